@@ -0,0 +1,163 @@
+# coding: utf-8
+import json
+import os
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+
+# Status normalizados de um job de lote (cada backend traduz os seus para estes)
+STATUS_EM_ANDAMENTO = "em_andamento"
+STATUS_CONCLUIDO = "concluido"
+STATUS_FALHOU = "falhou"
+
+
+def escrever_jsonl(caminho, linhas):
+    """Grava uma lista de dicionários como JSONL. Retorna quantas linhas foram gravadas."""
+    total = 0
+    with open(caminho, 'w', encoding='utf-8') as f:
+        for linha in linhas:
+            f.write(json.dumps(linha, ensure_ascii=False) + "\n")
+            total += 1
+    return total
+
+
+def ler_jsonl(caminho):
+    """Lê um arquivo JSONL, ignorando linhas em branco."""
+    with open(caminho, 'r', encoding='utf-8') as f:
+        return [json.loads(linha) for linha in f if linha.strip()]
+
+
+def salvar_manifesto(diretorio, manifesto):
+    """O manifesto guarda tudo que a importação precisa (amostra, jobs, pedidos)."""
+    caminho = os.path.join(diretorio, "manifesto.json")
+    with open(caminho, 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+    return caminho
+
+
+def carregar_manifesto(diretorio):
+    with open(os.path.join(diretorio, "manifesto.json"), 'r', encoding='utf-8') as f:
+        manifesto = json.load(f)
+    # JSON transforma as chaves int das competências em str; desfaz isso
+    for redacao in manifesto.get("amostra", []):
+        comps = redacao["ground_truth"]["competencias"]
+        redacao["ground_truth"]["competencias"] = {int(k): v for k, v in comps.items()}
+    return manifesto
+
+
+class BatchBackend(ABC):
+    """
+    Interface de um endpoint de processamento em lote:
+    submit (envia o JSONL) -> poll (consulta o status) -> download (baixa os resultados).
+    """
+    nome = "abstrato"
+
+    @abstractmethod
+    def submit(self, caminho_jsonl):
+        """Envia o arquivo de pedidos (formato nativo do provedor). Retorna o job_id."""
+        pass
+
+    @abstractmethod
+    def poll(self, job_id):
+        """Retorna um dos STATUS_* normalizados."""
+        pass
+
+    @abstractmethod
+    def download(self, job_id, caminho_saida):
+        """Grava os resultados (JSONL nativo) em caminho_saida."""
+        pass
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """
+    Batch API da OpenAI (/v1/batches): ~50% mais barata, janela de até 24h.
+    """
+    nome = "openai"
+
+    STATUS_OPENAI = {
+        "validating": STATUS_EM_ANDAMENTO,
+        "in_progress": STATUS_EM_ANDAMENTO,
+        "finalizing": STATUS_EM_ANDAMENTO,
+        "cancelling": STATUS_EM_ANDAMENTO,
+        "completed": STATUS_CONCLUIDO,
+        "failed": STATUS_FALHOU,
+        "expired": STATUS_FALHOU,
+        "cancelled": STATUS_FALHOU,
+    }
+
+    def __init__(self, client, completion_window="24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, caminho_jsonl):
+        with open(caminho_jsonl, 'rb') as f:
+            arquivo = self.client.files.create(file=f, purpose="batch")
+        job = self.client.batches.create(
+            input_file_id=arquivo.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self.completion_window,
+        )
+        return job.id
+
+    def poll(self, job_id):
+        job = self.client.batches.retrieve(job_id)
+        return self.STATUS_OPENAI.get(job.status, STATUS_EM_ANDAMENTO)
+
+    def download(self, job_id, caminho_saida):
+        job = self.client.batches.retrieve(job_id)
+        with open(caminho_saida, 'w', encoding='utf-8') as f:
+            # Pedidos que falharam vão para o error_file; juntamos os dois
+            for file_id in (job.output_file_id, job.error_file_id):
+                if file_id:
+                    f.write(self.client.files.content(file_id).text)
+        return caminho_saida
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    Substituto local, baseado em arquivos, de um endpoint de lote.
+    O job é processado no primeiro poll, pedido a pedido, pelo próprio
+    provedor (answer_batch_request). Com um provedor offline, o fluxo
+    submit/poll/download inteiro roda sem rede.
+    """
+    nome = "local"
+
+    def __init__(self, provedor, diretorio="lotes_locais"):
+        self.provedor = provedor
+        self.diretorio = diretorio
+
+    def _pasta(self, job_id):
+        return os.path.join(self.diretorio, job_id)
+
+    def _gravar_status(self, job_id, status):
+        with open(os.path.join(self._pasta(job_id), "status.json"), 'w', encoding='utf-8') as f:
+            json.dump({"status": status, "atualizado_em": time.time()}, f)
+
+    def submit(self, caminho_jsonl):
+        job_id = f"local-{uuid.uuid4().hex[:12]}"
+        os.makedirs(self._pasta(job_id), exist_ok=True)
+        shutil.copyfile(caminho_jsonl, os.path.join(self._pasta(job_id), "input.jsonl"))
+        self._gravar_status(job_id, STATUS_EM_ANDAMENTO)
+        return job_id
+
+    def poll(self, job_id):
+        with open(os.path.join(self._pasta(job_id), "status.json"), 'r', encoding='utf-8') as f:
+            status = json.load(f)["status"]
+        if status != STATUS_EM_ANDAMENTO:
+            return status
+
+        try:
+            pedidos = ler_jsonl(os.path.join(self._pasta(job_id), "input.jsonl"))
+            resultados = (self.provedor.answer_batch_request(pedido) for pedido in pedidos)
+            escrever_jsonl(os.path.join(self._pasta(job_id), "output.jsonl"), resultados)
+            status = STATUS_CONCLUIDO
+        except Exception as e:
+            print(f"[LocalBatchBackend ERRO] Falha ao processar o job {job_id}: {e}")
+            status = STATUS_FALHOU
+        self._gravar_status(job_id, status)
+        return status
+
+    def download(self, job_id, caminho_saida):
+        shutil.copyfile(os.path.join(self._pasta(job_id), "output.jsonl"), caminho_saida)
+        return caminho_saida
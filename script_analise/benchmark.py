@@ -0,0 +1,193 @@
+# coding: utf-8
+"""
+Benchmark do harness de avaliação.
+
+Roda o mesmo pipeline do main.py (amostra -> prompts -> chamadas -> parse ->
+gravação -> métricas) com provedores reais, simulados (mock) ou gravados
+(replay) e registra:
+  - latência p50/p95/p99 das chamadas, por provedor e por competência;
+  - redações por minuto de ponta a ponta;
+  - tempo gasto em cada etapa (carregar prompt, chamada à API, parse do
+    JSON, gravação dos resultados...).
+
+Cada execução acrescenta um registro JSON em ARQUIVO_BENCHMARKS, para
+comparar versões do harness e configurações de provedores ao longo do tempo.
+
+Exemplos:
+  python benchmark.py --provedores mock --base-sintetica 2000 --n 2000
+  python benchmark.py --provedores mock --latencia-media 0.8 --taxa-erro 0.02
+  python benchmark.py --provedores replay --arquivo-replay evaluation_results.csv
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import tempfile
+import time
+
+import main
+import perf_stats
+import tracing
+
+# Arquivo (JSONL) onde cada execução do benchmark acrescenta seu registro
+ARQUIVO_BENCHMARKS = "benchmarks.jsonl"
+
+
+def gerar_base_sintetica(caminho, n_redacoes, semente=0, tamanho_texto=2500):
+    """Grava uma base no formato do base_dados.json com n redações e notas humanas sorteadas."""
+    rng = random.Random(semente)
+    palavras = ("sociedade", "educação", "direitos", "cidadania", "desafios", "brasil",
+                "políticas", "públicas", "tecnologia", "meio", "ambiente", "cultura")
+    redacoes = []
+    for i in range(n_redacoes):
+        texto = []
+        while sum(len(p) + 1 for p in texto) < tamanho_texto:
+            texto.append(rng.choice(palavras))
+        notas = [rng.choice((40, 80, 120, 160, 200)) for _ in range(5)]
+        redacoes.append({
+            "url": f"sintetica://{i}",
+            "tema_geral": f"Tema {i % 20}",
+            "fonte": "sintetica",
+            "texto_original_recuperado": " ".join(texto),
+            "correcoes": [{
+                "tipo": "Tradicional",
+                "nota_final": sum(notas),
+                "detalhes_competencias": [{"nota": nota, "observacao": ""} for nota in notas]
+            }]
+        })
+    with open(caminho, 'w', encoding='utf-8') as f:
+        json.dump(redacoes, f, ensure_ascii=False)
+    return caminho
+
+
+def versao_harness():
+    """Commit atual do repositório (para comparar versões do harness), ou None."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return None
+
+
+def exibir_relatorio(registro):
+    print("\n--- Benchmark do Harness ---")
+    print(f"Provedores: {registro['config']['provedores']} | Modo: {registro['config']['modo_avaliacao']} "
+          f"| {'async' if registro['config']['modo_async'] else 'sequencial'}")
+    print(f"Redações: {registro['n_redacoes']} | Chamadas: {registro['chamadas']} "
+          f"| Tempo total: {registro['tempo_total_s']:.2f}s")
+    print(f"Vazão: {registro['redacoes_por_minuto']:.1f} redações/min | "
+          f"{registro['chamadas_por_segundo']:.1f} chamadas/s")
+
+    latencias = registro["latencia_chamadas"]
+    print("\nLatência das chamadas (ms):")
+    for modelo, p in latencias["por_modelo"].items():
+        print(f"  {modelo}: p50 {1000 * p['p50_s']:.1f} | p95 {1000 * p['p95_s']:.1f} "
+              f"| p99 {1000 * p['p99_s']:.1f} | n={p['n']} | falhas={p['falhas']}")
+        for competencia, pc in sorted(latencias["por_competencia"][modelo].items()):
+            print(f"    {competencia}: p50 {1000 * pc['p50_s']:.1f} | p95 {1000 * pc['p95_s']:.1f} "
+                  f"| p99 {1000 * pc['p99_s']:.1f}")
+
+    print("\nTempo por etapa (soma entre threads, s):")
+    for nome, p in sorted(registro["etapas"].items(), key=lambda item: -item[1].get("total_s", 0)):
+        if p["n"]:
+            print(f"  {nome:<20} total {p['total_s']:.3f} | n={p['n']} | p50 {1000 * p['p50_s']:.3f}ms "
+                  f"| p99 {1000 * p['p99_s']:.3f}ms")
+
+
+def rodar_benchmark(args):
+    """Configura o main.py conforme os argumentos, roda uma execução instrumentada e devolve o registro."""
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as pasta:
+        if args.base_sintetica:
+            main.NOME_ARQUIVO_DB = gerar_base_sintetica(os.path.join(pasta, "base_sintetica.json"),
+                                                        args.base_sintetica, semente=args.semente)
+        elif args.base:
+            main.NOME_ARQUIVO_DB = args.base
+        main.PROVEDORES = args.provedores
+        main.MOCK_CONFIG = dict(main.MOCK_CONFIG, latencia=args.latencia, latencia_media=args.latencia_media,
+                                taxa_erro=args.taxa_erro, semente=args.semente)
+        if args.arquivo_replay:
+            main.ARQUIVO_REPLAY = args.arquivo_replay
+        main.FORMATOS_SAIDA = args.formatos
+        # Permite rodar o benchmark de fora da pasta script_analise
+        if not os.path.isdir(main.DIRETORIO_PROMPTS):
+            main.DIRETORIO_PROMPTS = os.path.join(os.path.dirname(os.path.abspath(main.__file__)), main.DIRETORIO_PROMPTS)
+        # Benchmark mede o harness: cache e diário ficam numa pasta temporária
+        main.USAR_CACHE = args.cache
+        main.ARQUIVO_CACHE = os.path.join(pasta, "cache.sqlite")
+        main.DIRETORIO_EXECUCOES = os.path.join(pasta, "execucoes")
+
+        recorder = perf_stats.ativar()
+        if args.trace:
+            tracing.ativar(args.trace)
+        saida = io.StringIO()
+        inicio = time.perf_counter()
+        try:
+            # A saída do main.py (progresso, notas por redação) não interessa aqui
+            with contextlib.nullcontext() if args.verboso else contextlib.redirect_stdout(saida):
+                main.run_evaluation_batch(args.n, os.path.join(pasta, "resultados.csv"),
+                                          modo_async=not args.sequencial, modo_avaliacao=args.modo,
+                                          semente=args.semente)
+        finally:
+            tempo_total = time.perf_counter() - inicio
+            perf_stats.desativar()
+            tracing.desativar()
+
+    resumo = recorder.resumo()
+    n_chamadas = resumo["latencia_chamadas"]["geral"].get("n", 0)
+    tempo_execucao = resumo["etapas"].get("execucao", {}).get("total_s", tempo_total)
+    n_redacoes = resumo["contadores"].get("redacoes", 0)
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "versao_harness": versao_harness(),
+        "descricao": args.descricao,
+        "trace": args.trace,
+        "config": {
+            "provedores": args.provedores,
+            "modo_avaliacao": args.modo,
+            "modo_async": not args.sequencial,
+            "formatos_saida": args.formatos,
+            "cache": args.cache,
+            "mock": main.MOCK_CONFIG if args.provedores == "mock" else None,
+            "concorrencia": {"gemini": main.CONCORRENCIA_GEMINI, "openai": main.CONCORRENCIA_OPENAI},
+        },
+        "n_redacoes": n_redacoes,
+        "chamadas": n_chamadas,
+        "tempo_total_s": tempo_total,
+        "tempo_execucao_s": tempo_execucao,
+        "redacoes_por_minuto": 60.0 * n_redacoes / tempo_total if tempo_total else 0.0,
+        "chamadas_por_segundo": n_chamadas / tempo_execucao if tempo_execucao else 0.0,
+        **resumo,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do harness de avaliação (latência, vazão e etapas).")
+    parser.add_argument("--provedores", choices=["mock", "replay", "local", "cascata", "reais"], default="mock")
+    parser.add_argument("--n", type=int, default=main.N_AMOSTRAS_TESTE, help="Quantidade de redações da amostra.")
+    parser.add_argument("--modo", choices=["por_competencia", "completo"], default=main.MODO_AVALIACAO)
+    parser.add_argument("--sequencial", action="store_true", help="Usa o loop sequencial em vez do modo async.")
+    parser.add_argument("--base", help="Base de redações (padrão: NOME_ARQUIVO_DB do main.py).")
+    parser.add_argument("--base-sintetica", type=int, metavar="N",
+                        help="Gera uma base temporária com N redações sintéticas (não precisa do base_dados.json).")
+    parser.add_argument("--latencia", default="lognormal", help="Distribuição de latência do mock.")
+    parser.add_argument("--latencia-media", type=float, default=0.0, help="Latência média do mock (s).")
+    parser.add_argument("--taxa-erro", type=float, default=0.0, help="Fração de chamadas do mock que falham.")
+    parser.add_argument("--arquivo-replay", help="CSV ou journal.jsonl gravado (provedores replay).")
+    parser.add_argument("--formatos", nargs="+", default=["csv"], help="Formatos de saída gravados (csv jsonl parquet).")
+    parser.add_argument("--cache", action="store_true", help="Liga o cache de respostas (temporário).")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--descricao", default="", help="Texto livre gravado junto do registro.")
+    parser.add_argument("--saida", default=ARQUIVO_BENCHMARKS, help="Arquivo JSONL onde o registro é acrescentado.")
+    parser.add_argument("--trace", metavar="ARQUIVO",
+                        help="Grava também um trace (chrome://tracing / Perfetto) com os spans de cada tarefa.")
+    parser.add_argument("--verboso", action="store_true", help="Mostra a saída normal do main.py.")
+    args = parser.parse_args()
+
+    registro = rodar_benchmark(args)
+    exibir_relatorio(registro)
+    with open(args.saida, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+    print(f"\n[OK] Registro acrescentado em '{args.saida}'")
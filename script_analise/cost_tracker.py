@@ -0,0 +1,120 @@
+# coding: utf-8
+import threading
+from collections import defaultdict
+
+# Endpoints de lote (ex: OpenAI Batch API) cobram metade do preço interativo
+FATOR_PRECO_LOTE = 0.5
+
+
+def custo_chamada(precos, modelo, uso):
+    """
+    Custo (USD) de uma chamada a partir do uso de tokens e da tabela de preços
+    (USD por milhão de tokens: "entrada", "saida" e, opcional, "entrada_cache").
+    Tokens de entrada servidos do cache do provedor ("tokens_cache", já incluídos
+    em "tokens_entrada") pagam o preço de entrada_cache. Sem preço para o modelo,
+    o custo é 0.
+    """
+    preco = precos.get(modelo)
+    if not preco or not uso:
+        return 0.0
+    tokens_cache = uso.get("tokens_cache", 0) or 0
+    tokens_entrada = (uso.get("tokens_entrada", 0) or 0) - tokens_cache
+    custo = (tokens_entrada * preco["entrada"]
+             + tokens_cache * preco.get("entrada_cache", preco["entrada"])
+             + (uso.get("tokens_saida", 0) or 0) * preco["saida"]) / 1_000_000
+    if uso.get("lote"):
+        custo *= FATOR_PRECO_LOTE
+    return custo
+
+
+class CostTracker:
+    """
+    Totais de custo da execução, ao vivo, por modelo, competência e redação,
+    e controle do orçamento (--max-cost).
+
+    Antes de cada chamada, reservar() soma o custo estimado dela ao que já foi
+    gasto e ao que está em andamento. Se só não cabe por causa das chamadas em
+    andamento, espera elas terminarem; se não cabe nem assim, a chamada não é
+    feita. Depois, liberar() desfaz a reserva e registrar() lança o custo real.
+    """
+    def __init__(self, precos, orcamento=None):
+        self.precos = precos
+        self.orcamento = orcamento
+        self._cond = threading.Condition()
+        self.gasto = 0.0
+        self.reservado = 0.0
+        self.por_modelo = defaultdict(float)
+        self.por_competencia = defaultdict(float)
+        self.por_redacao = defaultdict(float)
+        self.tarefas_puladas = 0
+        self._modelos_sem_preco = set()
+        # Cache de prefixo dos provedores, por modelo: tokens de entrada (total e em cache),
+        # economia e latência das chamadas com e sem acerto no cache
+        self.cache_prefixo = defaultdict(lambda: {"tokens_entrada": 0, "tokens_cache": 0, "economia": 0.0,
+                                                  "chamadas_com_cache": 0, "latencia_com_cache": 0.0,
+                                                  "chamadas_sem_cache": 0, "latencia_sem_cache": 0.0})
+
+    def custo(self, modelo, uso):
+        if modelo not in self.precos and modelo not in self._modelos_sem_preco:
+            self._modelos_sem_preco.add(modelo)
+            print(f"[CostTracker AVISO] Modelo '{modelo}' sem preço em PRECOS_POR_MILHAO; custo contado como 0.")
+        return custo_chamada(self.precos, modelo, uso)
+
+    def reservar(self, custo_estimado):
+        """True se ainda cabe uma chamada de 'custo_estimado' no orçamento (e a reserva)."""
+        with self._cond:
+            if self.orcamento is not None:
+                while (self.reservado > 0 and self.gasto + custo_estimado <= self.orcamento
+                       and self.gasto + self.reservado + custo_estimado > self.orcamento):
+                    self._cond.wait()
+                if self.gasto + self.reservado + custo_estimado > self.orcamento:
+                    self.tarefas_puladas += 1
+                    if self.tarefas_puladas == 1:
+                        print(f"[ORÇAMENTO] Orçamento esgotado: limite de ${self.orcamento:.4f} atingido "
+                              f"(gasto ${self.gasto:.4f}). Nenhuma chamada nova será feita.")
+                    return False
+            self.reservado += custo_estimado
+            return True
+
+    def liberar(self, custo_estimado):
+        with self._cond:
+            self.reservado = max(0.0, self.reservado - custo_estimado)
+            self._cond.notify_all()
+
+    def registrar(self, modelo, redacao_id, competencia, custo, uso=None):
+        """Lança o custo real de uma chamada; com 'uso', conta também o cache de prefixo."""
+        with self._cond:
+            self.gasto += custo
+            self.por_modelo[modelo] += custo
+            self.por_competencia[(modelo, competencia)] += custo
+            self.por_redacao[(modelo, redacao_id)] += custo
+            # Respostas do cache local não passaram pelo provedor: não entram na conta do prefixo
+            if uso and not uso.get("em_cache") and uso.get("tokens_entrada"):
+                prefixo = self.cache_prefixo[modelo]
+                prefixo["tokens_entrada"] += uso["tokens_entrada"]
+                prefixo["tokens_cache"] += uso.get("tokens_cache", 0)
+                # Economia: o que a chamada custaria sem nenhum token em cache (só para modelos com
+                # preço na tabela; uma cascata, por exemplo, traz o custo já somado das etapas)
+                if modelo in self.precos:
+                    prefixo["economia"] += custo_chamada(self.precos, modelo, dict(uso, tokens_cache=0)) - custo
+                sufixo = "com_cache" if uso.get("tokens_cache") else "sem_cache"
+                prefixo[f"chamadas_{sufixo}"] += 1
+                prefixo[f"latencia_{sufixo}"] += uso.get("latencia_s") or 0.0
+
+    def registrar_extra(self, modelo, custo):
+        """Custo que chegou depois da chamada (ex: a cópia de um hedge que perdeu): entra no total do modelo."""
+        with self._cond:
+            self.gasto += custo
+            self.por_modelo[modelo] += custo
+
+    def resumo(self):
+        with self._cond:
+            return {
+                "gasto": self.gasto,
+                "orcamento": self.orcamento,
+                "tarefas_puladas": self.tarefas_puladas,
+                "por_modelo": dict(self.por_modelo),
+                "por_competencia": dict(self.por_competencia),
+                "por_redacao": dict(self.por_redacao),
+                "cache_prefixo": {modelo: dict(valores) for modelo, valores in self.cache_prefixo.items()},
+            }
@@ -1,6 +1,60 @@
 import json
+import math
 import pandas as pd
 import random
+import statistics
+from collections import defaultdict
+from sharding import hash_estavel, shard_da_redacao
+
+# Faixas da nota final humana usadas como estrato "faixa_nota": [0, 400), [400, 600), [600, 800), [800, 1000]
+LIMITES_FAIXAS_NOTA = (400, 600, 800)
+ESTRATOS_VALIDOS = ("fonte", "tema_geral", "faixa_nota")
+
+
+def faixa_nota(nota_final):
+    """Rótulo da faixa de nota (ex: "600-799") de uma nota final do ENEM."""
+    limites = (0,) + LIMITES_FAIXAS_NOTA + (1001,)
+    for inferior, superior in zip(limites, limites[1:]):
+        if nota_final < superior:
+            return f"{inferior}-{min(superior - 1, 1000)}"
+    return f"{limites[-2]}-1000"
+
+
+def alocar_amostra(tamanhos, n, desvios=None):
+    """
+    Divide 'n' entre os estratos de 'tamanhos' (quantas redações cada um tem).
+    Sem 'desvios', alocação proporcional (n_h ~ N_h); com eles, alocação de Neyman
+    (n_h ~ N_h * S_h), que põe mais redações onde a nota varia mais.
+    Cada estrato recebe ao menos 1 redação quando n dá para todos, e nunca mais do
+    que tem; as sobras são redistribuídas pelos maiores restos. Retorna uma lista de n_h.
+    """
+    alocacao = [0] * len(tamanhos)
+    if n >= len(tamanhos):
+        alocacao = [min(1, tamanho) for tamanho in tamanhos]
+    restante = n - sum(alocacao)
+    while restante > 0:
+        abertos = [h for h, tamanho in enumerate(tamanhos) if alocacao[h] < tamanho]
+        if not abertos:
+            break
+        fatores = {h: tamanhos[h] * (desvios[h] if desvios else 1.0) for h in abertos}
+        if not any(fatores.values()):
+            # Estratos restantes sem variação (ex: uma redação só): divide pelo tamanho
+            fatores = {h: float(tamanhos[h]) for h in abertos}
+        total = sum(fatores.values())
+        cotas = {h: restante * fator / total for h, fator in fatores.items()}
+        extras = {h: min(math.floor(cota), tamanhos[h] - alocacao[h]) for h, cota in cotas.items()}
+        sobra = restante - sum(extras.values())
+        # Maiores restos primeiro, entre os estratos que ainda têm redações
+        for h in sorted(abertos, key=lambda h: cotas[h] - math.floor(cotas[h]), reverse=True):
+            if sobra == 0:
+                break
+            if alocacao[h] + extras[h] < tamanhos[h]:
+                extras[h] += 1
+                sobra -= 1
+        for h, extra in extras.items():
+            alocacao[h] += extra
+        restante = n - sum(alocacao)
+    return alocacao
 
 class DataLoader:
     def __init__(self, json_path):
@@ -29,17 +83,11 @@ class DataLoader:
         if self.data:
             print(f"Dataset carregado com sucesso. Total de redações: {len(self.data)}")
 
-    def get_sample(self, n=10, tipo_correcao='Tradicional'):
+    def _candidatos(self, tipo_correcao):
         """
-        Retorna uma amostra aleatória de 'n' redações que tenham 
-        a correção humana (tipo_correcao).
+        Lista de pares (redacao, correcao) que têm a correção humana
+        (tipo_correcao) com as 5 competências detalhadas.
         """
-        if not self.data:
-            print("Nenhum dado carregado. Abortando get_sample.")
-            return []
-            
-        amostra_valida = []
-        
         # Filtra redações que possuem a correção que queremos (Humana)
         candidatos = []
         for redacao in self.data:
@@ -53,20 +101,16 @@ class DataLoader:
                     if correcao.get('detalhes_competencias') and len(correcao.get('detalhes_competencias')) == 5:
                         candidatos.append((redacao, correcao))
                         break # Pega a primeira correção 'Tradicional' que encontrar
-        
-        if not candidatos:
-            print(f"Erro: Nenhuma redação com correção '{tipo_correcao}' e 5 competências foi encontrada.")
-            return []
+        return candidatos
 
-        if len(candidatos) < n:
-            print(f"Aviso: Pediu {n} amostras, mas só {len(candidatos)} encontradas com correção '{tipo_correcao}' e 5 competências.")
-            n = len(candidatos)
-            
-        amostra_aleatoria = random.sample(candidatos, n)
-        
+    def _preparar_amostra(self, pares, pesos=None):
+        """
+        Converte pares (redacao, correcao) no formato {input, ground_truth} usado pelo main.py.
+        Com 'pesos' ({url: peso}), cada item leva também o seu peso amostral ("peso").
+        """
         # Prepara os dados de entrada e o ground truth
         amostra_final = []
-        for redacao, correcao in amostra_aleatoria:
+        for redacao, correcao in pares:
             input_data = {
                 "id": redacao.get('url'), # Usando URL como ID único
                 "tema": redacao.get('tema_geral'),
@@ -102,11 +146,122 @@ class DataLoader:
                     "input": input_data,
                     "ground_truth": ground_truth
                 })
+                if pesos is not None:
+                    amostra_final[-1]["peso"] = pesos.get(input_data["id"], 1.0)
             else:
                 print(f"Aviso: Redação {input_data['id']} pulada por não ter 5 competências detalhadas.")
 
         return amostra_final
 
+    def _estrato(self, redacao, correcao, estratos):
+        valores = []
+        for chave in estratos:
+            if chave == "faixa_nota":
+                valores.append(faixa_nota(correcao.get('nota_final') or 0))
+            else:
+                valores.append(str(redacao.get(chave) or "?"))
+        return tuple(valores)
+
+    def get_sample(self, n=10, tipo_correcao='Tradicional', estratos=None, alocacao="proporcional", semente=None):
+        """
+        Retorna uma amostra aleatória de 'n' redações que tenham 
+        a correção humana (tipo_correcao). Com n=None, todas elas.
+        Com 'semente', o sorteio é reproduzível.
+        Com 'estratos' (ex: ["fonte", "faixa_nota"]; ver ESTRATOS_VALIDOS), a amostra é
+        estratificada: 'n' é dividido entre os estratos por alocação "proporcional" ou
+        "neyman" (ver alocar_amostra) e cada redação leva o peso amostral N_h / n_h
+        ("peso"), para as métricas ponderadas estimarem as do corpus inteiro.
+        """
+        if not self.data:
+            print("Nenhum dado carregado. Abortando get_sample.")
+            return []
+            
+        candidatos = self._candidatos(tipo_correcao)
+        
+        if not candidatos:
+            print(f"Erro: Nenhuma redação com correção '{tipo_correcao}' e 5 competências foi encontrada.")
+            return []
+
+        if n is None:
+            n = len(candidatos)
+        if len(candidatos) < n:
+            print(f"Aviso: Pediu {n} amostras, mas só {len(candidatos)} encontradas com correção '{tipo_correcao}' e 5 competências.")
+            n = len(candidatos)
+            
+        rng = random.Random(semente)
+        if not estratos:
+            amostra_aleatoria = rng.sample(candidatos, n)
+            return self._preparar_amostra(amostra_aleatoria)
+        return self._amostra_estratificada(candidatos, n, estratos, alocacao, rng)
+
+    def _amostra_estratificada(self, candidatos, n, estratos, alocacao, rng):
+        invalidos = [chave for chave in estratos if chave not in ESTRATOS_VALIDOS]
+        if invalidos:
+            raise ValueError(f"Estratos desconhecidos: {invalidos} (use {', '.join(ESTRATOS_VALIDOS)})")
+        if alocacao not in ("proporcional", "neyman"):
+            raise ValueError(f"Alocação desconhecida: '{alocacao}' (use proporcional ou neyman)")
+
+        grupos = defaultdict(list)
+        for redacao, correcao in candidatos:
+            grupos[self._estrato(redacao, correcao, estratos)].append((redacao, correcao))
+        # Ordem fixa dos estratos: com a mesma semente, a mesma amostra
+        chaves = sorted(grupos)
+        tamanhos = [len(grupos[chave]) for chave in chaves]
+        desvios = None
+        if alocacao == "neyman":
+            # Desvio-padrão da nota final humana dentro de cada estrato
+            desvios = [statistics.pstdev([correcao.get('nota_final') or 0 for _, correcao in grupos[chave]])
+                       for chave in chaves]
+        n_por_estrato = alocar_amostra(tamanhos, n, desvios)
+
+        pares, pesos = [], {}
+        for chave, tamanho, n_h in zip(chaves, tamanhos, n_por_estrato):
+            for redacao, correcao in rng.sample(grupos[chave], n_h):
+                pares.append((redacao, correcao))
+                pesos[redacao.get('url')] = tamanho / n_h
+        # Embaralha: a ordem de avaliação (e os primeiros lotes da amostragem sequencial) não segue os estratos
+        rng.shuffle(pares)
+
+        vazios = sum(1 for n_h in n_por_estrato if n_h == 0)
+        print(f"Amostra estratificada por {', '.join(estratos)} ({alocacao}): {len(chaves)} estratos, "
+              f"{len(pares)} redações" + (f" ({vazios} estratos sem nenhuma redação sorteada)" if vazios else ""))
+        return self._preparar_amostra(pares, pesos)
+
+    def get_shard(self, indice, n_shards, n=None, tipo_correcao='Tradicional'):
+        """
+        Retorna as redações do shard 'indice' (0 a n_shards-1). Cada redação vai para
+        o shard dado por um hash estável da sua URL, então processos ou máquinas
+        diferentes, com a mesma base, dividem as redações sem sobreposição.
+        Com 'n', a amostra global são as n redações de menor hash (a mesma em todos
+        os shards) e cada shard fica com a sua parte; com n=None, o corpus inteiro.
+        """
+        if not self.data:
+            print("Nenhum dado carregado. Abortando get_shard.")
+            return []
+
+        candidatos = self._candidatos(tipo_correcao)
+        if n is not None and n < len(candidatos):
+            # Sal diferente do usado na divisão, para a amostra não pender para nenhum shard
+            candidatos = sorted(candidatos, key=lambda par: hash_estavel(par[0].get('url'), sal="amostra:"))[:n]
+        pares = [par for par in candidatos if shard_da_redacao(par[0].get('url'), n_shards) == indice]
+        return self._preparar_amostra(pares)
+
+    def get_by_ids(self, ids, tipo_correcao='Tradicional', pesos=None):
+        """
+        Retorna as redações com os IDs (URLs) pedidos, na mesma ordem.
+        Usado para recarregar exatamente a mesma amostra ao retomar uma execução
+        (com 'pesos', os pesos amostrais de uma amostra estratificada).
+        """
+        if not self.data:
+            print("Nenhum dado carregado. Abortando get_by_ids.")
+            return []
+
+        por_id = {redacao.get('url'): (redacao, correcao) for redacao, correcao in self._candidatos(tipo_correcao)}
+        faltando = [redacao_id for redacao_id in ids if redacao_id not in por_id]
+        if faltando:
+            print(f"Aviso: {len(faltando)} redações da amostra original não foram encontradas no dataset.")
+        return self._preparar_amostra([por_id[redacao_id] for redacao_id in ids if redacao_id in por_id], pesos)
+
 # Exemplo de como usar (para testar se funciona)
 if __name__ == "__main__":
     # Assumindo que seu JSON está no mesmo diretório
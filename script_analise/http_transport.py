@@ -0,0 +1,210 @@
+# coding: utf-8
+import threading
+import time
+from importlib.util import find_spec
+
+try:
+    import httpx
+except ImportError:
+    # Versões recentes do SDK da OpenAI trocaram o httpx pelo httpx2 (mesma API)
+    import httpx2 as httpx
+
+import perf_stats
+
+# Conexões além da concorrência dos provedores (lotes, reconexões depois de um timeout)
+FOLGA_CONEXOES = 2
+
+
+class _CorpoMonitorado(httpx.SyncByteStream):
+    """
+    Corpo da resposta que avisa o transporte quando é fechado (a conexão volta ao pool)
+    e quando a leitura estoura o timeout (em streaming, a resposta chega aos poucos).
+    """
+    def __init__(self, corpo, ao_fechar, ao_timeout):
+        self._corpo = corpo
+        self._ao_fechar = ao_fechar
+        self._ao_timeout = ao_timeout
+        self._fechado = False
+
+    def __iter__(self):
+        try:
+            yield from self._corpo
+        except httpx.TimeoutException as e:
+            self._ao_timeout(e)
+            raise
+
+    def close(self):
+        try:
+            self._corpo.close()
+        finally:
+            if not self._fechado:
+                self._fechado = True
+                self._ao_fechar()
+
+
+class PooledTransport(httpx.BaseTransport):
+    """
+    Transporte HTTP de longa duração, compartilhado pelos provedores que falam com o
+    mesmo host (ex: as etapas OpenAI de uma cascata):
+      - um pool de conexões com keep-alive, do tamanho da soma das concorrências dos
+        provedores que o usam (reservar()), criado na primeira requisição e dimensionado
+        uma vez só (até ser fechado pelo último provedor);
+      - timeouts explícitos de conexão, leitura, escrita e espera por uma conexão livre;
+      - HTTP/2 opcional (exige o pacote h2; sem ele, segue em HTTP/1.1).
+
+    stats() mede a saturação do pool: requisições em voo (pico), quantas chegaram com
+    o pool cheio e quanto esperaram por uma conexão, conexões novas e handshakes TLS
+    (o que o keep-alive não conseguiu reaproveitar) e timeouts (inclusive os da leitura
+    do corpo, depois dos cabeçalhos).
+    """
+    def __init__(self, nome="http", timeout_conexao=5.0, timeout_leitura=120.0, timeout_pool=30.0,
+                 keepalive_s=90.0, http2=False):
+        self.nome = nome
+        if http2 and find_spec("h2") is None:
+            print(f"[PooledTransport AVISO] HTTP/2 pedido para '{nome}', mas o pacote h2 não está instalado "
+                  f"(pip install h2). Seguindo com HTTP/1.1.")
+            http2 = False
+        self.http2 = http2
+        self.keepalive_s = keepalive_s
+        self.timeout = httpx.Timeout(connect=timeout_conexao, read=timeout_leitura,
+                                     write=timeout_conexao, pool=timeout_pool)
+        self.max_conexoes = FOLGA_CONEXOES
+        self._interno_conexoes = 0
+        self._usuarios = 0
+        self._interno = None
+        self._lock = threading.Lock()
+        self._em_voo = 0
+        self.metricas = {"requisicoes": 0, "pico_em_voo": 0, "com_pool_cheio": 0, "conexoes_novas": 0,
+                         "handshakes_tls": 0, "timeouts": 0, "timeouts_pool": 0}
+        self._esperas = []
+        self._tempos_conexao = []
+
+    def reservar(self, conexoes):
+        """
+        Soma 'conexoes' (a concorrência de um provedor) ao tamanho do pool. Depois que o
+        pool é criado, o tamanho não muda mais: numa nova execução no mesmo processo, sem
+        que os provedores da anterior tenham sido fechados, as reservas não se acumulam.
+        """
+        with self._lock:
+            self._usuarios += 1
+            if self._interno is not None:
+                print(f"[PooledTransport AVISO] Pool HTTP '{self.nome}' já criado com {self._interno_conexoes} "
+                      f"conexões; mantido com esse tamanho (mais {conexoes} pedidas).")
+                return
+            self.max_conexoes += conexoes
+
+    def criar_cliente(self):
+        """Cliente httpx que usa este transporte e os timeouts dele (para o http_client dos SDKs)."""
+        return httpx.Client(transport=self, timeout=self.timeout)
+
+    def _transporte(self):
+        with self._lock:
+            if self._interno is None:
+                self._interno_conexoes = self.max_conexoes
+                limites = httpx.Limits(max_connections=self.max_conexoes,
+                                       max_keepalive_connections=self.max_conexoes,
+                                       keepalive_expiry=self.keepalive_s)
+                self._interno = httpx.HTTPTransport(limits=limites, http2=self.http2)
+            return self._interno
+
+    def _liberar(self):
+        with self._lock:
+            self._em_voo -= 1
+
+    def _contar_timeout(self, erro):
+        with self._lock:
+            self.metricas["timeouts_pool" if isinstance(erro, httpx.PoolTimeout) else "timeouts"] += 1
+
+    def handle_request(self, request):
+        transporte = self._transporte()
+        inicio = time.perf_counter()
+        with self._lock:
+            self._em_voo += 1
+            self.metricas["requisicoes"] += 1
+            self.metricas["pico_em_voo"] = max(self.metricas["pico_em_voo"], self._em_voo)
+            if self._em_voo > self._interno_conexoes:
+                self.metricas["com_pool_cheio"] += 1
+
+        # Eventos do httpcore: o primeiro marca o fim da espera por uma conexão do pool
+        # (ou é a abertura de uma conexão nova, ou já é o envio numa conexão reaproveitada)
+        marcas = {}
+
+        def rastrear(evento, info):
+            agora = time.perf_counter()
+            if "espera" not in marcas:
+                marcas["espera"] = agora - inicio
+            if evento == "connection.connect_tcp.started":
+                marcas["conexao"] = agora
+            elif evento == "connection.connect_tcp.complete":
+                with self._lock:
+                    self.metricas["conexoes_novas"] += 1
+            elif evento == "connection.start_tls.complete":
+                with self._lock:
+                    self.metricas["handshakes_tls"] += 1
+                    self._tempos_conexao.append(agora - marcas.get("conexao", agora))
+
+        request.extensions = dict(request.extensions, trace=rastrear)
+        try:
+            resposta = transporte.handle_request(request)
+        except httpx.TimeoutException as e:
+            self._liberar()
+            self._contar_timeout(e)
+            raise
+        except BaseException:
+            self._liberar()
+            raise
+        finally:
+            with self._lock:
+                self._esperas.append(marcas.get("espera", time.perf_counter() - inicio))
+        # A conexão só volta ao pool quando o corpo da resposta é lido e fechado
+        resposta.stream = _CorpoMonitorado(resposta.stream, self._liberar, self._contar_timeout)
+        return resposta
+
+    def stats(self):
+        """Tamanho do pool, saturação, reuso de conexões e timeouts."""
+        with self._lock:
+            m = dict(self.metricas)
+            esperas = perf_stats.percentis(self._esperas)
+            conexao = perf_stats.percentis(self._tempos_conexao)
+        requisicoes = max(1, m["requisicoes"])
+        return {
+            "pool": self.nome,
+            "pool_conexoes": self._interno_conexoes or self.max_conexoes,
+            "http2": self.http2,
+            "requisicoes": m["requisicoes"],
+            "pico_em_voo": m["pico_em_voo"],
+            "fracao_pool_cheio": m["com_pool_cheio"] / requisicoes,
+            "espera_pool_p95_ms": 1000 * esperas.get("p95_s", 0.0),
+            "conexoes_novas": m["conexoes_novas"],
+            "reuso_conexoes": 1 - m["conexoes_novas"] / requisicoes if m["requisicoes"] else 0.0,
+            "handshake_tls_medio_ms": 1000 * conexao.get("media_s", 0.0),
+            "timeouts": m["timeouts"],
+            "timeouts_pool": m["timeouts_pool"],
+        }
+
+    def close(self):
+        # Cada cliente criado fecha o transporte ao ser fechado: o pool só fecha com o último
+        with self._lock:
+            self._usuarios -= 1
+            if self._usuarios > 0 or self._interno is None:
+                return
+            interno, self._interno = self._interno, None
+            # A próxima execução dimensiona o pool de novo, com as reservas dela
+            self.max_conexoes = FOLGA_CONEXOES
+        interno.close()
+
+
+# Transportes compartilhados do processo, por nome (um por host de API)
+_compartilhados = {}
+_lock_compartilhados = threading.Lock()
+
+
+def transporte_compartilhado(nome, **config):
+    """
+    O PooledTransport 'nome' do processo, criado com 'config' na primeira vez
+    (os provedores do mesmo host dividem o pool, as conexões e as métricas).
+    """
+    with _lock_compartilhados:
+        if nome not in _compartilhados:
+            _compartilhados[nome] = PooledTransport(nome, **config)
+        return _compartilhados[nome]
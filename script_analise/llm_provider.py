@@ -1,29 +1,680 @@
 # coding: utf-8
 import os
 import json
+import math
+import random
+import time
+import datetime
+import statistics
+import threading
+import contextvars
 from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 import google.generativeai as genai
 from openai import OpenAI
+from rate_limiter import AdaptiveRateLimiter, estimar_tokens, is_rate_limit_error
+from retry_policy import CircuitBreaker, RespostaInvalida, RetryPolicy, is_retryable_error, retry_after_do_erro
+from batch_jobs import LocalBatchBackend, OpenAIBatchBackend
+from cost_tracker import custo_chamada
+from http_transport import PooledTransport
+from response_cache import hash_texto
+from result_sink import ler_resultados
+import perf_stats
+import tracing
+
+# llama-cpp-python é opcional: só é necessário para o LocalProvider
+try:
+    from llama_cpp import Llama, LlamaGrammar
+except ImportError:
+    Llama = None
+    LlamaGrammar = None
 
 # Carrega as variáveis de ambiente (GOOGLE_API_KEY, OPENAI_API_KEY) do arquivo .env
 load_dotenv()
 
-class AbstractLLMProvider(ABC):
+# Define o SCHEMA JSON que vamos FORÇAR na LLM
+# (Corresponde ao que definimos no planejamento)
+# A nota é o primeiro campo: em streaming, ela chega antes do raciocínio (ver ExtratorNotas)
+SCHEMA_COMPETENCIA = {
+    "type": "OBJECT",
+    "properties": {
+        "nota_atribuida": {"type": "NUMBER"},
+        "raciocinio_cot": {"type": "STRING"},
+        "justificativa_para_aluno": {"type": "STRING"}
+    },
+    "required": ["nota_atribuida", "raciocinio_cot", "justificativa_para_aluno"]
+}
+
+# Modo "completo": uma única chamada devolve os 5 blocos (c1 a c5) de uma vez
+SCHEMA_COMPLETO = {
+    "type": "OBJECT",
+    "properties": {f"c{comp_id}": SCHEMA_COMPETENCIA for comp_id in range(1, 6)},
+    "required": [f"c{comp_id}" for comp_id in range(1, 6)]
+}
+
+def validar_json(json_data, schema):
     """
-    Interface abstrata para provedores de LLM. 
-    Garante que todos os provedores tenham o método get_correction.
+    Confere (recursivamente) se o JSON tem todos os campos 'required' do schema.
+    Levanta RespostaInvalida (um ValueError retentável) no primeiro campo ausente.
+    """
+    if schema.get("type") != "OBJECT":
+        return
+    if not isinstance(json_data, dict):
+        raise RespostaInvalida(f"JSON retornado não é um objeto: {str(json_data)[:100]}")
+    for campo in schema.get("required", []):
+        if campo not in json_data:
+            raise RespostaInvalida(f"JSON retornado pela API não contém '{campo}'")
+        validar_json(json_data[campo], schema["properties"].get(campo, {}))
+
+def contar_blocos(schema):
+    """Quantas avaliações de competência uma resposta com esse schema carrega."""
+    if "nota_atribuida" in schema.get("properties", {}):
+        return 1
+    return len(schema.get("properties", {}))
+
+# Notas possíveis de uma competência no ENEM
+NOTAS_VALIDAS = (0, 40, 80, 120, 160, 200)
+
+def ajustar_nota(nota):
+    """Nota válida do ENEM (0, 40, ..., 200) mais próxima de 'nota' (no empate, a menor)."""
+    return min(NOTAS_VALIDAS, key=lambda valida: (abs(valida - float(nota)), valida))
+
+def agregar_notas(notas, agregacao="maioria"):
+    """
+    Nota de consenso de várias amostras da mesma competência, já ajustada às notas válidas.
+    "maioria": a nota mais votada (no empate, a empatada mais próxima da mediana dos votos);
+    "mediana": a mediana dos votos.
+    """
+    notas = [ajustar_nota(nota) for nota in notas]
+    mediana = statistics.median(notas)
+    if agregacao == "mediana":
+        return ajustar_nota(mediana)
+    if agregacao == "maioria":
+        contagem = Counter(notas)
+        mais_votos = max(contagem.values())
+        return min((nota for nota, votos in contagem.items() if votos == mais_votos),
+                   key=lambda nota: (abs(nota - mediana), nota))
+    raise ValueError(f"Agregação desconhecida: '{agregacao}' (use maioria ou mediana)")
+
+def _agregar_bloco(blocos, agregacao):
+    notas = [ajustar_nota(bloco["nota_atribuida"]) for bloco in blocos]
+    consenso = agregar_notas(notas, agregacao)
+    # Textos (raciocínio e justificativa) da amostra cuja nota é a de consenso (ou a mais próxima dela)
+    escolhido = min(zip(notas, blocos), key=lambda par: abs(par[0] - consenso))[1]
+    return dict(escolhido, nota_atribuida=consenso, concordancia=notas.count(consenso) / len(notas),
+                notas_candidatas=notas)
+
+def agregar_candidatos(candidatos, schema, agregacao="maioria"):
+    """
+    Junta as respostas de várias amostras da mesma chamada (self-consistency) numa só,
+    bloco a bloco: a nota é a de consenso (agregar_notas) e cada bloco ganha
+    "concordancia" (fração das amostras que deram a nota de consenso, um sinal de
+    confiança) e "notas_candidatas".
+    """
+    if contar_blocos(schema) == 1:
+        return _agregar_bloco(candidatos, agregacao)
+    return {campo: _agregar_bloco([candidato[campo] for candidato in candidatos], agregacao)
+            for campo in schema["properties"]}
+
+def schema_para_json_schema(schema):
+    """
+    Converte um schema no formato do Gemini (tipos em maiúsculas) em JSON Schema
+    padrão: o response_format da OpenAI (structured outputs, modo strict) e a gramática
+    da decodificação restrita do LocalProvider. A nota fica restrita às notas válidas
+    do ENEM, e os campos saem na ordem do schema, a nota primeiro (os dois geram as
+    propriedades nessa ordem; ver ExtratorNotas).
+    """
+    tipo = schema.get("type", "").lower()
+    if tipo != "object":
+        return {"type": tipo}
+    propriedades = schema.get("properties", {})
+    return {
+        "type": "object",
+        "properties": {
+            campo: ({"type": "integer", "enum": list(NOTAS_VALIDAS)} if campo == "nota_atribuida"
+                    else schema_para_json_schema(propriedades[campo]))
+            for campo in propriedades
+        },
+        "required": [campo for campo in propriedades if campo in schema.get("required", [])],
+        "additionalProperties": False
+    }
+
+# property_ordering (ordem dos campos na resposta) só existe nas versões mais novas do
+# google-ai-generativelanguage; sem ele, o Gemini gera os campos em ordem alfabética
+GEMINI_ORDENA_CAMPOS = "property_ordering" in genai.protos.Schema.meta.fields
+# O aviso de que falta property_ordering sai uma vez por processo, não a cada GeminiProvider
+_aviso_ordem_gemini = False
+
+def schema_para_gemini(schema):
+    """
+    O response_schema do Gemini com property_ordering em cada objeto, na ordem do
+    schema (a nota primeiro). Sem suporte no SDK instalado, o schema vai como está.
+    """
+    if not GEMINI_ORDENA_CAMPOS or "properties" not in schema:
+        return schema
+    propriedades = {campo: schema_para_gemini(valor) for campo, valor in schema["properties"].items()}
+    return dict(schema, properties=propriedades, property_ordering=list(propriedades))
+
+class ExtratorNotas:
+    """
+    Lê o JSON de uma resposta em streaming à medida que os pedaços chegam e avisa
+    'ao_receber_nota(bloco, nota)' assim que cada nota_atribuida termina de chegar,
+    antes do resto do JSON (bloco None no modo por competência, "c1" a "c5" no
+    completo). Por isso os schemas trazem a nota como primeiro campo: com ela no
+    começo, a nota sai logo no início da geração, e não depois do raciocínio.
+
+    O parser é incremental e mínimo: acompanha strings (com escapes), o aninhamento
+    dos objetos e a chave atual de cada nível, e só lê os números. Uma nota dentro de
+    um texto (ex: no raciocinio_cot) não é confundida com o campo.
+    """
+    def __init__(self, schema, ao_receber_nota=None):
+        self.completo = contar_blocos(schema) > 1
+        self.ao_receber_nota = ao_receber_nota
+        self.inicio = time.perf_counter()
+        # Nota de cada bloco e o tempo (s, desde o início da chamada) em que ela chegou
+        self.notas = {}
+        self.tempos = {}
+        self.reiniciar()
+
+    def reiniciar(self):
+        """Começa uma resposta nova (outra tentativa); as notas já entregues continuam valendo."""
+        self._pedacos = []
+        self._chaves = []
+        self._em_string = False
+        self._escape = False
+        self._lendo_numero = False
+        self._esperando_valor = False
+        self._token = []
+
+    def texto(self):
+        """O JSON recebido até agora."""
+        return "".join(self._pedacos)
+
+    def receber(self, pedaco):
+        self._pedacos.append(pedaco)
+        for c in pedaco:
+            if self._em_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._em_string = False
+                    if self._esperando_valor:
+                        self._esperando_valor = False
+                    elif self._chaves:
+                        self._chaves[-1] = "".join(self._token)
+                elif not self._esperando_valor:
+                    # Só os nomes das chaves interessam; o texto dos valores não é guardado
+                    self._token.append(c)
+                continue
+            if self._lendo_numero:
+                if c in "0123456789.eE+-":
+                    self._token.append(c)
+                    continue
+                self._lendo_numero = False
+                self._esperando_valor = False
+                self._numero_lido("".join(self._token))
+            if c == '"':
+                self._em_string = True
+                self._token = []
+            elif c in "{[":
+                self._chaves.append(None)
+                self._esperando_valor = False
+            elif c in "}]":
+                if self._chaves:
+                    self._chaves.pop()
+                self._esperando_valor = False
+            elif c == ":":
+                self._esperando_valor = True
+            elif c == ",":
+                self._esperando_valor = False
+            elif self._esperando_valor and (c.isdigit() or c == "-"):
+                self._lendo_numero = True
+                self._token = [c]
+
+    def _numero_lido(self, numero):
+        chaves = self._chaves
+        if self.completo:
+            if len(chaves) != 2 or chaves[1] != "nota_atribuida" or not str(chaves[0]).startswith("c"):
+                return
+            bloco = chaves[0]
+        elif chaves == ["nota_atribuida"]:
+            bloco = None
+        else:
+            return
+        try:
+            nota = float(numero)
+        except ValueError:
+            return
+        self.entregar(bloco, int(nota) if nota.is_integer() else nota)
+
+    def entregar(self, bloco, nota):
+        """
+        Entrega a nota de um bloco. Também usado pelos provedores que repassam as
+        notas dos internos (cascata, hedge), que chegam já prontas.
+        """
+        if bloco in self.notas and self.notas[bloco] == nota:
+            return
+        # Nota nova ou diferente da já entregue (ex: uma retentativa que deu outra nota, ou a
+        # cascata que subiu de etapa): o tempo passa a ser o da nota que valeu
+        self.notas[bloco] = nota
+        self.tempos[bloco] = time.perf_counter() - self.inicio
+        if self.ao_receber_nota is not None:
+            self.ao_receber_nota(bloco, nota)
+
+    def completar(self, json_data):
+        """Entrega, a partir da resposta final, as notas que não saíram durante o streaming."""
+        if self.completo:
+            for bloco, valor in json_data.items():
+                if isinstance(valor, dict) and "nota_atribuida" in valor:
+                    self.entregar(bloco, valor["nota_atribuida"])
+        elif "nota_atribuida" in json_data:
+            self.entregar(None, json_data["nota_atribuida"])
+
+    def tempo_primeira_nota(self):
+        return min(self.tempos.values()) if self.tempos else None
+
+class BaseLLMProvider(ABC):
+    """
+    O que todo provedor oferece ao main.py: get_correction (e a variante em streaming)
+    com o uso de cada chamada por thread, o modo lote genérico e as estatísticas do
+    resumo. Não faz chamadas: os provedores de API herdam de AbstractLLMProvider, e os
+    que só combinam outros (CascadeProvider, HedgedProvider) herdam direto daqui.
     """
-    def __init__(self, model_name):
+    # Reserva de tokens de saída por chamada (para o balde de TPM)
+    TOKENS_SAIDA_ESTIMADOS = 800
+    # Se o provedor implementa _request_correction_stream (ver get_correction_stream)
+    SUPORTA_STREAMING = False
+
+    def __init__(self, model_name, max_concurrency=4, n_candidatos=1):
         self.model_name = model_name
+        # Máximo de chamadas simultâneas a este provedor no modo async do main.py
+        self.max_concurrency = max_concurrency
+        # Amostras por chamada (self-consistency; ver AbstractLLMProvider)
+        self.n_candidatos = n_candidatos
+        # Uso (tokens, tentativas, latência) da chamada em andamento, por thread
+        self._uso_local = threading.local()
+        # Streaming: tempo até a primeira nota e latência total de cada chamada
+        self._lock_streaming = threading.Lock()
+        self._streaming = {"chamadas": 0, "nota_no_fim": 0, "tempo_ate_nota": [], "latencia": []}
         print(f"Inicializando provedor: {self.__class__.__name__} com modelo {self.model_name}")
 
-    @abstractmethod
-    def get_correction(self, system_prompt, redacao_texto):
+    def get_correction(self, system_prompt, redacao_texto, schema=SCHEMA_COMPETENCIA, competencia=None):
         """
         Método principal para obter a correção.
-        Deverá retornar um dicionário Python (parseado do JSON da LLM)
+        Retorna um dicionário Python (parseado do JSON da LLM)
         ou None em caso de falha.
+        Com schema=SCHEMA_COMPLETO, o dicionário traz os blocos c1 a c5.
+        'competencia' (1 a 5, ou None no modo completo) entra na chave do cache:
+        dois prompts de texto igual não compartilham respostas entre competências.
+
+        O dicionário traz também a chave "_uso": tokens de entrada, de saída e
+        de entrada servidos do cache do provedor (somados entre as tentativas),
+        número de tentativas, latência total (s) e se veio do cache de respostas.
+        O mesmo uso fica disponível em ultimo_uso(), inclusive quando a chamada falha.
+        """
+        uso = self._uso_local.atual = {
+            "tokens_entrada": 0, "tokens_saida": 0, "tokens_cache": 0,
+            "tentativas": 0, "latencia_s": 0.0, "em_cache": False,
+        }
+        self._uso_local.competencia = competencia
+        inicio = time.perf_counter()
+        json_data = self._obter_correcao(system_prompt, redacao_texto, schema, uso)
+        uso["latencia_s"] = time.perf_counter() - inicio
+        if json_data is None:
+            return None
+        return dict(json_data, _uso=uso)
+
+    def get_correction_stream(self, system_prompt, redacao_texto, schema=SCHEMA_COMPETENCIA, ao_receber_nota=None,
+                              competencia=None):
+        """
+        Variante de get_correction com a resposta em streaming, para a correção
+        interativa: 'ao_receber_nota(bloco, nota)' é chamada assim que cada
+        nota_atribuida chega (ver ExtratorNotas), e o dicionário completo (raciocínio
+        e justificativa) sai no fim, como no get_correction. Se uma retentativa (ou
+        a cascata, ao subir de etapa) mudar uma nota já entregue, a função é chamada
+        de novo com a nota nova.
+
+        Sem streaming possível (provedor sem suporte, n_candidatos > 1, em que a nota
+        é a de consenso, ou resposta do cache), as notas são entregues no fim.
+        "_uso" ganha "tempo_ate_nota_s" (do início da chamada até a primeira nota)
+        e "tempos_ate_nota" (por bloco).
+        """
+        extrator = ExtratorNotas(schema, ao_receber_nota)
+        self._uso_local.extrator = extrator if self.suporta_streaming() else None
+        try:
+            json_data = self.get_correction(system_prompt, redacao_texto, schema, competencia)
+        finally:
+            self._uso_local.extrator = None
+        uso = self.ultimo_uso()
+        if json_data is None:
+            return None
+        no_fim = not extrator.tempos
+        extrator.completar(json_data)
+        uso["tempo_ate_nota_s"] = extrator.tempo_primeira_nota()
+        uso["tempos_ate_nota"] = dict(extrator.tempos)
+        with self._lock_streaming:
+            self._streaming["chamadas"] += 1
+            self._streaming["nota_no_fim"] += no_fim
+            self._streaming["tempo_ate_nota"].append(uso["tempo_ate_nota_s"])
+            self._streaming["latencia"].append(uso["latencia_s"])
+        return json_data
+
+    def suporta_streaming(self):
+        """Se as notas podem sair antes do fim da resposta (ver get_correction_stream)."""
+        return self.SUPORTA_STREAMING and self.n_candidatos == 1
+
+    def extrator_atual(self):
+        """O ExtratorNotas da chamada em streaming desta thread (None fora do streaming)."""
+        return getattr(self._uso_local, "extrator", None)
+
+    @staticmethod
+    def _correcao_interna(provedor, system_prompt, redacao_texto, schema, competencia, ao_receber_nota=None):
+        """
+        get_correction de um provedor interno (cascata, hedge). Com 'ao_receber_nota'
+        (o provedor de fora está em streaming), a chamada é em streaming e as notas
+        do interno são repassadas assim que chegam.
+        """
+        if ao_receber_nota is None:
+            return provedor.get_correction(system_prompt, redacao_texto, schema, competencia)
+        return provedor.get_correction_stream(system_prompt, redacao_texto, schema, ao_receber_nota, competencia)
+
+    def streaming_stats(self):
+        """p50/p95 do tempo até a primeira nota e da latência total das chamadas em streaming ({} se não houve)."""
+        with self._lock_streaming:
+            if not self._streaming["chamadas"]:
+                return {}
+            return {
+                "chamadas": self._streaming["chamadas"],
+                "nota_no_fim": self._streaming["nota_no_fim"],
+                "tempo_ate_nota": perf_stats.percentis(self._streaming["tempo_ate_nota"]),
+                "latencia_total": perf_stats.percentis(self._streaming["latencia"]),
+            }
+
+    def ultimo_uso(self):
+        """Uso da última chamada feita por esta thread (ver get_correction)."""
+        return getattr(self._uso_local, "atual", None)
+
+    def competencia_atual(self):
+        """Competência da chamada em andamento nesta thread (ver get_correction)."""
+        return getattr(self._uso_local, "competencia", None)
+
+    # --- Modo lote (batch) ---
+    # A base usa um formato genérico de pedido/resultado, respondido pelo
+    # próprio get_correction. Provedores com endpoint de lote sobrescrevem
+    # estes métodos com o formato nativo da API.
+
+    def build_batch_request(self, custom_id, system_prompt, redacao_texto, schema=SCHEMA_COMPETENCIA, competencia=None):
+        """Monta uma linha do arquivo JSONL de job."""
+        return {
+            "custom_id": custom_id,
+            "system_prompt": system_prompt,
+            "redacao_texto": redacao_texto,
+            "schema": schema,
+            "competencia": competencia
+        }
+
+    def answer_batch_request(self, pedido):
+        """Responde uma linha de job pelo caminho interativo (usado pelo LocalBatchBackend)."""
+        json_data = self.get_correction(pedido["system_prompt"], pedido["redacao_texto"], pedido["schema"],
+                                        pedido.get("competencia"))
+        return {
+            "custom_id": pedido["custom_id"],
+            "resposta": json_data,
+            "erro": None if json_data else "Falha na chamada à API"
+        }
+
+    def parse_batch_result(self, resultado, schema=SCHEMA_COMPETENCIA):
+        """
+        Extrai o JSON da LLM de uma linha de resultado do lote.
+        Levanta exceção se aquele pedido falhou.
+        """
+        if resultado.get("erro"):
+            raise ValueError(resultado["erro"])
+        json_data = resultado["resposta"]
+        validar_json(json_data, schema)
+        return json_data
+
+    def batch_backend(self, diretorio):
+        """Backend de lote deste provedor. Sem endpoint próprio, usa o substituto local."""
+        return LocalBatchBackend(self, diretorio)
+
+    def provider_metrics(self):
+        """Métricas específicas do provedor para o resumo da execução (dict)."""
+        return {}
+
+    def modelos_cobrados(self):
+        """Modelos (nomes em PRECOS_POR_MILHAO) que uma chamada deste provedor pode usar."""
+        return [self.model_name]
+
+    def cache_key(self, system_prompt, redacao_texto, schema=SCHEMA_COMPETENCIA, competencia=None):
+        """Chave desta chamada no ResponseCache, ou None sem cache próprio (o dos provedores internos vale)."""
+        return None
+
+    def consistencia_stats(self):
+        """Concordância entre as amostras (self-consistency), ou None com uma amostra por chamada."""
+        return None
+
+    def provedores_internos(self):
+        """Provedores que fazem as chamadas por este (as etapas de uma cascata, por exemplo)."""
+        return []
+
+    def close(self):
+        """Libera recursos do provedor ao fim da execução (no-op por padrão)."""
+        pass
+
+    @abstractmethod
+    def _obter_correcao(self, system_prompt, redacao_texto, schema, uso):
+        """Correção da chamada em andamento (JSON da LLM sem "_uso") ou None; preenche 'uso'."""
+        pass
+
+class AbstractLLMProvider(BaseLLMProvider):
+    """
+    Interface abstrata para provedores de LLM. 
+    Garante que todos os provedores tenham o método get_correction.
+
+    get_correction cuida do que é comum a todos (cache, limite de taxa,
+    retentativas, disjuntor, tratamento de erro); cada provedor implementa
+    apenas _request_correction.
+    """
+    def __init__(self, model_name, max_concurrency=4, rpm=None, tpm=None, cache=None,
+                 retry_policy=None, circuit_breaker=None, n_candidatos=1, agregacao="maioria"):
+        super().__init__(model_name, max_concurrency, n_candidatos)
+        # Limitador de taxa próprio do provedor (RPM/TPM), adaptativo a erros 429
+        self.rate_limiter = AdaptiveRateLimiter(rpm=rpm, tpm=tpm)
+        # Retentativas (backoff exponencial com jitter) e disjuntor do provedor
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        # Cache persistente de respostas (ResponseCache) ou None para desligar
+        self.cache = cache
+        # Configuração de geração enviada à API; entra na chave do cache
+        self.generation_config = {}
+        # Self-consistency: amostras pedidas por chamada (numa única requisição, onde a API
+        # permite) e como a nota delas é agregada ("maioria" ou "mediana")
+        if agregacao not in ("maioria", "mediana"):
+            raise ValueError(f"Agregação desconhecida: '{agregacao}' (use maioria ou mediana)")
+        self.agregacao = agregacao
+        self._lock_consistencia = threading.Lock()
+        self._consistencia = {"blocos": 0, "soma_concordancia": 0.0, "unanimes": 0, "candidatos_invalidos": 0}
+
+    def _registrar_tokens(self, entrada=0, saida=0, cache=0):
+        """
+        Provedores chamam logo após cada resposta da API (mesmo que o JSON venha
+        inválido: os tokens foram cobrados). 'cache' são tokens de entrada
+        servidos do cache do provedor, já incluídos em 'entrada'.
+        """
+        uso = self.ultimo_uso()
+        if uso is not None:
+            uso["tokens_entrada"] += entrada or 0
+            uso["tokens_saida"] += saida or 0
+            uso["tokens_cache"] += cache or 0
+
+    def _obter_correcao(self, system_prompt, redacao_texto, schema, uso):
+        """Cache, limite de taxa, retentativas e disjuntor em volta do _request_correction."""
+        chave_cache = None
+        if self.cache is not None:
+            with tracing.span("cache_respostas"):
+                chave_cache = self.cache_key(system_prompt, redacao_texto, schema, self.competencia_atual())
+                json_data = self.cache.get(chave_cache)
+            if json_data is not None:
+                uso["em_cache"] = True
+                return json_data
+
+        tokens_estimados = (estimar_tokens(system_prompt) + estimar_tokens(redacao_texto)
+                            + self.TOKENS_SAIDA_ESTIMADOS * contar_blocos(schema) * self.n_candidatos)
+        nome = self.__class__.__name__
+        max_tentativas = self.retry_policy.max_tentativas
+
+        for tentativa in range(max_tentativas):
+            # Provedor pausado pelo disjuntor: espera aqui, sem gastar cota
+            with tracing.span("espera_disjuntor"):
+                liberado = self.circuit_breaker.aguardar()
+            if not liberado:
+                print(f"[{nome} FALHA] Disjuntor aberto: {self.model_name} dado como fora do ar. Chamada descartada.")
+                return None
+            with tracing.span("espera_limite_taxa"):
+                espera_taxa = self.rate_limiter.acquire(tokens_estimados)
+            if perf_stats.ativo() is not None:
+                perf_stats.ativo().registrar_etapa("espera_limite_taxa", espera_taxa)
+
+            uso["tentativas"] += 1
+            extrator = self.extrator_atual()
+            try:
+                with tracing.span("tentativa", tentativa=tentativa + 1):
+                    if extrator is None:
+                        json_data = self._request_correction(system_prompt, redacao_texto, schema)
+                    else:
+                        extrator.reiniciar()
+                        json_data = self._request_correction_stream(system_prompt, redacao_texto, schema, extrator)
+            except Exception as e:
+                retentavel = is_retryable_error(e)
+                if is_rate_limit_error(e):
+                    self.rate_limiter.report_rate_limit(retry_after_do_erro(e))
+                if retentavel and not is_rate_limit_error(e):
+                    if self.circuit_breaker.registrar_falha():
+                        print(f"[{nome} AVISO] Falhas seguidas demais. "
+                              f"Disjuntor aberto: {self.model_name} pausado.")
+                else:
+                    # 429 (fica com o limitador) ou erro fatal: o provedor está no ar e respondeu
+                    self.circuit_breaker.registrar_sucesso()
+
+                ultima = tentativa == max_tentativas - 1
+                if not retentavel or ultima:
+                    self.retry_policy.registrar(retentavel, esgotou=ultima)
+                    return None
+                espera = self.retry_policy.espera(tentativa)
+                self.retry_policy.registrar(retentavel, espera=espera)
+                print(f"[{nome} AVISO] Erro retentável ({type(e).__name__}). "
+                      f"Tentativa {tentativa + 2}/{max_tentativas} em {espera:.1f}s.")
+                with tracing.span("backoff", espera_s=round(espera, 3)):
+                    time.sleep(espera)
+                continue
+
+            self.circuit_breaker.registrar_sucesso()
+            self.rate_limiter.report_success()
+            if chave_cache is not None:
+                self.cache.put(chave_cache, json_data, nome, self.model_name)
+            return json_data
+
+    @staticmethod
+    def _build_messages(system_prompt, redacao_texto):
+        """
+        Mensagens de chat da chamada. A parte estática (rubrica e instruções de formato,
+        idêntica byte a byte entre as redações) vem primeiro e a redação por último: os
+        caches de prefixo dos provedores (prompt caching da OpenAI, cache implícito do
+        Gemini, KV cache do llama.cpp) só reaproveitam o início igual das requisições.
+        Nada que varie por chamada pode entrar antes da redação.
+        """
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": redacao_texto}
+        ]
+
+    @staticmethod
+    def chave_prefixo(system_prompt):
+        """Identificador estável do prefixo (system prompt) de uma chamada."""
+        return f"rubrica-{hash_texto(system_prompt)[:16]}"
+
+    def _parse_json(self, json_string, schema):
+        """Parseia o JSON string da LLM e valida contra o schema (etapa medida no benchmark)."""
+        with perf_stats.medir("parse_json"):
+            json_data = json.loads(json_string)
+            # Validação final para garantir que a(s) nota(s) existe(m)
+            with tracing.span("validacao"):
+                validar_json(json_data, schema)
+        return json_data
+
+    def _parse_candidatos(self, json_strings, schema):
+        """
+        Parseia as respostas das amostras de uma chamada. Com uma só, igual ao _parse_json;
+        com várias, descarta as inválidas e agrega as demais (agregar_candidatos).
+        Levanta o erro da última se nenhuma for válida.
+        """
+        if len(json_strings) == 1 and self.n_candidatos == 1:
+            return self._parse_json(json_strings[0], schema)
+        candidatos, erro = [], None
+        for json_string in json_strings:
+            try:
+                candidatos.append(self._parse_json(json_string, schema))
+            except Exception as e:
+                erro = e
+        if not candidatos:
+            raise erro or RespostaInvalida("Nenhuma amostra retornada pela API")
+        json_data = agregar_candidatos(candidatos, schema, self.agregacao)
+
+        blocos = [json_data] if contar_blocos(schema) == 1 else list(json_data.values())
+        with self._lock_consistencia:
+            self._consistencia["candidatos_invalidos"] += len(json_strings) - len(candidatos)
+            for bloco in blocos:
+                self._consistencia["blocos"] += 1
+                self._consistencia["soma_concordancia"] += bloco["concordancia"]
+                self._consistencia["unanimes"] += bloco["concordancia"] == 1.0
+        return json_data
+
+    def consistencia_stats(self):
+        """Concordância entre as amostras (self-consistency), ou None com uma amostra por chamada."""
+        if self.n_candidatos == 1:
+            return None
+        with self._lock_consistencia:
+            c = dict(self._consistencia)
+        return {
+            "n_candidatos": self.n_candidatos,
+            "agregacao": self.agregacao,
+            "blocos": c["blocos"],
+            "concordancia_media": c["soma_concordancia"] / c["blocos"] if c["blocos"] else 0.0,
+            "unanimes": c["unanimes"] / c["blocos"] if c["blocos"] else 0.0,
+            "candidatos_invalidos": c["candidatos_invalidos"],
+        }
+
+    def cache_key(self, system_prompt, redacao_texto, schema=SCHEMA_COMPETENCIA, competencia=None):
+        """Chave desta chamada no ResponseCache (exige self.cache configurado)."""
+        config = dict(self.generation_config, schema=schema)
+        if competencia is not None:
+            config["competencia"] = competencia
+        return self.cache.make_key(
+            self.__class__.__name__, self.model_name, system_prompt, redacao_texto, config
+        )
+
+    def retry_stats(self):
+        """Retentativas e disparos do disjuntor, para o resumo da execução."""
+        return dict(self.retry_policy.stats(), **{f"disjuntor_{k}": v for k, v in self.circuit_breaker.stats().items()})
+
+    def _request_correction_stream(self, system_prompt, redacao_texto, schema, extrator):
+        """
+        Como _request_correction, mas com a resposta em streaming: cada pedaço de texto
+        recebido vai para extrator.receber(). Só nos provedores com SUPORTA_STREAMING.
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} não suporta streaming")
+
+    @abstractmethod
+    def _request_correction(self, system_prompt, redacao_texto, schema):
+        """
+        Faz UMA chamada à API e devolve o JSON da LLM já parseado
+        e validado contra 'schema' (ver validar_json).
+        Deve levantar exceção em caso de falha (o get_correction trata).
         """
         pass
 
@@ -31,78 +682,187 @@ class GeminiProvider(AbstractLLMProvider):
     """
     Implementação concreta para a API do Google Gemini.
     Utiliza o modo JSON para garantir a saída estruturada.
+
+    Os GenerativeModel ficam num pool pequeno, um por hash de system prompt
+    (só existem ~6 prompts distintos). Com usar_cache_contexto=True, o texto
+    da rubrica vira um CachedContent no servidor e deixa de ser reenviado e
+    retokenizado a cada chamada. A API exige um tamanho mínimo de prompt para
+    isso; se a criação falhar, o provedor segue sem cache de contexto.
     """
-    def __init__(self, model_name="gemini-2.5-flash-preview-09-2025"):
-        super().__init__(model_name)
+    # Quantos GenerativeModel (um por system prompt) manter em memória
+    TAMANHO_POOL_MODELOS = 16
+    SUPORTA_STREAMING = True
+
+    def __init__(self, model_name="gemini-2.5-flash-preview-09-2025", max_concurrency=4, rpm=1000, tpm=1_000_000, cache=None,
+                 usar_cache_contexto=False, ttl_cache_contexto=3600, retry_policy=None, circuit_breaker=None,
+                 temperature=0.2, n_candidatos=1, agregacao="maioria", timeout=None):
+        super().__init__(model_name, max_concurrency, rpm, tpm, cache, retry_policy, circuit_breaker,
+                         n_candidatos, agregacao)
         
         # Configura a API key
         api_key = os.getenv("GOOGLE_API_KEY")
         if not api_key:
             raise ValueError("GOOGLE_API_KEY não encontrada no arquivo .env")
-        genai.configure(api_key=api_key)
-        
-        # Define o SCHEMA JSON que vamos FORÇAR na LLM
-        # (Corresponde ao que definimos no planejamento)
-        self.json_schema = {
-            "type": "OBJECT",
-            "properties": {
-                "nota_atribuida": {"type": "NUMBER"},
-                "raciocinio_cot": {"type": "STRING"},
-                "justificativa_para_aluno": {"type": "STRING"}
-            },
-            "required": ["nota_atribuida", "raciocinio_cot", "justificativa_para_aluno"]
-        }
+        # O SDK fala gRPC: um canal HTTP/2 por processo, de longa duração, que multiplexa
+        # todas as chamadas concorrentes (não há pool de conexões para dimensionar)
+        genai.configure(api_key=api_key, transport="grpc")
+        # Prazo explícito de cada chamada (segundos; None = o padrão do SDK)
+        self.request_options = {"timeout": timeout} if timeout else None
         
         # Configuração de geração da API
+        # (o response_schema é definido por chamada: competência ou completo)
+        global _aviso_ordem_gemini
+        if not GEMINI_ORDENA_CAMPOS and not _aviso_ordem_gemini:
+            _aviso_ordem_gemini = True
+            print("[GeminiProvider AVISO] O SDK do Gemini instalado não aceita property_ordering: a nota sai "
+                  "depois da justificativa. Para a nota primeiro: pip install -U google-ai-generativelanguage")
         self.generation_config = {
             "response_mime_type": "application/json",
-            "response_schema": self.json_schema,
-            "temperature": 0.2 # Baixa temperatura para consistência
+            "temperature": temperature # Baixa temperatura para consistência
+        }
+        if n_candidatos > 1:
+            # Self-consistency: as amostras saem todas da mesma requisição
+            self.generation_config["candidate_count"] = n_candidatos
+
+        # NÃO inicializamos o modelo aqui, pois ele precisa do system_prompt.
+        # Os modelos são criados sob demanda e reaproveitados (ver _obter_modelo).
+        self._modelos = OrderedDict()
+        self._lock_modelos = threading.Lock()
+        self.usar_cache_contexto = usar_cache_contexto
+        self.ttl_cache_contexto = ttl_cache_contexto
+        self._caches_contexto = []
+
+        # Métricas do pool e do cache de contexto
+        self.metricas = {
+            "chamadas": 0,
+            "modelos_criados": 0,
+            "modelos_reutilizados": 0,
+            "tempo_construcao_total": 0.0,
+            "caches_contexto_criados": 0,
+            "tokens_prompt": 0,
+            "tokens_prompt_em_cache": 0,
+        }
+
+    def _obter_modelo(self, system_prompt):
+        """
+        Devolve o GenerativeModel deste system prompt, criando-o (e o cache
+        de contexto, se ligado) só na primeira vez.
+        """
+        chave = hash_texto(system_prompt)
+        with self._lock_modelos:
+            model = self._modelos.get(chave)
+            if model is not None:
+                self._modelos.move_to_end(chave)
+                self.metricas["modelos_reutilizados"] += 1
+                return model
+
+            inicio = time.perf_counter()
+            model = None
+            if self.usar_cache_contexto:
+                model = self._criar_modelo_com_cache(system_prompt)
+            if model is None:
+                model = genai.GenerativeModel(
+                    self.model_name,
+                    system_instruction=system_prompt
+                )
+            self.metricas["tempo_construcao_total"] += time.perf_counter() - inicio
+            self.metricas["modelos_criados"] += 1
+
+            self._modelos[chave] = model
+            if len(self._modelos) > self.TAMANHO_POOL_MODELOS:
+                self._modelos.popitem(last=False)
+            return model
+
+    def _criar_modelo_com_cache(self, system_prompt):
+        """Cria o CachedContent da rubrica no servidor. Retorna None se não for possível."""
+        try:
+            conteudo = genai.caching.CachedContent.create(
+                model=f"models/{self.model_name}",
+                system_instruction=system_prompt,
+                ttl=datetime.timedelta(seconds=self.ttl_cache_contexto)
+            )
+        except Exception as e:
+            print(f"[GeminiProvider AVISO] Cache de contexto indisponível para este prompt, "
+                  f"seguindo sem ele: {e}")
+            return None
+        self._caches_contexto.append(conteudo)
+        self.metricas["caches_contexto_criados"] += 1
+        return genai.GenerativeModel.from_cached_content(conteudo)
+
+    def provider_metrics(self):
+        m = self.metricas
+        chamadas = max(1, m["chamadas"])
+        tempo_medio = m["tempo_construcao_total"] / max(1, m["modelos_criados"])
+        return {
+            "modelos_criados": m["modelos_criados"],
+            "modelos_reutilizados": m["modelos_reutilizados"],
+            "construcao_ms_por_chamada": 1000 * m["tempo_construcao_total"] / chamadas,
+            # Quanto teria custado recriar o modelo em toda chamada (comportamento antigo)
+            "construcao_ms_evitada": 1000 * tempo_medio * m["modelos_reutilizados"],
+            "caches_contexto_criados": m["caches_contexto_criados"],
+            "tokens_prompt": m["tokens_prompt"],
+            "tokens_prompt_em_cache": m["tokens_prompt_em_cache"],
+            "fracao_prompt_em_cache": m["tokens_prompt_em_cache"] / max(1, m["tokens_prompt"]),
         }
 
-        # --- MUDANÇA ---
-        # NÃO inicializamos o modelo aqui. 
-        # Vamos inicializá-lo dentro do get_correction,
-        # pois ele precisa do system_prompt.
-        # self.model = None 
+    def close(self):
+        """Apaga os caches de contexto criados (eles são cobrados por hora de armazenamento)."""
+        for conteudo in self._caches_contexto:
+            try:
+                conteudo.delete()
+            except Exception as e:
+                print(f"[GeminiProvider AVISO] Não foi possível apagar o cache de contexto: {e}")
+        self._caches_contexto = []
+
+    def _registrar_uso(self, response):
+        uso = getattr(response, "usage_metadata", None)
+        with self._lock_modelos:
+            self.metricas["chamadas"] += 1
+            if uso is not None:
+                self.metricas["tokens_prompt"] += getattr(uso, "prompt_token_count", 0) or 0
+                self.metricas["tokens_prompt_em_cache"] += getattr(uso, "cached_content_token_count", 0) or 0
+        if uso is not None:
+            # Nos modelos 2.5, os tokens de "thinking" são cobrados como saída
+            self._registrar_tokens(
+                entrada=getattr(uso, "prompt_token_count", 0),
+                saida=(getattr(uso, "candidates_token_count", 0) or 0) + (getattr(uso, "thoughts_token_count", 0) or 0),
+                cache=getattr(uso, "cached_content_token_count", 0)
+            )
 
-    def get_correction(self, system_prompt, redacao_texto):
+    def _request_correction(self, system_prompt, redacao_texto, schema):
         """
         Chama a API do Gemini com o prompt do sistema e a redação,
         forçando a resposta em JSON.
         """
         
         try:
-            # --- INÍCIO DA CORREÇÃO ---
-            # O modelo é inicializado AQUI, toda vez,
-            # passando o system_prompt dinâmico.
-            model = genai.GenerativeModel(
-                self.model_name,
-                system_instruction=system_prompt
-            )
+            with tracing.span("montar_requisicao"):
+                # Modelo do pool (um por system prompt), criado só na primeira vez
+                model = self._obter_modelo(system_prompt)
+                generation_config = dict(self.generation_config, response_schema=schema_para_gemini(schema))
             
             # A API do Gemini usa o argumento principal para a entrada do usuário
-            # (a redação) e NÃO aceita system_instruction aqui.
-            response = model.generate_content(
-                redacao_texto,
-                generation_config=self.generation_config
-            )
-            # --- FIM DA CORREÇÃO ---
+            # (a redação) e NÃO aceita system_instruction aqui. A rubrica (system_instruction
+            # do modelo) vai antes da redação: prefixo estável para o cache implícito do Gemini.
+            with perf_stats.medir("chamada_api"):
+                response = model.generate_content(
+                    redacao_texto,
+                    generation_config=generation_config,
+                    request_options=self.request_options
+                )
+            self._registrar_uso(response)
             
             if not response.candidates:
                 raise Exception("Resposta da API vazia ou bloqueada (safety settings?).")
             
-            # response.text já é o JSON string
-            json_string = response.text
-            
-            # Parseia o JSON string para um dicionário Python
-            json_data = json.loads(json_string)
-            
-            # Validação final para garantir que a nota existe
-            if "nota_atribuida" not in json_data:
-                raise ValueError("JSON retornado pela API não contém 'nota_atribuida'")
-                
-            return json_data
+            if self.n_candidatos == 1:
+                # response.text já é o JSON string
+                return self._parse_json(response.text, schema)
+
+            # Várias amostras (candidate_count): response.text só existe com um candidato
+            json_strings = ["".join(part.text for part in candidato.content.parts)
+                            for candidato in response.candidates if candidato.content.parts]
+            return self._parse_candidatos(json_strings, schema)
 
         except Exception as e:
             print(f"[GeminiProvider ERRO] Falha ao chamar API ou parsear JSON: {e}")
@@ -112,51 +872,185 @@ class GeminiProvider(AbstractLLMProvider):
                 print(f"   Resposta recebida (se houver): {response.text[:200]}...")
             elif 'response' in locals() and hasattr(response, 'prompt_feedback'):
                  print(f"   Feedback do Prompt (possível bloqueio): {response.prompt_feedback}")
-            return None
+            raise
+
+    def _request_correction_stream(self, system_prompt, redacao_texto, schema, extrator):
+        """
+        Como _request_correction, com stream=True. Com property_ordering (ver
+        schema_para_gemini), a nota é o primeiro campo gerado; sem ele, o Gemini ordena
+        os campos em ordem alfabética e a nota chega depois da justificativa.
+        """
+        try:
+            with tracing.span("montar_requisicao"):
+                model = self._obter_modelo(system_prompt)
+                generation_config = dict(self.generation_config, response_schema=schema_para_gemini(schema))
+            with perf_stats.medir("chamada_api"):
+                response = model.generate_content(
+                    redacao_texto,
+                    generation_config=generation_config,
+                    request_options=self.request_options,
+                    stream=True
+                )
+                for pedaco in response:
+                    for candidato in pedaco.candidates[:1]:
+                        extrator.receber("".join(part.text for part in candidato.content.parts))
+            # O uso de tokens vem com o último pedaço
+            self._registrar_uso(response)
+
+            if not response.candidates:
+                raise Exception("Resposta da API vazia ou bloqueada (safety settings?).")
+            return self._parse_json(extrator.texto(), schema)
+
+        except Exception as e:
+            print(f"[GeminiProvider ERRO] Falha no streaming ou ao parsear JSON: {e}")
+            print(f"   Contexto: Modelo={self.model_name} | Recebido: {extrator.texto()[:200]}")
+            raise
 
 class OpenAIProvider(AbstractLLMProvider):
     """
     Implementação concreta para a API da OpenAI (GPT).
+    As requisições passam por um PooledTransport ('transporte', que pode ser dividido
+    com outros provedores OpenAI; ver http_transport.transporte_compartilhado), com
+    max_concurrency conexões reservadas para este provedor.
     """
-    def __init__(self, model_name="gpt-4o-mini"): # gpt-4o-mini é rápido e barato
-        super().__init__(model_name)
+    SUPORTA_STREAMING = True
+
+    def __init__(self, model_name="gpt-4o-mini", max_concurrency=8, rpm=500, tpm=200_000, cache=None, # gpt-4o-mini é rápido e barato
+                 retry_policy=None, circuit_breaker=None, temperature=0.2, n_candidatos=1, agregacao="maioria",
+                 transporte=None):
+        super().__init__(model_name, max_concurrency, rpm, tpm, cache, retry_policy, circuit_breaker,
+                         n_candidatos, agregacao)
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OPENAI_API_KEY não encontrada no arquivo .env")
-        # Inicializa o cliente da OpenAI
-        self.client = OpenAI(api_key=api_key)
+        # Inicializa o cliente da OpenAI sobre o pool de conexões
+        # (max_retries=0: as retentativas ficam com a RetryPolicy, que conversa com o limitador e o disjuntor)
+        self.transporte = transporte or PooledTransport("openai")
+        self.transporte.reservar(max_concurrency)
+        self.client = OpenAI(api_key=api_key, max_retries=0, timeout=self.transporte.timeout,
+                             http_client=self.transporte.criar_cliente())
+        self._fechado = False
+
+        # Configuração de geração da API
+        # (o response_format é definido por chamada: competência ou completo; ver _config_da_chamada)
+        self.generation_config = {
+            "temperature": temperature # Baixa temperatura para consistência
+        }
+        if n_candidatos > 1:
+            # Self-consistency: n amostras na mesma requisição (o prompt é cobrado uma vez só)
+            self.generation_config["n"] = n_candidatos
+
+    def _config_da_chamada(self, schema):
+        """
+        generation_config com o response_format do schema da chamada: structured outputs
+        (json_schema em modo strict), que força o JSON válido e a ordem dos campos, com a
+        nota antes do raciocínio (o json_object só garantia um JSON qualquer).
+        """
+        nome = "correcao_completa" if contar_blocos(schema) > 1 else "correcao_competencia"
+        formato = {"type": "json_schema",
+                   "json_schema": {"name": nome, "strict": True, "schema": schema_para_json_schema(schema)}}
+        return dict(self.generation_config, response_format=formato)
+
+    # --- Modo lote: formato nativo da Batch API da OpenAI ---
 
-    def get_correction(self, system_prompt, redacao_texto):
+    def build_batch_request(self, custom_id, system_prompt, redacao_texto, schema=SCHEMA_COMPETENCIA, competencia=None):
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.model_name,
+                "messages": self._build_messages(system_prompt, redacao_texto),
+                "prompt_cache_key": self.chave_prefixo(system_prompt),
+                **self._config_da_chamada(schema)
+            }
+        }
+
+    def answer_batch_request(self, pedido):
+        """Executa uma linha nativa da Batch API de forma interativa (substituto local)."""
+        corpo = pedido["body"]
+        tokens_estimados = sum(estimar_tokens(m["content"]) for m in corpo["messages"]) + self.TOKENS_SAIDA_ESTIMADOS
+        self.rate_limiter.acquire(tokens_estimados)
+        try:
+            response = self.client.chat.completions.create(**corpo)
+        except Exception as e:
+            if is_rate_limit_error(e):
+                self.rate_limiter.report_rate_limit()
+            return {"custom_id": pedido["custom_id"], "response": None, "error": {"message": str(e)}}
+        self.rate_limiter.report_success()
+        return {
+            "custom_id": pedido["custom_id"],
+            "response": {"status_code": 200, "body": response.model_dump()},
+            "error": None
+        }
+
+    def parse_batch_result(self, resultado, schema=SCHEMA_COMPETENCIA):
+        if resultado.get("error"):
+            raise ValueError(resultado["error"])
+        resposta = resultado.get("response") or {}
+        if resposta.get("status_code") != 200:
+            raise ValueError(f"Pedido do lote retornou status {resposta.get('status_code')}")
+        json_data = self._parse_candidatos([escolha["message"]["content"] for escolha in resposta["body"]["choices"]],
+                                           schema)
+        entrada, saida, cache = self._tokens_do_uso(resposta["body"].get("usage"))
+        json_data["_uso"] = {"tokens_entrada": entrada, "tokens_saida": saida, "tokens_cache": cache,
+                             "tentativas": 1, "latencia_s": None, "em_cache": False, "lote": True}
+        return json_data
+
+    def batch_backend(self, diretorio):
+        return OpenAIBatchBackend(self.client)
+
+    def provider_metrics(self):
+        return self.transporte.stats()
+
+    def close(self):
+        # O mesmo provedor pode aparecer duas vezes na execução (ex: sozinho e dentro da cascata)
+        if not self._fechado:
+            self._fechado = True
+            self.client.close()
+
+    @staticmethod
+    def _tokens_do_uso(usage):
+        """(entrada, saída, entrada em cache) de um objeto/dict 'usage' da API."""
+        if usage is None:
+            return 0, 0, 0
+        if not isinstance(usage, dict):
+            usage = usage.model_dump()
+        detalhes = usage.get("prompt_tokens_details") or {}
+        return usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0, detalhes.get("cached_tokens") or 0
+
+    def _registrar_uso(self, response):
+        entrada, saida, cache = self._tokens_do_uso(getattr(response, "usage", None))
+        self._registrar_tokens(entrada, saida, cache)
+
+    def _request_correction(self, system_prompt, redacao_texto, schema):
         """
         Chama a API da OpenAI com o prompt do sistema e a redação,
         forçando a resposta em JSON.
         """
         try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": redacao_texto}
-                ],
-                # Esta é a "mágica" para forçar JSON no GPT
-                response_format={"type": "json_object"},
-                temperature=0.2 # Baixa temperatura para consistência
-            )
+            with tracing.span("montar_requisicao"):
+                messages = self._build_messages(system_prompt, redacao_texto)
+            with perf_stats.medir("chamada_api"):
+                # prompt_cache_key: chamadas com a mesma rubrica vão para os mesmos servidores,
+                # o que aumenta os acertos do prompt caching (prefixos de 1024+ tokens)
+                response = self.client.chat.completions.create(
+                    model=self.model_name,
+                    messages=messages,
+                    prompt_cache_key=self.chave_prefixo(system_prompt),
+                    **self._config_da_chamada(schema)
+                )
             
+            self._registrar_uso(response)
+
             if not response.choices:
                  raise Exception("Resposta da API da OpenAI vazia.")
 
-            # O JSON string está dentro da mensagem de resposta
-            json_string = response.choices[0].message.content
+            # O JSON string está dentro da mensagem de resposta (uma por amostra, com n > 1)
+            json_strings = [escolha.message.content for escolha in response.choices]
             
-            # Parseia o JSON string para um dicionário Python
-            json_data = json.loads(json_string)
-            
-            # Validação final para garantir que a nota existe
-            if "nota_atribuida" not in json_data:
-                raise ValueError("JSON retornado pela API (OpenAI) não contém 'nota_atribuida'")
-
-            return json_data
+            # Parseia o(s) JSON string(s) para um dicionário Python (e valida)
+            return self._parse_candidatos(json_strings, schema)
 
         except Exception as e:
             print(f"[OpenAIProvider ERRO] Falha ao chamar API ou parsear JSON: {e}")
@@ -164,4 +1058,801 @@ class OpenAIProvider(AbstractLLMProvider):
             # Se a resposta não for JSON, pode estar aqui
             if 'response' in locals() and hasattr(response, 'choices'):
                 print(f"   Resposta recebida (se houver): {response.choices[0].message.content[:200]}...")
+            raise
+
+    def _request_correction_stream(self, system_prompt, redacao_texto, schema, extrator):
+        """Como _request_correction, com stream=True (o uso de tokens vem no último pedaço)."""
+        try:
+            with tracing.span("montar_requisicao"):
+                messages = self._build_messages(system_prompt, redacao_texto)
+            with perf_stats.medir("chamada_api"):
+                stream = self.client.chat.completions.create(
+                    model=self.model_name,
+                    messages=messages,
+                    prompt_cache_key=self.chave_prefixo(system_prompt),
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **self._config_da_chamada(schema)
+                )
+                usage = None
+                for pedaco in stream:
+                    if pedaco.choices and pedaco.choices[0].delta.content:
+                        extrator.receber(pedaco.choices[0].delta.content)
+                    if getattr(pedaco, "usage", None) is not None:
+                        usage = pedaco.usage
+            self._registrar_tokens(*self._tokens_do_uso(usage))
+
+            if not extrator.texto():
+                raise Exception("Resposta da API da OpenAI vazia.")
+            return self._parse_json(extrator.texto(), schema)
+
+        except Exception as e:
+            print(f"[OpenAIProvider ERRO] Falha no streaming ou ao parsear JSON: {e}")
+            print(f"   Contexto: Modelo={self.model_name} | Recebido: {extrator.texto()[:200]}")
+            raise
+
+
+# --- Provedores offline (sem rede e sem chave de API) ---
+# Servem para medir o overhead do próprio harness (agendamento, parse, gravação)
+# e para reproduzir execuções anteriores.
+
+class ErroSimulado(Exception):
+    """Erro injetado pelo MockProvider; status_code imita o HTTP do erro real."""
+    def __init__(self, mensagem, status_code=None):
+        super().__init__(mensagem)
+        self.status_code = status_code
+
+class MockProvider(AbstractLLMProvider):
+    """
+    Provedor simulado e determinístico (com 'semente' fixa).
+
+    - latencia: distribuição do tempo de resposta ("zero", "constante",
+      "uniforme", "exponencial" ou "lognormal"), com média 'latencia_media'
+      segundos ('latencia_desvio' é o sigma da lognormal).
+    - taxa_erro / tipo_erro: fração das chamadas que falha e como
+      ("503", "429", "timeout", "json" = JSON malformado, ou "fatal").
+    - politica_nota: "hash" (nota fixa por prompt + redação, igual entre
+      execuções), "aleatoria", "constante" (nota_fixa) ou uma função
+      f(system_prompt, redacao_texto, comp_id) -> nota.
+
+    A resposta passa por json.dumps/json.loads e validar_json, como nos
+    provedores reais, para que o custo de parse entre nas medições.
+    O cache de prefixo é simulado como o da OpenAI: a partir da segunda chamada
+    com o mesmo system prompt (de 1024+ tokens), ele conta como tokens em cache,
+    em blocos de 128.
+    Com n_candidatos > 1, a primeira amostra tem a nota da política e as demais
+    discordam dela em uma nota (40 pontos) com probabilidade 'discordancia'.
+    Em streaming, a resposta chega em pedaços de TAMANHO_PEDACO caracteres: o
+    primeiro depois de FRACAO_PRIMEIRO_PEDACO da latência, os demais no restante.
+    """
+    SUPORTA_STREAMING = True
+    FRACAO_PRIMEIRO_PEDACO = 0.2
+    TAMANHO_PEDACO = 16
+
+    def __init__(self, model_name="mock", max_concurrency=64, rpm=None, tpm=None, cache=None,
+                 latencia="zero", latencia_media=0.0, latencia_desvio=0.5,
+                 taxa_erro=0.0, tipo_erro="503", politica_nota="hash", nota_fixa=120, semente=None,
+                 retry_policy=None, circuit_breaker=None, n_candidatos=1, agregacao="maioria", discordancia=0.3):
+        super().__init__(model_name, max_concurrency, rpm, tpm, cache, retry_policy, circuit_breaker,
+                         n_candidatos, agregacao)
+        self.generation_config = {"mock": True, "politica_nota": str(politica_nota)}
+        if n_candidatos > 1:
+            self.generation_config["n_candidatos"] = n_candidatos
+        self.discordancia = discordancia
+        self.latencia = latencia
+        self.latencia_media = latencia_media
+        self.latencia_desvio = latencia_desvio
+        self.taxa_erro = taxa_erro
+        self.tipo_erro = tipo_erro
+        self.politica_nota = politica_nota
+        self.nota_fixa = nota_fixa
+        self._rng = random.Random(semente)
+        self._lock_rng = threading.Lock()
+        self._prefixos_vistos = set()
+
+    def _sortear(self, funcao, *args):
+        with self._lock_rng:
+            return getattr(self._rng, funcao)(*args)
+
+    def _tempo_resposta(self):
+        media = self.latencia_media
+        if self.latencia == "zero" or media <= 0:
+            return 0.0
+        if self.latencia == "constante":
+            return media
+        if self.latencia == "uniforme":
+            return self._sortear("uniform", 0, 2 * media)
+        if self.latencia == "exponencial":
+            return self._sortear("expovariate", 1.0 / media)
+        if self.latencia == "lognormal":
+            # mu escolhido para que a média da distribuição seja 'latencia_media'
+            sigma = self.latencia_desvio
+            return self._sortear("lognormvariate", math.log(media) - sigma ** 2 / 2, sigma)
+        raise ValueError(f"Distribuição de latência desconhecida: '{self.latencia}'")
+
+    def _nota(self, system_prompt, redacao_texto, comp_id):
+        if callable(self.politica_nota):
+            return self.politica_nota(system_prompt, redacao_texto, comp_id)
+        if self.politica_nota == "constante":
+            return self.nota_fixa
+        if self.politica_nota == "aleatoria":
+            return self._sortear("choice", NOTAS_VALIDAS)
+        if self.politica_nota == "hash":
+            digest = hash_texto(f"{system_prompt}|{redacao_texto}|{comp_id}")
+            return NOTAS_VALIDAS[int(digest[:8], 16) % len(NOTAS_VALIDAS)]
+        raise ValueError(f"Política de nota desconhecida: '{self.politica_nota}'")
+
+    def _bloco(self, system_prompt, redacao_texto, comp_id, amostra=0):
+        nota = self._nota(system_prompt, redacao_texto, comp_id)
+        if amostra > 0:
+            # Amostras extras (self-consistency): às vezes uma nota acima ou abaixo
+            sorteio = int(hash_texto(f"{system_prompt}|{redacao_texto}|{comp_id}|{amostra}")[:8], 16) / 0xFFFFFFFF
+            if sorteio < self.discordancia:
+                passo = -40 if sorteio < self.discordancia / 2 else 40
+                nota = ajustar_nota(min(200, max(0, nota + passo)))
+        return {
+            "nota_atribuida": nota,
+            "raciocinio_cot": f"[mock] Nota {nota} atribuída pela política '{self.politica_nota}'.",
+            "justificativa_para_aluno": "[mock] Resposta simulada."
+        }
+
+    def _tokens_prefixo_em_cache(self, system_prompt):
+        tokens_prefixo = estimar_tokens(system_prompt)
+        chave = self.chave_prefixo(system_prompt)
+        with self._lock_rng:
+            visto = chave in self._prefixos_vistos
+            self._prefixos_vistos.add(chave)
+        if not visto or tokens_prefixo < 1024:
+            return 0
+        return tokens_prefixo - tokens_prefixo % 128
+
+    def _falhar(self):
+        if self.tipo_erro == "429":
+            raise ErroSimulado("429 Too Many Requests (simulado)", status_code=429)
+        if self.tipo_erro == "timeout":
+            raise TimeoutError("Timeout (simulado)")
+        if self.tipo_erro == "fatal":
+            raise ErroSimulado("400 Bad Request (simulado)", status_code=400)
+        raise ErroSimulado("503 Service Unavailable (simulado)", status_code=503)
+
+    def _request_correction(self, system_prompt, redacao_texto, schema):
+        with perf_stats.medir("chamada_api"):
+            espera = self._tempo_resposta()
+            if espera > 0:
+                time.sleep(espera)
+
+            falhou = self.taxa_erro > 0 and self._sortear("random") < self.taxa_erro
+            if falhou and self.tipo_erro != "json":
+                self._falhar()
+
+            json_strings = []
+            for amostra in range(self.n_candidatos):
+                if contar_blocos(schema) == 1:
+                    resposta = self._bloco(system_prompt, redacao_texto, None, amostra)
+                else:
+                    resposta = {f"c{c}": self._bloco(system_prompt, redacao_texto, c, amostra) for c in range(1, 6)}
+                json_strings.append(json.dumps(resposta, ensure_ascii=False))
+            if falhou:
+                json_strings = [json_string[:len(json_string) // 2] for json_string in json_strings]
+            # Como no n da OpenAI: o prompt é cobrado uma vez, a saída de todas as amostras
+            self._registrar_tokens(entrada=estimar_tokens(system_prompt) + estimar_tokens(redacao_texto),
+                                   saida=sum(estimar_tokens(json_string) for json_string in json_strings),
+                                   cache=self._tokens_prefixo_em_cache(system_prompt))
+
+        return self._parse_candidatos(json_strings, schema)
+
+    def _request_correction_stream(self, system_prompt, redacao_texto, schema, extrator):
+        # Mesma resposta do _request_correction, entregue em pedaços ao longo da latência sorteada
+        with perf_stats.medir("chamada_api"):
+            espera = self._tempo_resposta()
+            falhou = self.taxa_erro > 0 and self._sortear("random") < self.taxa_erro
+            if falhou and self.tipo_erro != "json":
+                time.sleep(espera)
+                self._falhar()
+            if contar_blocos(schema) == 1:
+                resposta = self._bloco(system_prompt, redacao_texto, None)
+            else:
+                resposta = {f"c{c}": self._bloco(system_prompt, redacao_texto, c) for c in range(1, 6)}
+            json_string = json.dumps(resposta, ensure_ascii=False)
+            if falhou:
+                json_string = json_string[:len(json_string) // 2]
+            pedacos = [json_string[i:i + self.TAMANHO_PEDACO] for i in range(0, len(json_string), self.TAMANHO_PEDACO)]
+            for i, pedaco in enumerate(pedacos):
+                if espera > 0:
+                    time.sleep(espera * (self.FRACAO_PRIMEIRO_PEDACO if i == 0
+                                         else (1 - self.FRACAO_PRIMEIRO_PEDACO) / max(1, len(pedacos) - 1)))
+                extrator.receber(pedaco)
+            self._registrar_tokens(entrada=estimar_tokens(system_prompt) + estimar_tokens(redacao_texto),
+                                   saida=estimar_tokens(json_string),
+                                   cache=self._tokens_prefixo_em_cache(system_prompt))
+        return self._parse_json(extrator.texto(), schema)
+
+class ReplayProvider(AbstractLLMProvider):
+    """
+    Reproduz as respostas gravadas de uma execução anterior, a partir do CSV
+    de resultados ou do diário (JSONL), sem chamar nenhuma API.
+
+    As respostas são indexadas por (hash do prompt, redação, competência); a
+    competência vem do get_correction (dois prompts de texto igual, como c3 e c4,
+    têm o mesmo hash). Gravações sem a coluna prompt_hash (CSVs antigos) valem
+    para qualquer prompt da mesma redação e competência. Como a chamada só
+    recebe o texto da redação, 'textos_por_id' ({redacao_id: texto}) faz a ponte
+    entre o texto e o redacao_id gravado. Uma chamada sem resposta gravada (outro
+    prompt, outra redação) levanta KeyError, que é tratado como erro fatal.
+    """
+    def __init__(self, caminho, textos_por_id, modelo_gravado=None, model_name=None, max_concurrency=64,
+                 cache=None, retry_policy=None, circuit_breaker=None):
+        super().__init__(model_name or f"replay:{modelo_gravado or os.path.basename(caminho)}",
+                         max_concurrency, None, None, cache, retry_policy, circuit_breaker)
+        self.caminho = caminho
+        self.modelo_gravado = modelo_gravado
+        self.generation_config = {"replay": os.path.abspath(caminho), "modelo_gravado": modelo_gravado}
+        self._id_por_texto = {hash_texto(texto): redacao_id for redacao_id, texto in textos_por_id.items()}
+        self._respostas = {}
+        for linha in self.ler_gravacao(caminho):
+            if modelo_gravado is not None and linha["modelo"] != modelo_gravado:
+                continue
+            chave = (linha.get("prompt_hash") or None, linha["redacao_id"], int(str(linha["competencia"]).lstrip("C")))
+            self._respostas[chave] = {
+                "nota_atribuida": int(linha["nota_llm"]),
+                "raciocinio_cot": linha.get("raciocinio_cot"),
+                "justificativa_para_aluno": linha.get("justificativa_aluno")
+            }
+        print(f"[OK] {self.model_name}: {len(self._respostas)} respostas gravadas em '{caminho}'")
+
+    def _resposta_gravada(self, prompt_hash, redacao_id, competencia):
+        """Resposta gravada com este prompt (ou, em gravações sem prompt_hash, com qualquer um)."""
+        return (self._respostas.get((prompt_hash, redacao_id, competencia))
+                or self._respostas.get((None, redacao_id, competencia)))
+
+    @staticmethod
+    def ler_gravacao(caminho):
+        """Lê as linhas de resultado de um CSV (evaluation_results.csv), JSONL (diário) ou Parquet."""
+        return ler_resultados(caminho)
+
+    @classmethod
+    def modelos_gravados(cls, caminho):
+        """Nomes dos modelos presentes na gravação, na ordem em que aparecem."""
+        modelos = {}
+        for linha in cls.ler_gravacao(caminho):
+            modelos.setdefault(linha["modelo"], None)
+        return list(modelos)
+
+    def _request_correction(self, system_prompt, redacao_texto, schema):
+        with perf_stats.medir("chamada_api"):
+            redacao_id = self._id_por_texto.get(hash_texto(redacao_texto))
+            prompt_hash = hash_texto(system_prompt)
+            if contar_blocos(schema) == 1:
+                competencias = [self.competencia_atual()] if self.competencia_atual() is not None else range(1, 6)
+            else:
+                competencias = range(1, 6)
+            blocos = {c: self._resposta_gravada(prompt_hash, redacao_id, c) for c in competencias}
+            blocos = {c: bloco for c, bloco in blocos.items() if bloco is not None}
+        if not blocos:
+            raise KeyError(f"Sem resposta gravada para a redação {redacao_id} com este prompt")
+
+        if contar_blocos(schema) == 1:
+            if len(blocos) != 1:
+                raise KeyError(f"Gravação da redação {redacao_id} não é de uma única competência "
+                               f"(informe a competência no get_correction)")
+            json_data = next(iter(blocos.values()))
+        else:
+            if len(blocos) != 5:
+                raise KeyError(f"Gravação da redação {redacao_id} não tem as 5 competências com este prompt")
+            json_data = {f"c{c}": blocos[c] for c in range(1, 6)}
+        validar_json(json_data, schema)
+        return json_data
+
+
+# --- Provedor local (modelo open-weight na CPU) ---
+
+class LocalProvider(AbstractLLMProvider):
+    """
+    Modelo open-weight quantizado (arquivo GGUF) rodando na CPU via llama-cpp-python:
+    sem rede, sem chave e sem limite de taxa. Serve para testes de regressão e
+    pré-correção em massa a custo zero.
+
+    - A saída é gerada com decodificação restrita por gramática (derivada do schema),
+      então sempre é um JSON com nota_atribuida / raciocinio_cot / justificativa_para_aluno
+      e a nota é uma das notas válidas.
+    - 'n_instancias' cópias do modelo dividem os núcleos ('n_threads' cada); cada uma
+      atende uma chamada por vez. O llama.cpp reaproveita o prefixo já processado (o
+      system prompt) entre chamadas seguidas na mesma instância, então cada chamada vai,
+      de preferência, para a instância que atendeu por último o mesmo prompt.
+    - No modo "completo" as 5 competências saem numa única geração.
+    - Com n_candidatos > 1, as amostras são geradas uma após a outra na mesma
+      instância (o llama.cpp não gera várias de uma vez), reaproveitando o prefixo.
+
+    O provider_metrics() mostra a vazão em redações por minuto por núcleo.
+    """
+    def __init__(self, caminho_modelo, model_name=None, n_instancias=1, n_threads=None, n_ctx=8192,
+                 max_tokens_por_competencia=1024, temperature=0.2, cache=None,
+                 retry_policy=None, circuit_breaker=None, n_candidatos=1, agregacao="maioria"):
+        if Llama is None:
+            raise ImportError("O LocalProvider exige o pacote 'llama-cpp-python' (pip install llama-cpp-python).")
+        if not os.path.exists(caminho_modelo):
+            raise FileNotFoundError(f"Modelo local não encontrado: '{caminho_modelo}'")
+        nome_arquivo = os.path.splitext(os.path.basename(caminho_modelo))[0]
+        super().__init__(model_name or f"local:{nome_arquivo}", n_instancias, None, None, cache,
+                         retry_policy, circuit_breaker, n_candidatos, agregacao)
+        self.n_threads = n_threads or max(1, (os.cpu_count() or 1) // n_instancias)
+        self.n_nucleos = min(os.cpu_count() or 1, self.n_threads * n_instancias)
+        self.max_tokens_por_competencia = max_tokens_por_competencia
+        self.generation_config = {"modelo_local": nome_arquivo, "temperature": temperature}
+        if n_candidatos > 1:
+            self.generation_config["n_candidatos"] = n_candidatos
+
+        self._instancias = [
+            {"llama": Llama(model_path=caminho_modelo, n_ctx=n_ctx, n_threads=self.n_threads, verbose=False),
+             "prompt": None, "ocupada": False}
+            for _ in range(n_instancias)
+        ]
+        self._cond = threading.Condition()
+        self._gramaticas = {}
+
+        # Métricas de vazão
+        self.metricas = {
+            "chamadas": 0,
+            "competencias": 0,
+            "prefixo_reaproveitado": 0,
+            "tokens_entrada": 0,
+            "tokens_saida": 0,
+            "tempo_inferencia_total": 0.0,
+        }
+        self._inicio = None
+        self._fim = None
+
+    def _gramatica(self, schema):
+        """LlamaGrammar do schema (gerada uma vez por schema)."""
+        chave = json.dumps(schema, sort_keys=True)
+        with self._cond:
+            gramatica = self._gramaticas.get(chave)
+        if gramatica is None:
+            gramatica = LlamaGrammar.from_json_schema(json.dumps(schema_para_json_schema(schema)), verbose=False)
+            with self._cond:
+                self._gramaticas[chave] = gramatica
+        return gramatica
+
+    def _pegar_instancia(self, chave_prompt):
+        """Reserva uma instância livre, de preferência a que processou este system prompt por último."""
+        with self._cond:
+            while True:
+                livres = [instancia for instancia in self._instancias if not instancia["ocupada"]]
+                if livres:
+                    break
+                self._cond.wait()
+            instancia = next((i for i in livres if i["prompt"] == chave_prompt), livres[0])
+            if instancia["prompt"] == chave_prompt:
+                self.metricas["prefixo_reaproveitado"] += 1
+            instancia["ocupada"] = True
+            instancia["prompt"] = chave_prompt
+            if self._inicio is None:
+                self._inicio = time.perf_counter()
+            return instancia
+
+    def _devolver_instancia(self, instancia):
+        with self._cond:
+            instancia["ocupada"] = False
+            self._cond.notify()
+
+    def _request_correction(self, system_prompt, redacao_texto, schema):
+        blocos = contar_blocos(schema)
+        with tracing.span("montar_requisicao"):
+            gramatica = self._gramatica(schema)
+            messages = self._build_messages(system_prompt, redacao_texto)
+
+        instancia = self._pegar_instancia(hash_texto(system_prompt))
+        inicio = time.perf_counter()
+        respostas = []
+        try:
+            with perf_stats.medir("chamada_api"):
+                for _ in range(self.n_candidatos):
+                    respostas.append(instancia["llama"].create_chat_completion(
+                        messages=messages,
+                        grammar=gramatica,
+                        temperature=self.generation_config["temperature"],
+                        max_tokens=self.max_tokens_por_competencia * blocos
+                    ))
+        finally:
+            self._devolver_instancia(instancia)
+
+        tokens_entrada = sum((resposta.get("usage") or {}).get("prompt_tokens") or 0 for resposta in respostas)
+        tokens_saida = sum((resposta.get("usage") or {}).get("completion_tokens") or 0 for resposta in respostas)
+        self._registrar_tokens(entrada=tokens_entrada, saida=tokens_saida)
+        with self._cond:
+            self.metricas["chamadas"] += 1
+            self.metricas["competencias"] += blocos
+            self.metricas["tokens_entrada"] += tokens_entrada
+            self.metricas["tokens_saida"] += tokens_saida
+            self.metricas["tempo_inferencia_total"] += time.perf_counter() - inicio
+            self._fim = time.perf_counter()
+
+        # Se a geração parou em max_tokens, o JSON vem truncado: o _parse_json
+        # levanta o erro e a RetryPolicy tenta de novo
+        return self._parse_candidatos([resposta["choices"][0]["message"]["content"] for resposta in respostas], schema)
+
+    def provider_metrics(self):
+        m = self.metricas
+        tempo = (self._fim - self._inicio) if self._inicio is not None and self._fim is not None else 0.0
+        # Redações equivalentes: 5 competências avaliadas = 1 redação
+        redacoes_por_minuto = 60.0 * (m["competencias"] / 5) / tempo if tempo > 0 else 0.0
+        return {
+            "instancias": len(self._instancias),
+            "nucleos": self.n_nucleos,
+            "chamadas": m["chamadas"],
+            "prefixo_reaproveitado": m["prefixo_reaproveitado"],
+            "tokens_saida_por_s": m["tokens_saida"] / m["tempo_inferencia_total"] if m["tempo_inferencia_total"] else 0.0,
+            "redacoes_por_minuto": redacoes_por_minuto,
+            "redacoes_por_minuto_por_nucleo": redacoes_por_minuto / self.n_nucleos,
+        }
+
+    def close(self):
+        """Libera a memória dos modelos carregados."""
+        for instancia in self._instancias:
+            fechar = getattr(instancia["llama"], "close", None)
+            if fechar is not None:
+                fechar()
+        self._instancias = []
+
+
+# --- Cascata (modelo barato primeiro, o mais forte só quando preciso) ---
+
+class CascadeProvider(BaseLLMProvider):
+    """
+    Cascata de provedores em ordem crescente de custo (ex: gpt-4o-mini e depois gpt-4o).
+    Cada chamada vai primeiro ao mais barato e só sobe para o próximo quando a correção
+    é incerta:
+      - "resposta_invalida": a etapa falhou (JSON inválido ou erro depois das retentativas);
+      - "discordancia": as amostras da etapa (self-consistency, n_candidatos > 1)
+        concordam menos que 'limiar_concordancia' em alguma competência;
+      - "fronteira": a nota ficou entre dois níveis (fora de 0, 40, ..., 200) ou a média
+        das amostras está a 'distancia_fronteira' pontos ou mais da nota de consenso.
+    A cascata não faz chamadas: cache, limite de taxa, retentativas e disjuntor são os
+    de cada etapa (o get_correction dela), e o resumo da execução mostra os de cada uma
+    (provedores_internos). O uso devolvido soma todas as etapas, e o custo ("custo_usd")
+    usa o preço de cada uma ('precos', como PRECOS_POR_MILHAO).
+    Cada bloco da resposta leva "modelo_cascata", o modelo que deu a nota.
+    """
+    def __init__(self, provedores, model_name=None, precos=None, limiar_concordancia=1.0, distancia_fronteira=20):
+        if not provedores:
+            raise ValueError("A cascata precisa de ao menos um provedor")
+        super().__init__(model_name or "cascata:" + ">".join(provedor.model_name for provedor in provedores),
+                         provedores[0].max_concurrency, max(provedor.n_candidatos for provedor in provedores))
+        self.provedores = list(provedores)
+        self.precos = precos or {}
+        self.limiar_concordancia = limiar_concordancia
+        self.distancia_fronteira = distancia_fronteira
+        self._lock = threading.Lock()
+        self.metricas = {
+            "chamadas": 0,
+            "escaladas": 0,
+            "falhas": 0,
+            "respondidas_por": Counter(),
+            "motivos": Counter(),
+            "custo_real": 0.0,
+            # Custo do último modelo nas chamadas que chegaram a ele
+            "custo_forte_medido": 0.0,
+        }
+        # Por número de blocos do schema: [soma, n] do custo medido do último modelo (fora do
+        # cache) e [n, estimativa pelos tokens] das chamadas que pararam antes dele
+        self._custo_forte = {}
+        self._sem_forte = {}
+
+    def _somar_uso(self, uso, uso_etapa):
+        for campo in ("tokens_entrada", "tokens_saida", "tokens_cache", "tentativas"):
+            uso[campo] += uso_etapa.get(campo, 0) or 0
+
+    def _custo_so_forte(self, provedor, uso_etapa):
+        """Custo estimado da chamada no último modelo, pelos tokens da primeira etapa."""
+        forte = self.provedores[-1]
+        # A saída da etapa inclui todas as amostras dela; o modelo forte gera as suas
+        fator_saida = forte.n_candidatos / provedor.n_candidatos
+        uso_forte = dict(uso_etapa, tokens_cache=0, tokens_saida=(uso_etapa.get("tokens_saida") or 0) * fator_saida)
+        return custo_chamada(self.precos, forte.model_name, uso_forte)
+
+    def _na_fronteira(self, bloco):
+        nota = float(bloco["nota_atribuida"])
+        candidatas = bloco.get("notas_candidatas")
+        if candidatas:
+            return abs(statistics.mean(candidatas) - nota) >= self.distancia_fronteira
+        return nota not in NOTAS_VALIDAS
+
+    def motivo_incerteza(self, json_data, schema):
+        """Por que a resposta de uma etapa deve subir na cascata (ou None se ela é confiável)."""
+        if json_data is None:
+            return "resposta_invalida"
+        blocos = [json_data] if contar_blocos(schema) == 1 else [json_data[campo] for campo in schema["properties"]]
+        if any(bloco.get("concordancia", 1.0) < self.limiar_concordancia for bloco in blocos):
+            return "discordancia"
+        if any(self._na_fronteira(bloco) for bloco in blocos):
+            return "fronteira"
+        return None
+
+    def _registrar_custo_forte(self, blocos, uso_forte, custo_forte, estimativa):
+        """Custo do último modelo nesta chamada: o medido, se ela chegou a ele, ou a estimativa."""
+        if uso_forte is not None:
+            self.metricas["custo_forte_medido"] += custo_forte
+            if uso_forte.get("tokens_entrada"):
+                soma, n = self._custo_forte.get(blocos, (0.0, 0))
+                self._custo_forte[blocos] = (soma + custo_forte, n + 1)
+        elif estimativa is not None:
+            n, soma = self._sem_forte.get(blocos, (0, 0.0))
+            self._sem_forte[blocos] = (n + 1, soma + estimativa)
+
+    def _obter_correcao(self, system_prompt, redacao_texto, schema, uso):
+        json_data, motivos = None, []
+        uso_forte, custo_forte, estimativa = None, 0.0, None
+        em_cache = True
+        competencia = self.competencia_atual()
+        # Streaming: a nota de cada etapa sai assim que chega; se a cascata subir, a da
+        # etapa seguinte a substitui
+        extrator = self.extrator_atual()
+        ao_receber_nota = extrator.entregar if extrator is not None else None
+        for etapa, provedor in enumerate(self.provedores):
+            with tracing.span("etapa_cascata", etapa=etapa, modelo_etapa=provedor.model_name):
+                json_data = self._correcao_interna(provedor, system_prompt, redacao_texto, schema, competencia,
+                                                   ao_receber_nota)
+            uso_etapa = provedor.ultimo_uso() or {}
+            self._somar_uso(uso, uso_etapa)
+            custo_etapa = custo_chamada(self.precos, provedor.model_name, uso_etapa)
+            uso["custo_usd"] = uso.get("custo_usd", 0.0) + custo_etapa
+            em_cache = em_cache and uso_etapa.get("em_cache", False)
+            if etapa == len(self.provedores) - 1:
+                uso_forte, custo_forte = uso_etapa, custo_etapa
+            elif estimativa is None and uso_etapa.get("tokens_entrada"):
+                estimativa = self._custo_so_forte(provedor, uso_etapa)
+
+            motivo = self.motivo_incerteza(json_data, schema)
+            if motivo is None or etapa == len(self.provedores) - 1:
+                break
+            motivos.append(motivo)
+        uso["em_cache"] = em_cache
+
+        with self._lock:
+            self.metricas["chamadas"] += 1
+            self.metricas["escaladas"] += bool(motivos)
+            self.metricas["motivos"].update(motivos)
+            self.metricas["custo_real"] += uso["custo_usd"]
+            self._registrar_custo_forte(contar_blocos(schema), uso_forte, custo_forte, estimativa)
+            if json_data is None:
+                self.metricas["falhas"] += 1
+            else:
+                self.metricas["respondidas_por"][provedor.model_name] += 1
+        if json_data is None:
             return None
+
+        json_data = {campo: valor for campo, valor in json_data.items() if campo != "_uso"}
+        if contar_blocos(schema) == 1:
+            return dict(json_data, modelo_cascata=provedor.model_name)
+        return {campo: dict(bloco, modelo_cascata=provedor.model_name) for campo, bloco in json_data.items()}
+
+    def suporta_streaming(self):
+        return any(provedor.suporta_streaming() for provedor in self.provedores)
+
+    def modelos_cobrados(self):
+        return [provedor.model_name for provedor in self.provedores]
+
+    def provedores_internos(self):
+        return list(self.provedores)
+
+    def cascata_stats(self):
+        """
+        Escalonamentos, quem respondeu e custo real x custo de mandar tudo ao último modelo.
+        O custo só com o último modelo é o medido nas chamadas que chegaram a ele; nas outras,
+        o custo médio dele por chamada (ou, sem nenhuma medida ainda, a estimativa pelos
+        tokens da primeira etapa).
+        """
+        with self._lock:
+            m = dict(self.metricas)
+            custo_so_forte = m["custo_forte_medido"]
+            for blocos, (n, estimativa) in self._sem_forte.items():
+                soma, medidas = self._custo_forte.get(blocos, (0.0, 0))
+                custo_so_forte += n * soma / medidas if medidas else estimativa
+        return {
+            "chamadas": m["chamadas"],
+            "escaladas": m["escaladas"],
+            "taxa_escalonamento": m["escaladas"] / m["chamadas"] if m["chamadas"] else 0.0,
+            "falhas": m["falhas"],
+            "respondidas_por": dict(m["respondidas_por"]),
+            "motivos": dict(m["motivos"]),
+            "custo_real": m["custo_real"],
+            "custo_so_forte": custo_so_forte,
+            "economia": custo_so_forte - m["custo_real"],
+        }
+
+    def close(self):
+        for provedor in self.provedores:
+            provedor.close()
+
+
+# --- Hedge (chamada duplicada quando a primeira demora demais) ---
+
+class _RepasseNotas:
+    """
+    Repassa ao ExtratorNotas do hedge as notas da chamada original e da cópia (threads
+    diferentes) até a chamada terminar; as da requisição que perdeu, se chegarem
+    depois, são descartadas.
+    """
+    def __init__(self, extrator):
+        self._extrator = extrator
+        self._lock = threading.Lock()
+        self._aberto = True
+
+    def __call__(self, bloco, nota):
+        with self._lock:
+            if self._aberto:
+                self._extrator.entregar(bloco, nota)
+
+    def encerrar(self):
+        with self._lock:
+            self._aberto = False
+
+class HedgedProvider(BaseLLMProvider):
+    """
+    Corta a cauda de latência de um provedor: se a chamada não volta até o
+    'percentil' das latências já observadas, uma cópia dela vai para a 'reserva'
+    (outro provedor ou, com reserva=None, o próprio provedor: outra réplica da API)
+    e vale a primeira resposta válida. A que perder não é cancelada (a requisição
+    HTTP já foi feita) e é cobrada normalmente quando terminar. O hedge não faz
+    chamadas: cache, limite de taxa, retentativas e disjuntor são os dos provedores
+    internos, e o resumo da execução mostra os deles.
+
+    O gasto extra tem teto: no máximo 'fracao_maxima' das chamadas ganham cópia e,
+    com 'custo_maximo_extra' (USD), o custo das cópias para ali. Antes de
+    'min_amostras' latências observadas, nenhuma cópia é feita.
+    hedge_stats() compara o p99 observado com o que o provedor teria dado sozinho.
+    """
+    def __init__(self, principal, reserva=None, percentil=95, min_amostras=20, fracao_maxima=0.05,
+                 custo_maximo_extra=None, precos=None, janela_latencias=500):
+        nome = principal.model_name if reserva is None else f"hedge:{principal.model_name}|{reserva.model_name}"
+        super().__init__(nome, principal.max_concurrency, principal.n_candidatos)
+        self.principal = principal
+        self.reserva = reserva or principal
+        self.percentil = percentil
+        self.min_amostras = min_amostras
+        self.fracao_maxima = fracao_maxima
+        self.custo_maximo_extra = custo_maximo_extra
+        self.precos = precos or {}
+        # Cada chamada pode ocupar duas threads (original + cópia)
+        self._pool = ThreadPoolExecutor(max_workers=2 * principal.max_concurrency, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        # Latências do principal que definem o limiar: só as de chamadas sem cópia (uma
+        # chamada copiada já passou do limiar, e a latência dela depende da disputa)
+        self._latencias_principal = deque(maxlen=janela_latencias)
+        self.metricas = {"chamadas": 0, "hedges": 0, "hedges_venceram": 0, "hedges_negados": 0,
+                         "custo_extra": 0.0, "custo_tardio": 0.0}
+        # Latência de ponta a ponta de cada chamada e a que o principal sozinho teria dado
+        # (inclusive as que perderam para a cópia e terminaram depois: a cauda sem hedge)
+        self._latencias_com_hedge = []
+        self._latencias_sem_hedge = []
+
+    def _chamar(self, provedor, system_prompt, redacao_texto, schema, competencia, repasse):
+        inicio = time.perf_counter()
+        json_data = self._correcao_interna(provedor, system_prompt, redacao_texto, schema, competencia, repasse)
+        # ultimo_uso é por thread: lido aqui, na thread que fez a chamada
+        return json_data, provedor.ultimo_uso() or {}, time.perf_counter() - inicio
+
+    def _custo(self, provedor, uso_chamada):
+        return custo_chamada(self.precos, provedor.model_name, uso_chamada)
+
+    def _limiar(self):
+        """Tempo de espera antes da cópia: o percentil das latências do principal (None = sem cópia ainda)."""
+        with self._lock:
+            if len(self._latencias_principal) < max(2, self.min_amostras):
+                return None
+            return statistics.quantiles(self._latencias_principal, n=100)[self.percentil - 1]
+
+    def _reservar_hedge(self):
+        """True se o teto de gasto extra ainda permite uma cópia (e a conta)."""
+        with self._lock:
+            dentro_do_teto = (self.metricas["hedges"] + 1 <= self.fracao_maxima * self.metricas["chamadas"]
+                              and (self.custo_maximo_extra is None
+                                   or self.metricas["custo_extra"] < self.custo_maximo_extra))
+            self.metricas["hedges" if dentro_do_teto else "hedges_negados"] += 1
+            return dentro_do_teto
+
+    def _registrar_principal(self, latencia, sucesso, copiada):
+        """Latência do principal; só entra no limiar se a chamada terminou antes de uma cópia ser disparada."""
+        with self._lock:
+            if sucesso and not copiada:
+                self._latencias_principal.append(latencia)
+            self._latencias_sem_hedge.append(latencia)
+
+    def _terminou_tarde(self, futuro, provedor, hedge):
+        """Callback da requisição que perdeu: latência e custo entram quando ela termina."""
+        json_data, uso_chamada, latencia = futuro.result()
+        custo = self._custo(provedor, uso_chamada)
+        if not hedge:
+            # Perdeu para a cópia: houve cópia, então fica fora do limiar
+            self._registrar_principal(latencia, json_data is not None, copiada=True)
+        with self._lock:
+            self.metricas["custo_tardio"] += custo
+            if hedge:
+                self.metricas["custo_extra"] += custo
+
+    def _obter_correcao(self, system_prompt, redacao_texto, schema, uso):
+        with self._lock:
+            self.metricas["chamadas"] += 1
+        inicio = time.perf_counter()
+        # A competência é da thread que chamou: vai como argumento para as threads do pool.
+        # Cada requisição roda numa cópia do contexto, como no asyncio.to_thread: os spans
+        # abertos nas threads do pool levam os atributos da tarefa (redação, modelo, competência)
+        competencia = self.competencia_atual()
+        # Streaming: as notas das threads do pool vão para o extrator desta chamada
+        extrator = self.extrator_atual()
+        repasse = _RepasseNotas(extrator) if extrator is not None else None
+        principal = self._pool.submit(contextvars.copy_context().run, self._chamar, self.principal, system_prompt,
+                                      redacao_texto, schema, competencia, repasse)
+        pendentes = {principal: (self.principal, False)}
+
+        limiar = self._limiar()
+        copiada = False
+        if limiar is not None:
+            terminadas, _ = wait([principal], timeout=limiar)
+            if not terminadas and self._reservar_hedge():
+                copiada = True
+                with tracing.span("hedge", limiar_s=round(limiar, 3)):
+                    copia = self._pool.submit(contextvars.copy_context().run, self._chamar, self.reserva,
+                                              system_prompt, redacao_texto, schema, competencia, repasse)
+                pendentes[copia] = (self.reserva, True)
+
+        resposta, venceu_hedge = None, False
+        em_cache = True
+        while pendentes and resposta is None:
+            terminadas, _ = wait(list(pendentes), return_when=FIRST_COMPLETED)
+            for futuro in terminadas:
+                provedor, hedge = pendentes.pop(futuro)
+                json_data, uso_chamada, latencia = futuro.result()
+                for campo in ("tokens_entrada", "tokens_saida", "tokens_cache", "tentativas"):
+                    uso[campo] += uso_chamada.get(campo, 0) or 0
+                custo = self._custo(provedor, uso_chamada)
+                uso["custo_usd"] = uso.get("custo_usd", 0.0) + custo
+                em_cache = em_cache and uso_chamada.get("em_cache", False)
+                if hedge:
+                    with self._lock:
+                        self.metricas["custo_extra"] += custo
+                else:
+                    self._registrar_principal(latencia, json_data is not None, copiada=copiada)
+                if json_data is not None and resposta is None:
+                    resposta, venceu_hedge = json_data, hedge
+        uso["em_cache"] = em_cache
+        if repasse is not None:
+            repasse.encerrar()
+
+        # A que perdeu segue até o fim; latência e custo dela entram depois
+        for futuro, (provedor, hedge) in pendentes.items():
+            futuro.add_done_callback(lambda f, provedor=provedor, hedge=hedge: self._terminou_tarde(f, provedor, hedge))
+        with self._lock:
+            self._latencias_com_hedge.append(time.perf_counter() - inicio)
+            self.metricas["hedges_venceram"] += venceu_hedge
+        if resposta is None:
+            return None
+        return {campo: valor for campo, valor in resposta.items() if campo != "_uso"}
+
+    def suporta_streaming(self):
+        return self.principal.suporta_streaming() or self.reserva.suporta_streaming()
+
+    def modelos_cobrados(self):
+        return list(dict.fromkeys(self.principal.modelos_cobrados() + self.reserva.modelos_cobrados()))
+
+    def provedores_internos(self):
+        return [self.principal] if self.reserva is self.principal else [self.principal, self.reserva]
+
+    def cache_key(self, system_prompt, redacao_texto, schema=SCHEMA_COMPETENCIA, competencia=None):
+        # A resposta vai para o cache do provedor que respondeu; no lote, só o principal responde
+        return self.principal.cache_key(system_prompt, redacao_texto, schema, competencia)
+
+    def hedge_stats(self):
+        """Cópias disparadas, vencidas e negadas pelo teto, custo extra e latências com e sem hedge."""
+        with self._lock:
+            m = dict(self.metricas)
+            com_hedge = perf_stats.percentis(self._latencias_com_hedge)
+            sem_hedge = perf_stats.percentis(self._latencias_sem_hedge)
+        return dict(m, latencia_com_hedge=com_hedge, latencia_sem_hedge=sem_hedge)
+
+    def close(self):
+        # Espera as requisições que perderam terminarem (e serem contabilizadas)
+        self._pool.shutdown(wait=True)
+        self.principal.close()
+        if self.reserva is not self.principal:
+            self.reserva.close()
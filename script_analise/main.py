@@ -1,194 +1,636 @@
 # coding: utf-8
 from data_loader import DataLoader
-from llm_provider import GeminiProvider, OpenAIProvider # Importamos os provedores
+from llm_provider import (AbstractLLMProvider, GeminiProvider, OpenAIProvider, MockProvider, ReplayProvider, # Importamos os provedores
+                          LocalProvider, CascadeProvider, HedgedProvider,
+                          SCHEMA_COMPETENCIA, SCHEMA_COMPLETO)
+from response_cache import ResponseCache
+from retry_policy import CircuitBreaker, RetryPolicy
+from cost_tracker import CostTracker, custo_chamada
+from http_transport import transporte_compartilhado
+from rate_limiter import estimar_tokens
+from prompt_registry import Prompt, PromptRegistry
+from result_journal import ResultJournal
+from result_sink import MultiSink, TabelaNotas, abrir_sinks, ler_resultados
+from sharding import nome_arquivo_shard, parse_shard, shards_faltando
+import run_planner
+from batch_jobs import (LocalBatchBackend, STATUS_CONCLUIDO, STATUS_EM_ANDAMENTO, STATUS_FALHOU,
+                        escrever_jsonl, ler_jsonl, salvar_manifesto, carregar_manifesto)
 import metrics # Importamos nosso novo módulo de métricas
+import perf_stats
+import tracing
 import json
 import os
-import pandas as pd
 import time
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # --- CONFIGURAÇÕES DA EXECUÇÃO ---
 # Ajuste o nome do seu arquivo JSON principal aqui
 NOME_ARQUIVO_DB = "base_dados.json"
-# Quantas redações aleatórias você quer testar neste lote?
+# Quantas redações aleatórias você quer testar neste lote? (None = a base inteira; sobrescrito por --n)
 N_AMOSTRAS_TESTE = 5 
+# Amostragem estratificada (None = sorteio uniforme). Ex: {"estratos": ["fonte", "faixa_nota"], "alocacao": "neyman"}
+# Estratos: "fonte", "tema_geral" e "faixa_nota" (faixa da nota final humana); alocação "proporcional" ou "neyman".
+# Cada redação leva um peso amostral e as métricas também saem ponderadas (estimativa para o corpus inteiro).
+ESTRATIFICACAO = None
+# Semente do sorteio da amostra (None = uma amostra diferente a cada execução)
+SEMENTE_AMOSTRA = None
 # Arquivo de saída para os resultados
 ARQUIVO_SAIDA_CSV = "evaluation_results.csv"
-# Delay entre chamadas de API (em segundos) para evitar "Rate Limiting"
-DELAY_ENTRE_CHAMADAS_API = 1.0 
+# Formatos gravados durante a execução, linha a linha (mesmo nome-base do CSV):
+#   "csv", "jsonl" e "parquet" (este exige o pacote pyarrow; grava em row groups)
+FORMATOS_SAIDA = ["csv"]
+TAMANHO_ROW_GROUP_PARQUET = 5000
+# Modo de avaliação:
+#   "por_competencia": 5 chamadas por redação/modelo, uma por prompt cN_zero_shot.txt
+#   "completo": 1 chamada por redação/modelo com o prompt completo_zero_shot.txt (~5× menos
+#               chamadas e tokens de entrada). O CSV sai com as mesmas linhas por competência.
+MODO_AVALIACAO = "por_competencia"
+# Correção interativa: respostas em streaming, com a nota de cada competência lida assim que chega,
+# antes do raciocínio e da justificativa. O CSV ganha a coluna "tempo_ate_nota_s" e o resumo mostra
+# o p50 do tempo até a nota ao lado do da latência total. A nota só sai cedo se o modelo a escrever
+# antes do raciocinio_cot (ordem do schema); com AUTOCONSISTENCIA, ela sai no fim (é a de consenso).
+MODO_STREAMING = False
+# Pasta dos prompts e estratégia usada (arquivos c{N}_{estrategia}.txt e completo_{estrategia}.txt)
+DIRETORIO_PROMPTS = "prompts"
+ESTRATEGIA_PROMPT = "zero_shot"
+# Provedores avaliados:
+#   "reais":  GeminiProvider + OpenAIProvider (exige as chaves no .env)
+#   "mock":   MockProvider (sem rede; latência, erros e notas simulados conforme MOCK_CONFIG)
+#   "replay": ReplayProvider, um por modelo gravado em ARQUIVO_REPLAY (CSV de resultados ou journal.jsonl)
+#   "local":  LocalProvider, modelo GGUF quantizado na CPU (exige llama-cpp-python; ver MODELO_LOCAL)
+#   "cascata": CascadeProvider, modelo barato primeiro e o mais forte só nas correções incertas (ver CASCATA)
+PROVEDORES = "reais"
+MOCK_CONFIG = {"latencia": "lognormal", "latencia_media": 0.0, "taxa_erro": 0.0,
+               "tipo_erro": "503", "politica_nota": "hash", "semente": 42}
+ARQUIVO_REPLAY = "evaluation_results.csv"
+# Modelo local: arquivo GGUF, cópias do modelo (cada uma com núcleos/instâncias threads) e contexto
+MODELO_LOCAL = {"caminho_modelo": "modelos/qwen2.5-3b-instruct-q4_k_m.gguf", "n_instancias": 1, "n_ctx": 8192}
+# Self-consistency: cada chamada pede n_candidatos amostras numa única requisição (n da OpenAI,
+# candidate_count do Gemini) e a nota final é a da maioria (ou a mediana), ajustada às notas
+# válidas. A concordância entre as amostras vai para a coluna "concordancia" do CSV.
+# Com 1, desligado. Amostras a temperatura baixa quase nunca discordam: use uma maior.
+AUTOCONSISTENCIA = {"n_candidatos": 1, "agregacao": "maioria", "temperatura": 0.7}
+# Cascata (PROVEDORES = "cascata"): etapas em ordem crescente de custo ("provedor": openai, gemini,
+# mock ou local, mais os argumentos do provedor). Uma correção sobe para a etapa seguinte quando a
+# etapa falha, quando as amostras dela concordam menos que 'limiar_concordancia' (exige n_candidatos > 1)
+# ou quando a nota fica entre dois níveis. Com 'comparar_com_forte', a última etapa também avalia
+# tudo sozinha, para o relatório comparar o QWK da cascata com o dela. Custa uma segunda passada
+# do modelo mais forte: no modo async as duas rodam juntas e as correções escaladas são pagas duas vezes.
+CASCATA = {
+    "etapas": [{"provedor": "openai", "model_name": "gpt-4o-mini", "n_candidatos": 3, "temperature": 0.7},
+               {"provedor": "openai", "model_name": "gpt-4o"}],
+    "limiar_concordancia": 1.0,
+    "distancia_fronteira": 20,
+    "comparar_com_forte": False,
+}
+# Hedge contra a cauda de latência (None = desligado): se uma chamada não volta até o 'percentil' das
+# latências já observadas do provedor, uma cópia vai para a 'reserva' (None = o mesmo provedor, outra
+# réplica; ou uma etapa no formato das de CASCATA, ex: {"provedor": "gemini"}) e vale a primeira resposta.
+# Teto do gasto extra: no máximo 'fracao_maxima' das chamadas ganham cópia e, com 'custo_maximo_extra'
+# (USD), o custo das cópias para ali.
+# Ex: {"percentil": 95, "min_amostras": 20, "fracao_maxima": 0.05, "custo_maximo_extra": None, "reserva": None}
+HEDGE = None
+# Modo async: agenda todas as avaliações (redação × modelo × competência) de uma vez.
+# Com False, volta ao loop sequencial original (uma chamada por vez).
+MODO_ASYNC = True
+# Amostragem sequencial (adaptativa): em vez de avaliar todas as redações de uma vez, avalia em
+# lotes de 'tamanho_lote' e, após cada lote, calcula por bootstrap (reamostrando redações) o IC do
+# QWK e do Pearson de cada modelo. O modelo para assim que a largura dos dois ICs fica abaixo de
+# 'largura_alvo' (e já avaliou 'min_redacoes'). N_AMOSTRAS_TESTE (ou --n) vira o teto de redações.
+MODO_ADAPTATIVO = False
+AMOSTRAGEM_SEQUENCIAL = {"tamanho_lote": 20, "min_redacoes": 40, "largura_alvo": 0.10,
+                         "confianca": 0.95, "reamostras": 1000}
+# Modo async: dentro de cada janela de N redações, as chamadas são agendadas por competência
+# (todas as C1, depois todas as C2...), para que chamadas com o mesmo prompt saiam em sequência
+# e aproveitem o cache de prefixo dos provedores. 1 = redação a redação (ordem antiga).
+JANELA_AGRUPAMENTO_PREFIXO = 25
+# Máximo de requisições simultâneas por provedor (só usado no modo async)
+CONCORRENCIA_GEMINI = 4
+CONCORRENCIA_OPENAI = 8
+# Cotas de cada provedor (requisições e tokens por minuto) para evitar "Rate Limiting".
+# O limitador reduz a taxa sozinho ao receber 429 e volta à cota quando os erros param.
+LIMITES_GEMINI = {"rpm": 1000, "tpm": 1_000_000}
+LIMITES_OPENAI = {"rpm": 500, "tpm": 200_000}
+# Retentativas de erros transitórios (timeout, 429, 5xx, JSON malformado) com backoff
+# exponencial e jitter. Erros fatais (chave inválida, 400...) não são repetidos.
+RETENTATIVAS = {"max_tentativas": 4, "espera_base": 1.0, "espera_maxima": 30.0}
+# Disjuntor por provedor: após 'limite_falhas' falhas seguidas, pausa o provedor por
+# 'tempo_pausa' segundos (dobrando a cada novo disparo) em vez de gastar a cota à toa.
+CIRCUIT_BREAKER = {"limite_falhas": 5, "tempo_pausa": 30.0, "tempo_pausa_maximo": 300.0}
+# Conexões HTTP da OpenAI: um pool de longa duração, dividido por todos os provedores OpenAI da
+# execução e do tamanho da soma das concorrências deles, com keep-alive (segundos) e timeouts
+# explícitos (segundos). "http2" exige `pip install h2`. O Gemini fala gRPC (um único canal HTTP/2
+# multiplexado); dele vale só o timeout_leitura, como prazo de cada chamada.
+TRANSPORTE_HTTP = {"timeout_conexao": 5.0, "timeout_leitura": 120.0, "timeout_pool": 30.0,
+                   "keepalive_s": 90.0, "http2": False}
+# Cache de contexto do Gemini: a rubrica (system prompt) fica guardada no servidor
+# e não é reenviada/retokenizada a cada chamada. Exige prompts acima do mínimo de tokens da API.
+USAR_CACHE_CONTEXTO_GEMINI = False
+# Cache persistente das respostas (SQLite). Reexecuções não pagam de novo por
+# correções já feitas com o mesmo prompt, redação, modelo e configuração.
+USAR_CACHE = True
+ARQUIVO_CACHE = "cache_respostas.sqlite"
+CACHE_MAX_ENTRADAS = 200_000
+CACHE_MAX_IDADE_DIAS = 90
+# Modo lote (batch) offline: pasta dos lotes e backend usado no envio.
+#   "provedor": endpoint de lote do próprio provedor quando existir (ex: OpenAI Batch API)
+#   "local":    substituto local baseado em arquivos (processa as chamadas no poll)
+DIRETORIO_LOTES = "lotes"
+BATCH_BACKEND = "provedor"
+INTERVALO_POLL_SEGUNDOS = 60
+# Preços (USD por milhão de tokens) para a contabilidade de custo. "entrada_cache" é o
+# preço dos tokens de entrada servidos do cache do provedor. Modelos fora da tabela custam 0.
+PRECOS_POR_MILHAO = {
+    "gemini-2.5-flash-preview-09-2025": {"entrada": 0.30, "saida": 2.50, "entrada_cache": 0.075},
+    "gpt-4o-mini": {"entrada": 0.15, "saida": 0.60, "entrada_cache": 0.075},
+    "gpt-4o": {"entrada": 2.50, "saida": 10.00, "entrada_cache": 1.25},
+    "mock": {"entrada": 0.15, "saida": 0.60, "entrada_cache": 0.075},
+    "mock-forte": {"entrada": 2.50, "saida": 10.00, "entrada_cache": 1.25},
+}
+# Orçamento máximo (USD) de uma execução: ao atingi-lo, nenhuma chamada nova é feita e o que
+# já terminou é salvo normalmente. None = sem limite (sobrescrito por --max-cost).
+ORCAMENTO_MAXIMO_USD = None
+# Planejamento (--dry-run): estima chamadas, tokens, tempo e custo da amostra sem chamar as APIs.
+# Tokens de saída e latência vêm da execução anterior em ARQUIVO_SAIDA_CSV, se houver;
+# senão, das suposições abaixo (tokens de saída por competência e latência por chamada em cada modo).
+PLANO_SUPOSICOES = {"tokens_saida_por_competencia": 400,
+                    "latencia_s": {"por_competencia": 4.0, "completo": 12.0}}
+# Trace das etapas de cada tarefa (prompt, requisição, chamada, parse, validação, gravação),
+# no formato do chrome://tracing / Perfetto. None = desligado (sobrescrito por --trace).
+ARQUIVO_TRACE = None
+# Diário das execuções (um JSONL por execução, gravado a cada avaliação concluída).
+# Uma execução interrompida pode ser retomada com: python main.py --resume <run_id>
+DIRETORIO_EXECUCOES = "execucoes"
 
-def carregar_prompt(nome_arquivo):
-    """Lê um arquivo de prompt da pasta /prompts."""
-    caminho = os.path.join("prompts", nome_arquivo)
+# Custos da execução (totais ao vivo e orçamento); recriado a cada run_evaluation_batch
+_custos = CostTracker(PRECOS_POR_MILHAO)
+
+def iniciar_custos(orcamento=None):
+    """Zera os totais de custo e define o orçamento da execução."""
+    global _custos
+    _custos = CostTracker(PRECOS_POR_MILHAO, orcamento)
+    return _custos
+
+# Registro de prompts da execução: carregado uma única vez, na primeira chamada
+_registro_prompts = None
+_lock_registro_prompts = threading.Lock()
+
+def obter_registro_prompts():
+    """Retorna o PromptRegistry da pasta /prompts (lido do disco só uma vez)."""
+    global _registro_prompts
+    with _lock_registro_prompts:
+        if _registro_prompts is None:
+            _registro_prompts = PromptRegistry(DIRETORIO_PROMPTS)
+    return _registro_prompts
+
+def carregar_prompt(comp_id, estrategia=None):
+    """
+    Prompt (nome, texto e hash) da competência comp_id, ou do modo
+    "completo" se comp_id=None. Servido da memória; None se não existir.
+    """
+    with perf_stats.medir("carregar_prompt"):
+        return obter_registro_prompts().get_competencia(comp_id, estrategia or ESTRATEGIA_PROMPT)
+
+# Retorno de chamar_modelo quando a chamada não foi feita por falta de orçamento
+# (não é falha da API: o aviso "orçamento esgotado" sai uma vez só, no CostTracker)
+ORCAMENTO_ESGOTADO = "orcamento_esgotado"
+
+def chamar_modelo(modelo, prompt, redacao_teste, comp_id, schema=SCHEMA_COMPETENCIA):
+    """
+    get_correction com orçamento e contabilidade de custo: a chamada só é feita se
+    o custo estimado cabe no orçamento, e o custo real (inclusive de tentativas que
+    falharam) é lançado por modelo, competência e redação. A latência vai para o benchmark.
+    Retorna o JSON da LLM (com "_uso"), None se a API falhou ou ORCAMENTO_ESGOTADO.
+    """
+    input_data = redacao_teste['input']
+    competencia = "C1-C5" if comp_id is None else f"C{comp_id}"
+    uso_estimado = {"tokens_entrada": estimar_tokens(prompt.texto) + estimar_tokens(input_data['texto']),
+                    "tokens_saida": modelo.TOKENS_SAIDA_ESTIMADOS * (5 if comp_id is None else 1) * modelo.n_candidatos}
+    # Numa cascata, reserva o pior caso: a chamada passando por todas as etapas
+    custo_estimado = sum(_custos.custo(nome, uso_estimado) for nome in modelo.modelos_cobrados())
+    if not _custos.reservar(custo_estimado):
+        # O aviso sai uma vez só (CostTracker); o total de chamadas puladas vai para o resumo
+        return ORCAMENTO_ESGOTADO
+
+    inicio = time.perf_counter()
     try:
-        with open(caminho, 'r', encoding='utf-8') as f:
-            return f.read()
-    except Exception as e:
-        print(f"Erro ao carregar prompt: {caminho}. {e}")
+        if MODO_STREAMING:
+            resultado_json = modelo.get_correction_stream(prompt.texto, input_data['texto'], schema=schema,
+                                                          competencia=comp_id)
+        else:
+            resultado_json = modelo.get_correction(prompt.texto, input_data['texto'], schema=schema,
+                                                   competencia=comp_id)
+    finally:
+        _custos.liberar(custo_estimado)
+    perf_stats.registrar_chamada(modelo.model_name, "completo" if comp_id is None else competencia,
+                                 time.perf_counter() - inicio, resultado_json is not None)
+
+    uso = modelo.ultimo_uso()
+    if uso is not None:
+        if uso.get("custo_usd") is None:
+            # A cascata já traz o custo somado das etapas, cada uma com o seu preço
+            uso["custo_usd"] = _custos.custo(modelo.model_name, uso)
+        _custos.registrar(modelo.model_name, input_data['id'], competencia, uso["custo_usd"], uso)
+    return resultado_json
+
+def avaliar_competencia(modelo, redacao_teste, comp_id):
+    """
+    Avalia UMA competência de UMA redação com UM modelo.
+    Retorna a linha detalhada para o CSV ou None em caso de falha.
+    """
+    input_data = redacao_teste['input']
+
+    # 3a. Carregar o prompt
+    prompt = carregar_prompt(comp_id)
+    if not prompt:
+        print(f"[FALHA] Prompt {PromptRegistry.nome_arquivo(comp_id, ESTRATEGIA_PROMPT)} não encontrado. Pulando C{comp_id}.")
+        return None
+
+    # 3b. Chamar a API (o limitador de taxa do provedor segura a chamada se preciso)
+    resultado_json = chamar_modelo(modelo, prompt, redacao_teste, comp_id)
+
+    if resultado_json is ORCAMENTO_ESGOTADO:
+        return None
+    if not resultado_json:
+        print(f"[FALHA] API falhou para C{comp_id} ({modelo.model_name}, {input_data['id']}). Pulando.")
         return None
 
-def run_evaluation_batch(n_samples, output_csv):
+    # 3c. Coletar resultados
+    return linhas_do_resultado(modelo, redacao_teste, comp_id, prompt, resultado_json)[0]
+
+def avaliar_redacao_completa(modelo, redacao_teste):
     """
-    Função principal (Fase 6 - Lote).
-    Avalia N redações por completo (C1 a C5) e calcula as métricas agregadas.
+    Modo "completo": avalia as 5 competências de UMA redação em UMA chamada.
+    Retorna as 5 linhas detalhadas (mesmo formato do modo por competência)
+    ou uma lista vazia em caso de falha.
     """
-    
-    print("Iniciando execução em lote (Fase 6)...")
-    
-    # --- 1. Carregar Dados ---
-    print(f"\n--- Carregando {n_samples} redações de '{NOME_ARQUIVO_DB}' ---")
-    loader = DataLoader(NOME_ARQUIVO_DB)
-    amostra_redacoes = loader.get_sample(n=n_samples)
-    
-    if not amostra_redacoes:
-        print("Não foi possível carregar amostra. Verifique o DataLoader e o JSON. Abortando.")
-        return
-    
-    print(f"[OK] {len(amostra_redacoes)} redações carregadas.")
+    input_data = redacao_teste['input']
 
-    # --- 2. Inicializar Modelos ---
-    modelos_para_testar = [
-        GeminiProvider(),
-        OpenAIProvider()
-    ]
+    prompt = carregar_prompt(None)
+    if not prompt:
+        print(f"[FALHA] Prompt {PromptRegistry.nome_arquivo(None, ESTRATEGIA_PROMPT)} não encontrado. Pulando redação.")
+        return []
 
-    # --- 3. Loop de Execução ---
-    
-    # Listas mestras para armazenar TODOS os resultados para o CSV final
-    lista_resultados_finais = []
-    
-    # Listas para métricas agregadas (notas de competências individuais)
-    # Vamos armazenar cada par (humano, llm)
-    master_scores_competencias = []
-    # Lista para métricas de nota final
-    master_scores_finais = []
+    resultado_json = chamar_modelo(modelo, prompt, redacao_teste, None, schema=SCHEMA_COMPLETO)
+
+    if resultado_json is ORCAMENTO_ESGOTADO:
+        return []
+    if not resultado_json:
+        print(f"[FALHA] API falhou para C1-C5 ({modelo.model_name}, {input_data['id']}). Pulando.")
+        return []
+
+    return linhas_do_resultado(modelo, redacao_teste, None, prompt, resultado_json)
+
+def linhas_do_resultado(modelo, redacao_teste, comp_id, prompt, resultado_json):
+    """
+    Converte a resposta de UMA chamada em linhas do CSV.
+    comp_id=None indica uma resposta do modo "completo" (blocos c1 a c5);
+    nele, tokens e custo da chamada são divididos igualmente entre as 5 linhas.
+    """
+    uso = resultado_json.get("_uso")
+    if comp_id is None:
+        return [
+            montar_linha(modelo, redacao_teste, prompt, c, resultado_json[f"c{c}"], uso, fracao=0.2)
+            for c in range(1, 6)
+        ]
+    return [montar_linha(modelo, redacao_teste, prompt, comp_id, resultado_json, uso)]
+
+def montar_linha(modelo, redacao_teste, prompt, comp_id, resultado_json, uso=None, fracao=1.0):
+    """
+    Monta a linha detalhada do CSV para uma competência avaliada.
+    O hash do prompt vai junto, para saber exatamente qual versão gerou a nota.
+    'uso' é o uso de tokens da chamada; 'fracao' é a parte dela atribuída a esta linha.
+    """
+    input_data = redacao_teste['input']
+    ground_truth = redacao_teste['ground_truth']
+
+    nota_llm = int(resultado_json.get('nota_atribuida', 0))
+    nota_h = int(ground_truth['competencias'][comp_id]['nota'])
+
+    return {
+        "redacao_id": input_data['id'],
+        "modelo": modelo.model_name,
+        "prompt": prompt.nome,
+        "prompt_hash": prompt.hash,
+        "competencia": f"C{comp_id}",
+        "nota_humano": nota_h,
+        "nota_llm": nota_llm,
+        "diferenca": nota_llm - nota_h,
+        "raciocinio_cot": resultado_json.get('raciocinio_cot'),
+        "justificativa_aluno": resultado_json.get('justificativa_para_aluno'),
+        # Self-consistency: fração das amostras que deram a nota final (só com AUTOCONSISTENCIA)
+        **({"concordancia": round(resultado_json["concordancia"], 4)} if "concordancia" in resultado_json else {}),
+        # Cascata: o modelo que deu a nota
+        **({"modelo_cascata": resultado_json["modelo_cascata"]} if "modelo_cascata" in resultado_json else {}),
+        # Streaming: segundos do início da chamada até a nota desta competência (só com MODO_STREAMING)
+        **coluna_tempo_ate_nota(uso, comp_id),
+        **colunas_de_uso(modelo, uso, fracao)
+    }
+
+def coluna_tempo_ate_nota(uso, comp_id):
+    tempos = (uso or {}).get("tempos_ate_nota")
+    if not tempos:
+        return {}
+    # Modo por competência: a nota da chamada (bloco None); modo completo: a do bloco cN
+    tempo = tempos.get(f"c{comp_id}", tempos.get(None))
+    return {"tempo_ate_nota_s": None if tempo is None else round(tempo, 4)}
+
+def colunas_de_uso(modelo, uso, fracao=1.0):
+    """Colunas de tokens, latência e custo de uma linha (vazias se o uso não é conhecido)."""
+    if not uso:
+        return {"tokens_entrada": None, "tokens_saida": None, "tokens_cache": None,
+                "latencia_s": None, "custo_usd": None}
+    custo = uso.get("custo_usd")
+    if custo is None:
+        custo = custo_chamada(PRECOS_POR_MILHAO, modelo.model_name, uso)
+    latencia = uso.get("latencia_s")
+    return {
+        "tokens_entrada": round(uso.get("tokens_entrada", 0) * fracao, 1),
+        "tokens_saida": round(uso.get("tokens_saida", 0) * fracao, 1),
+        "tokens_cache": round(uso.get("tokens_cache", 0) * fracao, 1),
+        "latencia_s": None if latencia is None else round(latencia, 4),
+        "custo_usd": round(custo * fracao, 8),
+    }
+
+def atributos_tarefa(redacao_teste, modelo, comp_id):
+    """Redação, modelo e competência de uma tarefa (atributos dos spans do trace)."""
+    return {"redacao_id": redacao_teste['input']['id'], "modelo": modelo.model_name,
+            "competencia": "C1-C5" if comp_id is None else f"C{comp_id}"}
+
+def executar_tarefa(modelo, redacao_teste, comp_id):
+    """
+    Executa uma unidade de trabalho e devolve a lista de linhas produzidas.
+    comp_id=None significa o modo "completo" (as 5 competências de uma vez).
+    """
+    # Os spans internos (prompt, chamada, parse...) herdam redação, modelo e competência
+    with tracing.span("tarefa", **atributos_tarefa(redacao_teste, modelo, comp_id)):
+        if comp_id is None:
+            return avaliar_redacao_completa(modelo, redacao_teste)
+        linha = avaliar_competencia(modelo, redacao_teste, comp_id)
+        return [linha] if linha else []
+
+def competencias_por_tarefa(modo_avaliacao):
+    """Lista de comp_id agendados por (redação, modelo) no modo escolhido."""
+    if modo_avaliacao == "completo":
+        return [None]
+    return list(range(1, 6))
+
+def tarefa_pendente(concluidas, redacao_teste, modelo, comp_id):
+    """
+    True se a tarefa ainda não está no diário da execução.
+    No modo "completo", a tarefa só está feita se as 5 competências estão.
+    """
+    redacao_id = redacao_teste['input']['id']
+    comps = range(1, 6) if comp_id is None else [comp_id]
+    return any((redacao_id, modelo.model_name, f"C{c}") not in concluidas for c in comps)
+
+def ordenar_por_prefixo(pendentes, janela=JANELA_AGRUPAMENTO_PREFIXO):
+    """
+    Reordena as tarefas (redação, modelo, comp_id) para favorecer o cache de prefixo:
+    dentro de cada janela de 'janela' redações, agrupa por competência (mesmo system
+    prompt). Uma interrupção deixa no máximo uma janela de redações incompletas.
+    """
+    indices = {}
+    for redacao_teste, _, _ in pendentes:
+        indices.setdefault(redacao_teste['input']['id'], len(indices))
+    janela = max(1, janela)
+
+    def chave(tarefa):
+        indice = indices[tarefa[0]['input']['id']]
+        return indice // janela, tarefa[2] or 0, indice
+    return sorted(pendentes, key=chave)
+
+def linhas_novas(linhas, concluidas):
+    """
+    Descarta as linhas que já estão no diário. Só acontece no modo "completo",
+    quando uma redação incompleta é refeita e a resposta traz as 5 competências.
+    """
+    if not concluidas:
+        return linhas
+    return [linha for linha in linhas if ResultJournal.chave(linha) not in concluidas]
+
+def executar_sequencial(amostra_redacoes, modelos_para_testar, modo_avaliacao=MODO_AVALIACAO,
+                        sink=None, concluidas=frozenset()):
+    """
+    Modo original: percorre redações × modelos × competências uma chamada por vez.
+    Tarefas em 'concluidas' são puladas; as linhas novas vão para o sink
+    (diário, CSV, tabela de notas) assim que a tarefa termina.
+    Retorna quantas linhas foram geradas.
+    """
+    total_linhas = 0
 
-    start_time_total = time.time()
-    
     # Loop Principal (N Redações)
     for i, redacao_teste in enumerate(amostra_redacoes):
-        input_data = redacao_teste['input']
-        ground_truth = redacao_teste['ground_truth']
-        redacao_id = input_data['id']
-        
+        redacao_id = redacao_teste['input']['id']
         print(f"\n--- [Redação {i+1}/{len(amostra_redacoes)}] ID: {redacao_id} ---")
 
         # Loop de Modelos (Gemini, GPT, etc)
         for modelo in modelos_para_testar:
             print(f"Avaliando com: {modelo.__class__.__name__} ({modelo.model_name})")
-            
-            notas_llm_redacao = []
-            notas_humano_redacao = []
-
-            # Loop de Competências (C1 a C5)
-            for comp_id in range(1, 6):
-                # print(f"  Avaliando Competência {comp_id}...") # Log muito verboso
-                
-                # 3a. Carregar o prompt
-                nome_prompt = f"c{comp_id}_zero_shot.txt"
-                prompt_texto = carregar_prompt(nome_prompt)
-                if not prompt_texto:
-                    print(f"[FALHA] Prompt {nome_prompt} não encontrado. Pulando C{comp_id}.")
-                    continue
-                
-                # Adiciona delay para não bater o limite da API
-                time.sleep(DELAY_ENTRE_CHAMADAS_API)
-
-                # 3b. Chamar a API
-                resultado_json = modelo.get_correction(prompt_texto, input_data['texto'])
-                
-                if not resultado_json:
-                    print(f"[FALHA] API falhou para C{comp_id}. Pulando.")
+
+            # Loop de Competências (C1 a C5, ou uma única chamada no modo "completo")
+            for comp_id in competencias_por_tarefa(modo_avaliacao):
+                if not tarefa_pendente(concluidas, redacao_teste, modelo, comp_id):
                     continue
+                linhas = linhas_novas(executar_tarefa(modelo, redacao_teste, comp_id), concluidas)
+                if sink is not None:
+                    with perf_stats.medir("gravacao", **atributos_tarefa(redacao_teste, modelo, comp_id)):
+                        sink.write(linhas)
+                total_linhas += len(linhas)
 
-                # 3c. Coletar resultados
-                nota_llm = int(resultado_json.get('nota_atribuida', 0))
-                nota_h = int(ground_truth['competencias'][comp_id]['nota'])
-                
-                notas_llm_redacao.append(nota_llm)
-                notas_humano_redacao.append(nota_h)
-                
-                # Adiciona o par de notas à lista mestra de competências
-                master_scores_competencias.append({
-                    "modelo": modelo.model_name,
-                    "humano": nota_h,
-                    "llm": nota_llm
-                })
-                
-                # Salva o resultado detalhado para o CSV
-                lista_resultados_finais.append({
-                    "redacao_id": redacao_id,
-                    "modelo": modelo.model_name,
-                    "prompt": nome_prompt,
-                    "competencia": f"C{comp_id}",
-                    "nota_humano": nota_h,
-                    "nota_llm": nota_llm,
-                    "diferenca": nota_llm - nota_h,
-                    "raciocinio_cot": resultado_json.get('raciocinio_cot'),
-                    "justificativa_aluno": resultado_json.get('justificativa_para_aluno')
-                })
-            
-            # Fim do loop de competências (C1-C5)
-            if len(notas_llm_redacao) == 5:
-                # Se todas as 5 competências foram avaliadas, calcula os totais
-                total_humano = sum(notas_humano_redacao)
-                total_llm = sum(notas_llm_redacao)
-                
-                # Adiciona os totais à lista mestra de notas finais
-                master_scores_finais.append({
-                    "modelo": modelo.model_name,
-                    "humano": total_humano,
-                    "llm": total_llm
-                })
-                print(f"  -> Concluído. Nota Humano: {total_humano} | Nota LLM: {total_llm}")
-            else:
-                print(f"  -> Incompleto. Não foi possível calcular nota final.")
-    
-    # --- 4. Fim dos Loops (Salvando Resultados) ---
-    end_time_total = time.time()
-    print(f"\n--- Execução em Lote Concluída ---")
-    print(f"Tempo total: {end_time_total - start_time_total:.2f} segundos")
-    print(f"Total de redações avaliadas: {len(amostra_redacoes)}")
-    print(f"Total de avaliações de competências: {len(lista_resultados_finais)}")
+    return total_linhas
 
-    if not lista_resultados_finais:
-        print("Nenhum resultado foi gerado. Abortando.")
-        return
+async def _executar_async(amostra_redacoes, modelos_para_testar, modo_avaliacao, sink, concluidas):
+    """
+    Agenda TODAS as tarefas (redação, modelo, competência) de uma vez.
+    Cada provedor tem seu próprio semáforo (max_concurrency), então um
+    provedor lento não segura as chamadas do outro.
+    """
+    # As chamadas dos SDKs são bloqueantes: rodam em threads.
+    # O pool precisa comportar a soma dos limites de todos os provedores.
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(
+        max_workers=sum(modelo.max_concurrency for modelo in modelos_para_testar)
+    ))
 
-    # 4a. Criar e Salvar o DataFrame
-    df = pd.DataFrame(lista_resultados_finais)
-    try:
-        df.to_csv(output_csv, index=False, encoding='utf-8-sig')
-        print(f"\n[OK] Resultados detalhados salvos em '{output_csv}'")
-    except Exception as e:
-        print(f"\n[FALHA] Não foi possível salvar o CSV: {e}")
+    semaforos = {id(modelo): asyncio.Semaphore(modelo.max_concurrency) for modelo in modelos_para_testar}
+    pendentes = ordenar_por_prefixo([
+        (redacao_teste, modelo, comp_id)
+        for redacao_teste in amostra_redacoes
+        for modelo in modelos_para_testar
+        for comp_id in competencias_por_tarefa(modo_avaliacao)
+        if tarefa_pendente(concluidas, redacao_teste, modelo, comp_id)
+    ])
+    total_tarefas = len(pendentes)
+    progresso = {"concluidas": 0, "linhas": 0}
+
+    async def tarefa(redacao_teste, modelo, comp_id):
+        atributos = atributos_tarefa(redacao_teste, modelo, comp_id)
+        semaforo = semaforos[id(modelo)]
+        # Tempo na fila do provedor (todas as vagas de concorrência ocupadas)
+        with tracing.span("espera_concorrencia", **atributos):
+            await semaforo.acquire()
+        try:
+            linhas = await asyncio.to_thread(executar_tarefa, modelo, redacao_teste, comp_id)
+        finally:
+            semaforo.release()
+        # Vai para o diário e para os arquivos de saída assim que chega (sobrevive a crash / Ctrl-C).
+        # As linhas saem na ordem de conclusão, não na de agendamento.
+        linhas = linhas_novas(linhas, concluidas)
+        if sink is not None:
+            with perf_stats.medir("gravacao", **atributos):
+                sink.write(linhas)
+        progresso["concluidas"] += 1
+        progresso["linhas"] += len(linhas)
+        if progresso["concluidas"] % 25 == 0 or progresso["concluidas"] == total_tarefas:
+            print(f"  Progresso: {progresso['concluidas']}/{total_tarefas} chamadas concluídas "
+                  f"| custo até agora ${_custos.gasto:.4f}")
+
+    print(f"Agendando {total_tarefas} chamadas em modo async ({modo_avaliacao})...")
+    tarefas = [tarefa(redacao_teste, modelo, comp_id) for redacao_teste, modelo, comp_id in pendentes]
+    await asyncio.gather(*tarefas)
+    return progresso["linhas"]
+
+def executar_async(amostra_redacoes, modelos_para_testar, modo_avaliacao=MODO_AVALIACAO,
+                   sink=None, concluidas=frozenset()):
+    """Ponto de entrada síncrono para o modo async. Retorna quantas linhas foram geradas."""
+    return asyncio.run(_executar_async(amostra_redacoes, modelos_para_testar, modo_avaliacao, sink, concluidas))
+
+def intervalos_modelo(tabela, modelo_nome, confianca=0.95, reamostras=1000):
+    """
+    ICs por bootstrap do QWK e do Pearson das notas de competência do modelo, reamostrando
+    redações inteiras. Retorna {"n_redacoes": n, "qwk": (est, inf, sup), "pearson": (...)}.
+    """
+    humano, llm = tabela.scores_competencias(modelo_nome)
+    grupos = tabela.redacoes_competencias(modelo_nome)
+    return {
+        "n_redacoes": len(set(grupos.tolist())),
+        "qwk": metrics.bootstrap_ic(humano, llm, metrics.calculate_qwk, grupos, reamostras, confianca),
+        "pearson": metrics.bootstrap_ic(humano, llm, metrics.calculate_pearson, grupos, reamostras, confianca),
+    }
+
+def formatar_intervalos(intervalos):
+    partes = []
+    for nome, rotulo in (("qwk", "QWK"), ("pearson", "r")):
+        ic = intervalos[nome]
+        partes.append(f"{rotulo} --" if ic is None else
+                      f"{rotulo} {ic[0]:.3f} [{ic[1]:.3f}, {ic[2]:.3f}] (largura {ic[2] - ic[1]:.3f})")
+    return " | ".join(partes)
+
+def executar_ate_convergir(amostra_redacoes, modelos_para_testar, modo_avaliacao, sink, concluidas, tabela,
+                           modo_async=MODO_ASYNC, config=AMOSTRAGEM_SEQUENCIAL):
+    """
+    Amostragem sequencial: avalia as redações em lotes (na ordem sorteada da amostra)
+    e, depois de cada lote, recalcula os ICs de cada modelo ainda ativo a partir da
+    tabela de notas. Um modelo sai da execução quando os ICs do QWK e do Pearson ficam
+    mais estreitos que config["largura_alvo"]; a execução termina quando todos saem,
+    a amostra acaba ou o orçamento se esgota. Retorna quantas linhas foram geradas.
+    """
+    executar = executar_async if modo_async else executar_sequencial
+    ativos = list(modelos_para_testar)
+    intervalos_finais = {}
+    total_linhas = 0
+    tamanho_lote = max(1, config["tamanho_lote"])
 
-    # --- 5. Exibir Métricas Agregadas ---
+    for inicio in range(0, len(amostra_redacoes), tamanho_lote):
+        lote = amostra_redacoes[inicio:inicio + tamanho_lote]
+        total_linhas += executar(lote, ativos, modo_avaliacao, sink, concluidas)
+
+        print(f"\n--- [Amostragem sequencial] {inicio + len(lote)}/{len(amostra_redacoes)} redações sorteadas ---")
+        for modelo in list(ativos):
+            if modelo.model_name not in tabela.modelos:
+                print(f"  {modelo.model_name}: nenhuma avaliação ainda.")
+                continue
+            with perf_stats.medir("bootstrap"):
+                intervalos = intervalos_modelo(tabela, modelo.model_name, config["confianca"], config["reamostras"])
+            intervalos_finais[modelo.model_name] = intervalos
+            estreito = all(ic is not None and ic[2] - ic[1] <= config["largura_alvo"]
+                           for ic in (intervalos["qwk"], intervalos["pearson"]))
+            parar = estreito and intervalos["n_redacoes"] >= config["min_redacoes"]
+            print(f"  {modelo.model_name}: {intervalos['n_redacoes']} redações | {formatar_intervalos(intervalos)}"
+                  f" -> {'PARADO (IC abaixo do alvo)' if parar else 'continua'}")
+            if parar:
+                ativos.remove(modelo)
+
+        if not ativos:
+            print("[OK] Todos os modelos atingiram a precisão alvo.")
+            break
+        if _custos.tarefas_puladas:
+            print("[ORÇAMENTO] Amostragem sequencial interrompida: orçamento esgotado.")
+            break
+    else:
+        if ativos:
+            print(f"[Amostragem sequencial AVISO] A amostra acabou antes da precisão alvo para: "
+                  f"{', '.join(modelo.model_name for modelo in ativos)}. Aumente --n para continuar.")
+
+    print(f"\nIntervalos de confiança ({config['confianca']:.0%}, bootstrap por redação, "
+          f"alvo de largura {config['largura_alvo']}):")
+    for modelo_nome, intervalos in intervalos_finais.items():
+        print(f"  {modelo_nome}: {intervalos['n_redacoes']} redações | {formatar_intervalos(intervalos)}")
+    return total_linhas
+
+def reproduzir_diario(journal, sink):
+    """
+    Retomada: regrava no sink (CSV, tabela de notas...) as linhas que já estão
+    no diário, lendo-o linha a linha. Uma avaliação repetida entra só uma vez.
+    Retorna quantas linhas foram regravadas.
+    """
+    vistas = set()
+    total = 0
+    for linha in journal.iterar():
+        chave = ResultJournal.chave(linha)
+        if chave in vistas:
+            continue
+        vistas.add(chave)
+        sink.write([linha])
+        total += 1
+    return total
+
+def consolidar_notas(tabela):
+    """
+    Imprime a nota final de cada (redação, modelo) a partir da tabela de notas.
+    Retorna {modelo: (totais humanos, totais da LLM)} das redações completas.
+    """
+    scores_finais = {}
+    for modelo_nome in tabela.modelos:
+        ids, total_humano, total_llm, incompletas = tabela.scores_finais(modelo_nome)
+        for redacao_id, humano, llm in zip(ids, total_humano, total_llm):
+            print(f"  -> {redacao_id} ({modelo_nome}) Concluído. Nota Humano: {humano} | Nota LLM: {llm}")
+        for redacao_id in incompletas:
+            print(f"  -> {redacao_id} ({modelo_nome}) Incompleto. Não foi possível calcular nota final.")
+        scores_finais[modelo_nome] = (total_humano, total_llm)
+    return scores_finais
+
+def pesos_das_notas(tabela, modelo_nome, pesos, redacoes=None):
+    """Peso amostral de cada nota do modelo (ou de cada redação em 'redacoes'), a partir de {redacao_id: peso}."""
+    if redacoes is None:
+        redacoes = [tabela.redacao_ids[i] for i in tabela.redacoes_competencias(modelo_nome)]
+    return [pesos.get(redacao_id, 1.0) for redacao_id in redacoes]
+
+def exibir_metricas(tabela, scores_finais, modo_avaliacao=MODO_AVALIACAO, pesos=None):
+    """
+    Imprime QWK, Pearson e Adjacent Agreement por modelo. Com 'pesos' ({redacao_id: peso},
+    de uma amostra estratificada), imprime também as métricas ponderadas.
+    """
     print("\n--- Métricas de Desempenho Agregadas (vs. Humano) ---")
-    
-    # Agrupamos por modelo para calcular as métricas
-    df_scores_comp = pd.DataFrame(master_scores_competencias)
-    df_scores_final = pd.DataFrame(master_scores_finais)
-    
-    for modelo_nome in df_scores_comp['modelo'].unique():
+    print(f"Modo de avaliação: {modo_avaliacao}")
+
+    for modelo_nome in tabela.modelos:
         print(f"\nModelo: {modelo_nome}")
-        
-        # Filtra os scores para este modelo
-        scores_comp_modelo = df_scores_comp[df_scores_comp['modelo'] == modelo_nome]
-        scores_final_modelo = df_scores_final[df_scores_final['modelo'] == modelo_nome]
-        
+
         # Listas de notas
-        human_comp_scores = scores_comp_modelo['humano']
-        llm_comp_scores = scores_comp_modelo['llm']
-        human_final_scores = scores_final_modelo['humano']
-        llm_final_scores = scores_final_modelo['llm']
+        human_comp_scores, llm_comp_scores = tabela.scores_competencias(modelo_nome)
+        human_final_scores, llm_final_scores = scores_finais[modelo_nome]
 
         if len(human_comp_scores) > 1 and len(human_final_scores) > 0:
             # Métricas (Competências)
             qwk = metrics.calculate_qwk(human_comp_scores, llm_comp_scores)
             r, p = metrics.calculate_pearson(human_comp_scores, llm_comp_scores)
             adj_comp = metrics.calculate_adjacent_agreement(human_comp_scores, llm_comp_scores, threshold=80)
-            
+
             n_comp = len(human_comp_scores)
             print(f"  Resultados (Nível Competência, n={n_comp}):")
             print(f"    QWK:                 {qwk:.4f}")
@@ -197,23 +639,830 @@ def run_evaluation_batch(n_samples, output_csv):
 
             # Métricas (Nota Final)
             adj_final = metrics.calculate_adjacent_agreement(human_final_scores, llm_final_scores, threshold=100)
-            
+
             n_final = len(human_final_scores)
             print(f"  Resultados (Nível Nota Final, n={n_final}):")
             print(f"    Adjacent Agr. (100p):{adj_final:.2%}")
-            
+
             # Pearson da nota final (só se tivermos > 1 redação)
             if n_final > 1:
                 r_final, p_final = metrics.calculate_pearson(human_final_scores, llm_final_scores)
                 print(f"    Pearson (r) Final:   {r_final:.4f}")
+
+            if pesos:
+                # Ponderadas pelo peso amostral: estimam as métricas do corpus inteiro
+                pesos_comp = pesos_das_notas(tabela, modelo_nome, pesos)
+                pesos_final = pesos_das_notas(tabela, modelo_nome, pesos, tabela.scores_finais(modelo_nome)[0])
+                qwk_p = metrics.calculate_qwk(human_comp_scores, llm_comp_scores, pesos=pesos_comp)
+                r_p, _ = metrics.calculate_pearson(human_comp_scores, llm_comp_scores, pesos=pesos_comp)
+                adj_comp_p = metrics.calculate_adjacent_agreement(human_comp_scores, llm_comp_scores, 80, pesos=pesos_comp)
+                adj_final_p = metrics.calculate_adjacent_agreement(human_final_scores, llm_final_scores, 100,
+                                                                   pesos=pesos_final)
+                print(f"  Ponderadas pelos pesos amostrais (estimativa para o corpus):")
+                print(f"    QWK:                 {qwk_p:.4f}")
+                print(f"    Pearson (r):         {r_p:.4f}")
+                print(f"    Adjacent Agr. (80p): {adj_comp_p:.2%}")
+                print(f"    Adjacent Agr. (100p):{adj_final_p:.2%}")
         else:
             print("  Dados insuficientes para calcular métricas agregadas.")
 
+def opcoes_autoconsistencia(com_temperatura=True):
+    """Argumentos de self-consistency dos provedores (vazio se AUTOCONSISTENCIA está desligada)."""
+    if AUTOCONSISTENCIA["n_candidatos"] <= 1:
+        return {}
+    opcoes = {"n_candidatos": AUTOCONSISTENCIA["n_candidatos"], "agregacao": AUTOCONSISTENCIA["agregacao"]}
+    if com_temperatura:
+        opcoes["temperature"] = AUTOCONSISTENCIA["temperatura"]
+    return opcoes
+
+def transporte_openai():
+    """O pool de conexões HTTP dividido pelos provedores OpenAI (ver TRANSPORTE_HTTP)."""
+    return transporte_compartilhado("openai", **TRANSPORTE_HTTP)
+
+def criar_etapa_cascata(etapa, cache):
+    """
+    Cria o provedor de uma etapa de CASCATA (ou a reserva do HEDGE), com as cotas e a
+    concorrência padrão do tipo dele.
+    """
+    opcoes = dict(etapa)
+    tipo = opcoes.pop("provedor")
+    comuns = {"cache": cache, "retry_policy": RetryPolicy(**RETENTATIVAS),
+              "circuit_breaker": CircuitBreaker(**CIRCUIT_BREAKER)}
+    if tipo == "openai":
+        return OpenAIProvider(**comuns, transporte=transporte_openai(),
+                              **{**LIMITES_OPENAI, "max_concurrency": CONCORRENCIA_OPENAI, **opcoes})
+    if tipo == "gemini":
+        return GeminiProvider(**comuns, **{**LIMITES_GEMINI, "max_concurrency": CONCORRENCIA_GEMINI,
+                                           "usar_cache_contexto": USAR_CACHE_CONTEXTO_GEMINI,
+                                           "timeout": TRANSPORTE_HTTP["timeout_leitura"], **opcoes})
+    if tipo == "mock":
+        return MockProvider(**comuns, **{**MOCK_CONFIG, **opcoes})
+    if tipo == "local":
+        return LocalProvider(**comuns, **{**MODELO_LOCAL, **opcoes})
+    raise ValueError(f"Provedor desconhecido na CASCATA: '{tipo}' (use openai, gemini, mock ou local)")
+
+def aplicar_hedge(modelos_para_testar, cache):
+    """Envolve cada provedor (menos as cascatas) num HedgedProvider, conforme HEDGE."""
+    if not HEDGE:
+        return modelos_para_testar
+    opcoes = {chave: valor for chave, valor in HEDGE.items() if chave != "reserva"}
+    envolvidos = []
+    for modelo in modelos_para_testar:
+        if isinstance(modelo, CascadeProvider):
+            envolvidos.append(modelo)
+            continue
+        reserva = criar_etapa_cascata(HEDGE["reserva"], cache) if HEDGE.get("reserva") else None
+        envolvidos.append(HedgedProvider(modelo, reserva, precos=PRECOS_POR_MILHAO, **opcoes))
+    return envolvidos
+
+def inicializar_modelos():
+    """Cria o cache (se ligado) e os provedores que serão avaliados (ver PROVEDORES)."""
+    modelos_para_testar, cache = _inicializar_modelos()
+    return aplicar_hedge(modelos_para_testar, cache), cache
+
+def _inicializar_modelos():
+    cache = None
+    if USAR_CACHE:
+        cache = ResponseCache(ARQUIVO_CACHE, max_entradas=CACHE_MAX_ENTRADAS, max_idade_dias=CACHE_MAX_IDADE_DIAS)
+        print(f"[OK] Cache de respostas: '{ARQUIVO_CACHE}' ({len(cache)} entradas)")
+
+    if PROVEDORES == "mock":
+        return [MockProvider(cache=cache, retry_policy=RetryPolicy(**RETENTATIVAS),
+                             circuit_breaker=CircuitBreaker(**CIRCUIT_BREAKER), **MOCK_CONFIG,
+                             **opcoes_autoconsistencia(com_temperatura=False))], cache
+    if PROVEDORES == "local":
+        return [LocalProvider(cache=cache, retry_policy=RetryPolicy(**RETENTATIVAS),
+                              circuit_breaker=CircuitBreaker(**CIRCUIT_BREAKER),
+                              **dict(MODELO_LOCAL, **opcoes_autoconsistencia()))], cache
+    if PROVEDORES == "cascata":
+        etapas = [criar_etapa_cascata(etapa, cache) for etapa in CASCATA["etapas"]]
+        cascata = CascadeProvider(etapas, precos=PRECOS_POR_MILHAO, limiar_concordancia=CASCATA["limiar_concordancia"],
+                                  distancia_fronteira=CASCATA["distancia_fronteira"])
+        # O último modelo também sozinho (o mesmo objeto: mesmas cotas e mesmo cache; o que a
+        # cascata escalou sai do cache de respostas), para comparar QWK e custo com a cascata
+        return [cascata] + ([etapas[-1]] if CASCATA.get("comparar_com_forte") else []), cache
+    if PROVEDORES == "replay":
+        # O replay identifica a redação pelo texto: precisa do mapa id -> texto da base
+        textos_por_id = {redacao.get('url'): redacao.get('texto_original_recuperado')
+                         for redacao in DataLoader(NOME_ARQUIVO_DB).data if isinstance(redacao, dict)}
+        return [ReplayProvider(ARQUIVO_REPLAY, textos_por_id, modelo_gravado=modelo, cache=cache,
+                               retry_policy=RetryPolicy(**RETENTATIVAS), circuit_breaker=CircuitBreaker(**CIRCUIT_BREAKER))
+                for modelo in ReplayProvider.modelos_gravados(ARQUIVO_REPLAY)], cache
+
+    # Cada provedor tem sua própria política de retentativa e seu próprio disjuntor
+    modelos_para_testar = [
+        GeminiProvider(max_concurrency=CONCORRENCIA_GEMINI, cache=cache,
+                       usar_cache_contexto=USAR_CACHE_CONTEXTO_GEMINI, timeout=TRANSPORTE_HTTP["timeout_leitura"],
+                       retry_policy=RetryPolicy(**RETENTATIVAS), circuit_breaker=CircuitBreaker(**CIRCUIT_BREAKER),
+                       **LIMITES_GEMINI, **opcoes_autoconsistencia()),
+        OpenAIProvider(max_concurrency=CONCORRENCIA_OPENAI, cache=cache, transporte=transporte_openai(),
+                       retry_policy=RetryPolicy(**RETENTATIVAS), circuit_breaker=CircuitBreaker(**CIRCUIT_BREAKER),
+                       **LIMITES_OPENAI, **opcoes_autoconsistencia())
+    ]
+    return modelos_para_testar, cache
+
+def provedores_planejados():
+    """
+    Modelo, concorrência e cotas de cada provedor de PROVEDORES, sem criá-los
+    (o planejamento não precisa de chaves de API nem de rede).
+    """
+    if PROVEDORES == "mock":
+        return [{"modelo": "mock", "concorrencia": 64, "rpm": None, "tpm": None}]
+    if PROVEDORES == "local":
+        nome = os.path.splitext(os.path.basename(MODELO_LOCAL["caminho_modelo"]))[0]
+        return [{"modelo": f"local:{nome}", "concorrencia": MODELO_LOCAL.get("n_instancias", 1), "rpm": None, "tpm": None}]
+    if PROVEDORES == "cascata":
+        # Limite superior: como se todas as chamadas passassem por todas as etapas
+        padroes = {"openai": (CONCORRENCIA_OPENAI, LIMITES_OPENAI), "gemini": (CONCORRENCIA_GEMINI, LIMITES_GEMINI),
+                   "mock": (64, {"rpm": None, "tpm": None}), "local": (1, {"rpm": None, "tpm": None})}
+        planejados = []
+        for etapa in CASCATA["etapas"]:
+            concorrencia, limites = padroes[etapa["provedor"]]
+            planejados.append({"modelo": etapa.get("model_name", etapa["provedor"]),
+                               "concorrencia": etapa.get("max_concurrency", concorrencia),
+                               "rpm": etapa.get("rpm", limites["rpm"]), "tpm": etapa.get("tpm", limites["tpm"]),
+                               "n_candidatos": etapa.get("n_candidatos", 1)})
+        return planejados
+    if PROVEDORES == "replay":
+        return [{"modelo": f"replay:{modelo}", "concorrencia": 64, "rpm": None, "tpm": None}
+                for modelo in ReplayProvider.modelos_gravados(ARQUIVO_REPLAY)]
+    return [
+        {"modelo": "gemini-2.5-flash-preview-09-2025", "concorrencia": CONCORRENCIA_GEMINI, **LIMITES_GEMINI},
+        {"modelo": "gpt-4o-mini", "concorrencia": CONCORRENCIA_OPENAI, **LIMITES_OPENAI},
+    ]
+
+def planejar_execucao(n_samples, modo_async=MODO_ASYNC, modos=("por_competencia", "completo")):
+    """
+    Dry-run: sorteia a amostra, conta localmente os tokens de cada prompt e redação e,
+    com as cotas, a concorrência e os preços de cada provedor, estima chamadas, tokens,
+    tempo de parede e custo de cada modo de avaliação. Nenhuma API é chamada.
+    Não considera o cache de respostas (o plano é o de uma execução do zero).
+    """
+    print(f"--- Planejamento (dry-run): {n_samples} redações de '{NOME_ARQUIVO_DB}' ---")
+    amostra_redacoes = DataLoader(NOME_ARQUIVO_DB).get_sample(n=n_samples)
+    if not amostra_redacoes:
+        print("Não foi possível carregar amostra. Verifique o DataLoader e o JSON. Abortando.")
+        return None
+    textos = [redacao_teste['input']['texto'] or "" for redacao_teste in amostra_redacoes]
+
+    calibracao = run_planner.calibrar(ARQUIVO_SAIDA_CSV)
+    if calibracao:
+        print(f"[OK] Tokens de saída e latência calibrados com '{ARQUIVO_SAIDA_CSV}'")
+
+    # Self-consistency multiplica os tokens de saída de cada chamada (replay só relê as respostas)
+    provedores = [{"n_candidatos": 1 if PROVEDORES == "replay" else max(1, AUTOCONSISTENCIA["n_candidatos"]), **provedor}
+                  for provedor in provedores_planejados()]
+    planos = []
+    for modo in modos:
+        prompts = {}
+        for comp_id in competencias_por_tarefa(modo):
+            prompt = carregar_prompt(comp_id)
+            if not prompt:
+                print(f"[FALHA] Prompt {PromptRegistry.nome_arquivo(comp_id, ESTRATEGIA_PROMPT)} não encontrado. "
+                      f"Modo '{modo}' fora do plano.")
+                break
+            prompts[comp_id] = prompt.texto
+        else:
+            plano = run_planner.planejar(provedores, textos, prompts, modo, PRECOS_POR_MILHAO, calibracao, modo_async,
+                                         PLANO_SUPOSICOES, AbstractLLMProvider.TOKENS_SAIDA_ESTIMADOS)
+            run_planner.exibir_plano(plano)
+            planos.append(plano)
+    return planos
+
+def provedores_do_resumo(modelos):
+    """Provedores que fazem as chamadas: as etapas de cascatas e hedges no lugar deles, cada um uma vez."""
+    provedores = {}
+    for modelo in modelos:
+        internos = modelo.provedores_internos()
+        for provedor in provedores_do_resumo(internos) if internos else [modelo]:
+            provedores.setdefault(id(provedor), provedor)
+    return list(provedores.values())
+
+def exibir_resumo_provedores(modelos_para_testar, cache):
+    """
+    Imprime as estatísticas de limite de taxa, do provedor e de cache e libera os recursos.
+    Cascatas e hedges não chamam a API: o resumo é o de cada provedor interno (o relatório
+    deles sai em exibir_cascata e exibir_hedge).
+    """
+    for modelo in provedores_do_resumo(modelos_para_testar):
+        stats = modelo.rate_limiter.stats()
+        print(f"Limite de taxa ({modelo.model_name}): {stats['requisicoes']} requisições, "
+              f"{stats['erros_429']} erros 429, espera total {stats['tempo_espera_total']:.1f}s, "
+              f"taxa final {stats['taxa_atual']:.0%} da cota")
+        retry = modelo.retry_stats()
+        print(f"  Retentativas ({modelo.model_name}): {retry['retentativas']} retentativas "
+              f"(backoff total {retry['tempo_backoff_total']:.1f}s), {retry['tentativas_esgotadas']} esgotadas, "
+              f"{retry['erros_fatais']} erros fatais | Disjuntor: {retry['disjuntor_disparos']} disparos, "
+              f"pausa total {retry['disjuntor_tempo_pausa_total']:.0f}s, "
+              f"{retry['disjuntor_chamadas_recusadas']} chamadas recusadas")
+        metricas_provedor = modelo.provider_metrics()
+        if metricas_provedor:
+            detalhes = " | ".join(
+                f"{nome}: {valor:.2f}" if isinstance(valor, float) else f"{nome}: {valor}"
+                for nome, valor in metricas_provedor.items()
+            )
+            print(f"  Métricas do provedor ({modelo.model_name}): {detalhes}")
+        consistencia = modelo.consistencia_stats()
+        if consistencia:
+            print(f"  Self-consistency ({modelo.model_name}): {consistencia['n_candidatos']} amostras por chamada "
+                  f"({consistencia['agregacao']}) | concordância média {consistencia['concordancia_media']:.0%} "
+                  f"| {consistencia['unanimes']:.0%} das {consistencia['blocos']} notas unânimes "
+                  f"| {consistencia['candidatos_invalidos']} amostras inválidas descartadas")
+    # O streaming é medido por quem recebeu as chamadas (a cascata, não as etapas dela)
+    for modelo in modelos_para_testar:
+        streaming = modelo.streaming_stats()
+        if streaming:
+            ate_nota, total = streaming["tempo_ate_nota"], streaming["latencia_total"]
+            print(f"  Streaming ({modelo.model_name}): {streaming['chamadas']} chamadas | tempo até a nota "
+                  f"p50 {ate_nota['p50_s']:.2f}s (p95 {ate_nota['p95_s']:.2f}s) | latência total "
+                  f"p50 {total['p50_s']:.2f}s (p95 {total['p95_s']:.2f}s) "
+                  f"| {streaming['nota_no_fim']} com a nota só no fim")
+    # Cascatas e hedges fecham os provedores internos (ex: a última etapa, também avaliada sozinha)
+    internos = {id(provedor) for modelo in modelos_para_testar
+                for provedor in provedores_do_resumo(modelo.provedores_internos())}
+    for modelo in modelos_para_testar:
+        if id(modelo) not in internos:
+            modelo.close()
+    if cache is not None:
+        stats_cache = cache.stats()
+        print(f"Cache de respostas: {stats_cache['hits']} hits | {stats_cache['misses']} misses "
+              f"| {stats_cache['entradas']} entradas")
+        cache.close()
+
+def exibir_hedge(modelos_para_testar, custos):
+    """
+    Relatório de cada HedgedProvider: cópias disparadas, vencidas e negadas pelo teto,
+    custo extra e p50/p99 de ponta a ponta contra os do provedor sozinho. Lança no
+    CostTracker o custo das requisições que terminaram depois da chamada (as que perderam).
+    Chamar depois de exibir_resumo_provedores (o close() espera essas requisições).
+    """
+    for modelo in modelos_para_testar:
+        if not isinstance(modelo, HedgedProvider):
+            continue
+        stats = modelo.hedge_stats()
+        custos.registrar_extra(modelo.model_name, stats["custo_tardio"])
+        com_hedge, sem_hedge = stats["latencia_com_hedge"], stats["latencia_sem_hedge"]
+        print(f"Hedge ({modelo.model_name}): {stats['hedges']} cópias em {stats['chamadas']} chamadas, "
+              f"{stats['hedges_venceram']} venceram, {stats['hedges_negados']} negadas pelo teto "
+              f"| custo extra ${stats['custo_extra']:.4f}")
+        if com_hedge["n"] and sem_hedge["n"]:
+            queda = 1 - com_hedge["p99_s"] / sem_hedge["p99_s"] if sem_hedge["p99_s"] else 0.0
+            print(f"  p50 {sem_hedge['p50_s']:.2f}s -> {com_hedge['p50_s']:.2f}s | p99 {sem_hedge['p99_s']:.2f}s sem hedge "
+                  f"-> {com_hedge['p99_s']:.2f}s com hedge ({queda:.0%} menor)")
+
+def exibir_cascata(tabela, modelos_para_testar):
+    """
+    Relatório de cada cascata: taxa de escalonamento e motivos, quem respondeu, custo
+    real x custo de mandar tudo ao modelo mais forte e, se ele também avaliou tudo
+    (CASCATA["comparar_com_forte"]), o QWK entre as notas da cascata e as dele.
+    """
+    for modelo in modelos_para_testar:
+        if not isinstance(modelo, CascadeProvider):
+            continue
+        stats = modelo.cascata_stats()
+        forte = modelo.provedores[-1].model_name
+        print(f"\n--- Cascata ({modelo.model_name}) ---")
+        print(f"  {stats['chamadas']} chamadas | {stats['escaladas']} escaladas ({stats['taxa_escalonamento']:.1%}) "
+              f"| {stats['falhas']} sem resposta em nenhuma etapa")
+        if stats["motivos"]:
+            print("  Motivos: " + " | ".join(f"{motivo}: {n}" for motivo, n in sorted(stats["motivos"].items())))
+        print("  Respondidas por: " + " | ".join(f"{nome}: {n}" for nome, n in stats["respondidas_por"].items()))
+        economia = f" ({stats['economia'] / stats['custo_so_forte']:.0%})" if stats["custo_so_forte"] else ""
+        print(f"  Custo: ${stats['custo_real']:.4f} na cascata x ~${stats['custo_so_forte']:.4f} só com {forte} "
+              f"| economia ~${stats['economia']:.4f}{economia}")
+
+        if forte in tabela.modelos and modelo.model_name in tabela.modelos:
+            notas_cascata, notas_forte = tabela.pares_llm(modelo.model_name, forte)
+            if len(notas_cascata) > 1:
+                qwk = metrics.calculate_qwk(notas_forte, notas_cascata)
+                iguais = metrics.calculate_adjacent_agreement(notas_forte, notas_cascata, threshold=0)
+                print(f"  Cascata x só {forte} (n={len(notas_cascata)}): QWK {qwk:.4f} | notas iguais {iguais:.1%}")
+        else:
+            print(f"  (Para o QWK da cascata contra {forte}, use CASCATA['comparar_com_forte'] = True)")
+
+def exibir_custos(custos):
+    """Imprime o custo da execução por modelo, por competência e por redação."""
+    resumo = custos.resumo()
+    orcamento = "sem limite" if resumo["orcamento"] is None else f"orçamento ${resumo['orcamento']:.4f}"
+    print(f"Custo estimado desta execução: ${resumo['gasto']:.4f} ({orcamento})")
+    for modelo_nome, custo_modelo in resumo["por_modelo"].items():
+        por_comp = " | ".join(f"{comp}: ${custo:.4f}" for (modelo, comp), custo in sorted(resumo["por_competencia"].items())
+                              if modelo == modelo_nome)
+        custos_redacoes = [custo for (modelo, _), custo in resumo["por_redacao"].items() if modelo == modelo_nome]
+        print(f"  {modelo_nome}: ${custo_modelo:.4f} | {por_comp}")
+        if custos_redacoes:
+            print(f"    Por redação: média ${sum(custos_redacoes) / len(custos_redacoes):.5f} "
+                  f"| máx ${max(custos_redacoes):.5f} | {len(custos_redacoes)} redações")
+    for modelo_nome, prefixo in resumo["cache_prefixo"].items():
+        latencias = [
+            f"{rotulo} {prefixo[f'latencia_{sufixo}'] / prefixo[f'chamadas_{sufixo}']:.2f}s "
+            f"({prefixo[f'chamadas_{sufixo}']} chamadas)"
+            for rotulo, sufixo in (("com acerto", "com_cache"), ("sem acerto", "sem_cache")) if prefixo[f"chamadas_{sufixo}"]
+        ]
+        print(f"  Cache de prefixo ({modelo_nome}): {prefixo['tokens_cache'] / prefixo['tokens_entrada']:.1%} "
+              f"dos tokens de entrada em cache | economia ${prefixo['economia']:.4f} "
+              f"| latência média {' | '.join(latencias)}")
+    if resumo["tarefas_puladas"]:
+        print(f"  [ORÇAMENTO] {resumo['tarefas_puladas']} chamadas não foram feitas por falta de orçamento.")
+
+def abrir_saidas(output_csv):
+    """
+    Abre os arquivos de saída (FORMATOS_SAIDA) e a tabela de notas.
+    Retorna (sink de saída, caminhos dos arquivos, tabela de notas), ou None se falhar.
+    """
+    try:
+        sink_arquivos, caminhos = abrir_sinks(output_csv, FORMATOS_SAIDA, TAMANHO_ROW_GROUP_PARQUET)
+    except Exception as e:
+        print(f"[FALHA] Não foi possível abrir os arquivos de saída: {e}")
+        return None
+    return sink_arquivos, caminhos, TabelaNotas()
+
+def salvar_resultados(sink_arquivos, caminhos, tabela, modo_avaliacao, pesos=None):
+    """
+    Fecha os arquivos de saída (as linhas já foram gravadas durante a execução),
+    consolida as notas e exibe as métricas agregadas a partir da tabela de notas
+    (também ponderadas, com os 'pesos' de uma amostra estratificada).
+    """
+    try:
+        sink_arquivos.close()
+        for caminho in caminhos:
+            print(f"\n[OK] Resultados detalhados salvos em '{caminho}'")
+    except Exception as e:
+        print(f"\n[FALHA] Não foi possível finalizar os arquivos de saída: {e}")
+
+    if not len(tabela):
+        print("Nenhum resultado foi gerado. Abortando.")
+        return
+
+    print(f"\n--- Consolidando notas finais ---")
+    scores_finais = consolidar_notas(tabela)
+
+    # Exibir Métricas Agregadas
+    exibir_metricas(tabela, scores_finais, modo_avaliacao, pesos)
+
+def run_evaluation_batch(n_samples, output_csv, modo_async=MODO_ASYNC, modo_avaliacao=MODO_AVALIACAO, run_id=None,
+                         max_custo=ORCAMENTO_MAXIMO_USD, shard=None, adaptativo=MODO_ADAPTATIVO,
+                         estratificacao=ESTRATIFICACAO, semente=SEMENTE_AMOSTRA):
+    """
+    Função principal (Fase 6 - Lote).
+    Avalia N redações por completo (C1 a C5) e calcula as métricas agregadas.
+    Com modo_async=True, todas as chamadas são agendadas de uma vez,
+    respeitando o limite de concorrência de cada provedor.
+    modo_avaliacao escolhe entre uma chamada por competência ("por_competencia")
+    ou uma chamada com as 5 competências ("completo").
+    Com run_id, retoma uma execução anterior: mesma amostra, pulando o que já está no diário.
+    Com max_custo (USD), para de fazer chamadas novas quando o orçamento se esgota.
+    Com shard=(i, N), avalia só a parte i das redações (ver DataLoader.get_shard) e grava
+    em arquivos próprios do shard; os shards são juntados depois com mesclar_shards.
+    Com adaptativo=True, n_samples é o teto: as redações são avaliadas em lotes até os
+    ICs de cada modelo ficarem estreitos o bastante (ver executar_ate_convergir).
+    Com estratificacao ({"estratos": [...], "alocacao": ...}), a amostra é estratificada
+    (ver DataLoader.get_sample) e as métricas também saem ponderadas; 'semente' fixa o sorteio.
+    """
+    
+    print("Iniciando execução em lote (Fase 6)...")
+    
+    # --- 1. Carregar Dados ---
+    with perf_stats.medir("carregar_dados"):
+        loader = DataLoader(NOME_ARQUIVO_DB)
+    if run_id:
+        journal = ResultJournal(DIRETORIO_EXECUCOES, run_id, retomar=True)
+        if not journal.existe():
+            print(f"[FALHA] Execução '{run_id}' não encontrada em '{DIRETORIO_EXECUCOES}'. Abortando.")
+            return
+        manifesto = journal.carregar_manifesto()
+        if manifesto["estrategia_prompt"] != ESTRATEGIA_PROMPT:
+            print(f"A execução '{run_id}' usou a estratégia '{manifesto['estrategia_prompt']}', "
+                  f"mas ESTRATEGIA_PROMPT='{ESTRATEGIA_PROMPT}'. Ajuste a configuração para retomá-la. Abortando.")
+            return
+        modo_avaliacao = manifesto["modo_avaliacao"]
+        shard = tuple(manifesto["shard"]) if manifesto.get("shard") else None
+        adaptativo = manifesto.get("adaptativo", False)
+        print(f"\n--- Retomando execução '{run_id}' ({len(manifesto['redacao_ids'])} redações) ---")
+        amostra_redacoes = loader.get_by_ids(manifesto["redacao_ids"], pesos=manifesto.get("pesos"))
+    elif shard:
+        print(f"\n--- Carregando o shard {shard[0]}/{shard[1]} de "
+              f"{'todas as' if n_samples is None else n_samples} redações de '{NOME_ARQUIVO_DB}' ---")
+        if estratificacao:
+            print("[Amostragem AVISO] A estratificação não vale com --shard (a divisão é por hash); sorteio uniforme.")
+        amostra_redacoes = loader.get_shard(shard[0], shard[1], n=n_samples)
+        journal = None
+    else:
+        print(f"\n--- Carregando {'todas as' if n_samples is None else n_samples} redações de '{NOME_ARQUIVO_DB}' ---")
+        try:
+            amostra_redacoes = loader.get_sample(n=n_samples, semente=semente, **(estratificacao or {}))
+        except ValueError as e:
+            print(f"Configuração de estratificação inválida: {e}. Abortando.")
+            return
+        journal = None
+    
+    if not amostra_redacoes:
+        print("Não foi possível carregar amostra. Verifique o DataLoader e o JSON. Abortando.")
+        return
+    
+    print(f"[OK] {len(amostra_redacoes)} redações carregadas.")
+    pesos = {r['input']['id']: r['peso'] for r in amostra_redacoes if 'peso' in r} or None
+    perf_stats.contar("redacoes", len(amostra_redacoes))
+
+    if journal is None:
+        # Shards rodando ao mesmo tempo na mesma pasta não podem dividir o run_id
+        journal = ResultJournal(DIRETORIO_EXECUCOES, run_id=time.strftime("%Y%m%d-%H%M%S")
+                                + (f"-shard-{shard[0]}-de-{shard[1]}" if shard else ""))
+        journal.salvar_manifesto({
+            "run_id": journal.run_id,
+            "criado_em": time.time(),
+            "modo_avaliacao": modo_avaliacao,
+            "estrategia_prompt": ESTRATEGIA_PROMPT,
+            "shard": list(shard) if shard else None,
+            "adaptativo": adaptativo,
+            "estratificacao": estratificacao,
+            "semente": semente,
+            "pesos": pesos,
+            "redacao_ids": [r['input']['id'] for r in amostra_redacoes]
+        })
+    concluidas = journal.chaves_concluidas()
+    print(f"[OK] Diário da execução: '{journal.caminho}' (run_id: {journal.run_id}, "
+          f"{len(concluidas)} avaliações já concluídas)")
+
+    # --- 2. Arquivos de Saída ---
+    if shard:
+        output_csv = nome_arquivo_shard(output_csv, shard)
+    # As linhas vão para o diário, para os arquivos (CSV/JSONL/Parquet) e para a
+    # tabela de notas assim que cada tarefa termina; nada de texto fica em memória.
+    saidas = abrir_saidas(output_csv)
+    if saidas is None:
+        return
+    sink_arquivos, caminhos, tabela = saidas
+    # Na retomada, o que já está no diário entra primeiro nos arquivos e na tabela
+    n_reproduzidas = reproduzir_diario(journal, MultiSink([sink_arquivos, tabela]))
+    sink = MultiSink([journal, sink_arquivos, tabela])
+
+    # --- 3. Inicializar Prompts, Custos e Modelos ---
+    obter_registro_prompts()
+    custos = iniciar_custos(max_custo)
+    modelos_para_testar, cache = inicializar_modelos()
+
+    # --- 4. Execução ---
+    start_time_total = time.time()
+
+    try:
+        with perf_stats.medir("execucao"):
+            if adaptativo:
+                executar_ate_convergir(amostra_redacoes, modelos_para_testar, modo_avaliacao, sink, concluidas,
+                                       tabela, modo_async)
+            elif modo_async:
+                executar_async(amostra_redacoes, modelos_para_testar, modo_avaliacao, sink, concluidas)
+            else:
+                executar_sequencial(amostra_redacoes, modelos_para_testar, modo_avaliacao, sink, concluidas)
+    except KeyboardInterrupt:
+        # Tudo que já terminou está no diário e nos arquivos; as métricas saem com o parcial
+        print(f"\n[INTERROMPIDO] Execução interrompida. Para continuar de onde parou:")
+        print(f"  python main.py --resume {journal.run_id}")
+
+    # --- 5. Fim da Execução ---
+    end_time_total = time.time()
+    print(f"\n--- Execução em Lote Concluída ---")
+    print(f"Modo de execução: {'async' if modo_async else 'sequencial'}{' (amostragem adaptativa)' if adaptativo else ''} "
+          f"| Modo de avaliação: {modo_avaliacao}")
+    print(f"Tempo total: {end_time_total - start_time_total:.2f} segundos")
+    print(f"Total de redações avaliadas: {len(amostra_redacoes)}{' (teto da amostragem adaptativa)' if adaptativo else ''}")
+    print(f"Total de avaliações de competências: {len(tabela)} "
+          f"({len(tabela) - n_reproduzidas} novas nesta execução)")
+    exibir_resumo_provedores(modelos_para_testar, cache)
+    exibir_hedge(modelos_para_testar, custos)
+    exibir_custos(custos)
+    if custos.tarefas_puladas:
+        print(f"Para continuar com mais orçamento: python main.py --resume {journal.run_id} --max-cost <USD>")
+
+    # --- 6. Arquivos de Saída e Métricas Agregadas ---
+    with perf_stats.medir("finalizacao"):
+        salvar_resultados(sink_arquivos, caminhos, tabela, modo_avaliacao, pesos)
+    if len(tabela):
+        exibir_cascata(tabela, modelos_para_testar)
+    print(f"\nrun_id: {journal.run_id}")
+    return journal.run_id
+
+def mesclar_shards(arquivos, output_csv):
+    """
+    Junta os resultados dos shards (CSV, JSONL ou Parquet de cada um, ou os diários)
+    em um único conjunto de arquivos de saída e calcula as métricas globais a partir
+    de todas as avaliações, exatamente como uma execução única sobre as mesmas redações.
+    Uma avaliação repetida (redação, modelo, competência) entra só uma vez.
+    """
+    print(f"--- Mesclando {len(arquivos)} arquivos de shards em '{output_csv}' ---")
+    try:
+        n_shards, faltando = shards_faltando(arquivos)
+    except ValueError as e:
+        print(f"[FALHA] {e}. Abortando.")
+        return
+    if faltando:
+        print(f"[Merge AVISO] Faltam os shards {faltando} de {n_shards}: as métricas serão só das redações presentes.")
+
+    # Não deixa a saída mesclada sobrescrever um dos arquivos de entrada
+    base_saida = os.path.splitext(os.path.abspath(output_csv))[0]
+    entradas = [caminho for caminho in arquivos if os.path.splitext(os.path.abspath(caminho))[0] != base_saida]
+    for caminho in set(arquivos) - set(entradas):
+        print(f"[Merge AVISO] '{caminho}' tem o mesmo nome da saída mesclada. Ignorando.")
+
+    saidas = abrir_saidas(output_csv)
+    if saidas is None:
+        return
+    sink_arquivos, caminhos, tabela = saidas
+    sink = MultiSink([sink_arquivos, tabela])
+
+    vistas = set()
+    modos = set()
+    for caminho in entradas:
+        novas = repetidas = 0
+        try:
+            for linha in ler_resultados(caminho):
+                chave = ResultJournal.chave(linha)
+                if chave in vistas:
+                    repetidas += 1
+                    continue
+                vistas.add(chave)
+                modos.add(run_planner.modo_do_prompt(linha.get("prompt")))
+                sink.write([linha])
+                novas += 1
+        except Exception as e:
+            print(f"[FALHA] Não foi possível ler '{caminho}': {e}")
+            continue
+        print(f"[OK] {novas} avaliações de '{caminho}'" + (f" ({repetidas} repetidas ignoradas)" if repetidas else ""))
+
+    print(f"Total: {len(tabela)} avaliações de {len(tabela.redacao_ids)} redações e {len(tabela.modelos)} modelos.")
+    salvar_resultados(sink_arquivos, caminhos, tabela, modos.pop() if len(modos) == 1 else "misto")
+
+# --- MODO LOTE (BATCH) OFFLINE ---
+# 1. enviar_lote:   grava os pedidos pendentes em JSONL (um job por modelo) e envia ao endpoint de lote
+# 2. consultar_lote: consulta o status dos jobs
+# 3. importar_lote: baixa os resultados e segue o fluxo normal (CSV + métricas)
+
+def _pedidos_da_amostra(amostra_redacoes, modo_avaliacao):
+    """Gera (custom_id, índice da redação, comp_id) de cada chamada da amostra."""
+    for i in range(len(amostra_redacoes)):
+        for comp_id in competencias_por_tarefa(modo_avaliacao):
+            sufixo = "completo" if comp_id is None else f"c{comp_id}"
+            yield f"r{i}-{sufixo}", i, comp_id
+
+def _backend_do_job(modelo, diretorio_lote, nome_backend):
+    """Backend de lote de um job: o substituto local ou o endpoint do provedor."""
+    if nome_backend == "local":
+        return LocalBatchBackend(modelo, os.path.join(diretorio_lote, "local"))
+    return modelo.batch_backend(os.path.join(diretorio_lote, "local"))
+
+def enviar_lote(n_samples, modo_avaliacao=MODO_AVALIACAO):
+    """
+    Passo 1 do modo lote: sorteia a amostra, grava os pedidos que ainda não estão
+    no cache em um JSONL por modelo e envia cada um ao endpoint de lote.
+    Retorna o lote_id (usado em --batch-status e --batch-importar).
+    """
+    print(f"\n--- Preparando lote com {n_samples} redações de '{NOME_ARQUIVO_DB}' ---")
+    loader = DataLoader(NOME_ARQUIVO_DB)
+    amostra_redacoes = loader.get_sample(n=n_samples)
+    if not amostra_redacoes:
+        print("Não foi possível carregar amostra. Verifique o DataLoader e o JSON. Abortando.")
+        return None
+
+    modelos_para_testar, cache = inicializar_modelos()
+
+    lote_id = time.strftime("%Y%m%d-%H%M%S")
+    diretorio_lote = os.path.join(DIRETORIO_LOTES, lote_id)
+    os.makedirs(diretorio_lote, exist_ok=True)
+
+    manifesto = {
+        "lote_id": lote_id,
+        "criado_em": time.time(),
+        "modo_avaliacao": modo_avaliacao,
+        # O texto vai nos jobs; aqui basta o necessário para montar as linhas do CSV
+        "amostra": [
+            {"input": {"id": r['input']['id'], "tema": r['input']['tema']}, "ground_truth": r['ground_truth']}
+            for r in amostra_redacoes
+        ],
+        "jobs": []
+    }
+
+    for modelo in modelos_para_testar:
+        pedidos = {}
+        linhas_job = []
+        for custom_id, i, comp_id in _pedidos_da_amostra(amostra_redacoes, modo_avaliacao):
+            prompt = carregar_prompt(comp_id)
+            if not prompt:
+                print(f"[FALHA] Prompt {PromptRegistry.nome_arquivo(comp_id, ESTRATEGIA_PROMPT)} não encontrado. Pulando {custom_id}.")
+                continue
+            texto = amostra_redacoes[i]['input']['texto']
+            schema = SCHEMA_COMPLETO if comp_id is None else SCHEMA_COMPETENCIA
+            meta = {"redacao": i, "comp_id": comp_id, "prompt": prompt.nome, "prompt_hash": prompt.hash}
+
+            # Pedidos já respondidos no cache não vão para o lote (são lidos na importação)
+            # (uma cascata não tem chave própria: o cache vale para cada etapa, dentro do lote)
+            chave_cache = modelo.cache_key(prompt.texto, texto, schema, comp_id) if cache is not None else None
+            if chave_cache is not None:
+                meta["chave_cache"] = chave_cache
+                if cache.get(chave_cache) is not None:
+                    meta["em_cache"] = True
+                    pedidos[custom_id] = meta
+                    continue
+
+            pedidos[custom_id] = meta
+            linhas_job.append(modelo.build_batch_request(custom_id, prompt.texto, texto, schema, comp_id))
+
+        job = {"provedor": modelo.__class__.__name__, "modelo": modelo.model_name,
+               "pedidos": pedidos, "job_id": None, "backend": None, "status": STATUS_CONCLUIDO}
+
+        if linhas_job:
+            nome_arquivo = f"job_{modelo.__class__.__name__}_{modelo.model_name}.jsonl".replace("/", "_")
+            arquivo_job = os.path.join(diretorio_lote, nome_arquivo)
+            escrever_jsonl(arquivo_job, linhas_job)
+
+            backend = _backend_do_job(modelo, diretorio_lote, "local" if BATCH_BACKEND == "local" else None)
+            job.update(backend=backend.nome, arquivo_job=arquivo_job)
+            try:
+                job["job_id"] = backend.submit(arquivo_job)
+                job["status"] = STATUS_EM_ANDAMENTO
+                print(f"[OK] {modelo.model_name}: {len(linhas_job)} pedidos enviados ({backend.nome}, job {job['job_id']})")
+            except Exception as e:
+                # Fica registrado no manifesto; os pedidos do cache ainda são importados
+                job["status"] = STATUS_FALHOU
+                print(f"[FALHA] Não foi possível enviar o lote de {modelo.model_name}: {e}")
+
+        n_cache = len(pedidos) - len(linhas_job)
+        if n_cache:
+            print(f"  {modelo.model_name}: {n_cache} pedidos já estavam no cache")
+        manifesto["jobs"].append(job)
+
+    salvar_manifesto(diretorio_lote, manifesto)
+    if cache is not None:
+        cache.close()
+    print(f"\n[OK] Lote '{lote_id}' criado em '{diretorio_lote}'.")
+    print(f"Acompanhe com: python main.py --batch-status {lote_id}")
+    return lote_id
+
+def _modelo_do_job(modelos_para_testar, job):
+    for modelo in modelos_para_testar:
+        if modelo.__class__.__name__ == job["provedor"] and modelo.model_name == job["modelo"]:
+            return modelo
+    return None
+
+def consultar_lote(lote_id, modelos_para_testar=None):
+    """
+    Passo 2 do modo lote: consulta o status de cada job e atualiza o manifesto.
+    Retorna True quando todos os jobs terminaram.
+    """
+    diretorio_lote = os.path.join(DIRETORIO_LOTES, lote_id)
+    manifesto = carregar_manifesto(diretorio_lote)
+    cache = None
+    if modelos_para_testar is None:
+        modelos_para_testar, cache = inicializar_modelos()
+
+    todos_prontos = True
+    for job in manifesto["jobs"]:
+        if job["job_id"] and job["status"] == STATUS_EM_ANDAMENTO:
+            modelo = _modelo_do_job(modelos_para_testar, job)
+            backend = _backend_do_job(modelo, diretorio_lote, job["backend"])
+            try:
+                job["status"] = backend.poll(job["job_id"])
+            except Exception as e:
+                print(f"[FALHA] Não foi possível consultar o job {job['job_id']}: {e}")
+        print(f"  {job['modelo']}: {job['status']} (job {job['job_id']})")
+        todos_prontos = todos_prontos and job["status"] != STATUS_EM_ANDAMENTO
+
+    salvar_manifesto(diretorio_lote, manifesto)
+    if cache is not None:
+        cache.close()
+    return todos_prontos
+
+def importar_lote(lote_id, output_csv, aguardar=False):
+    """
+    Passo 3 do modo lote: baixa os resultados de cada job, grava as respostas
+    no cache e gera o mesmo CSV e as mesmas métricas da execução interativa.
+    """
+    diretorio_lote = os.path.join(DIRETORIO_LOTES, lote_id)
+    modelos_para_testar, cache = inicializar_modelos()
+
+    print(f"\n--- Consultando lote '{lote_id}' ---")
+    while not consultar_lote(lote_id, modelos_para_testar):
+        if not aguardar:
+            print("Lote ainda em andamento. Rode de novo mais tarde (ou use --aguardar).")
+            if cache is not None:
+                cache.close()
+            return
+        time.sleep(INTERVALO_POLL_SEGUNDOS)
+
+    manifesto = carregar_manifesto(diretorio_lote)
+    modo_avaliacao = manifesto["modo_avaliacao"]
+    amostra_redacoes = manifesto["amostra"]
+
+    # (índice da redação, índice do modelo, linhas) para manter a ordem do modo interativo
+    blocos = []
+    for job in manifesto["jobs"]:
+        modelo = _modelo_do_job(modelos_para_testar, job)
+        indice_modelo = modelos_para_testar.index(modelo)
+
+        resultados = {}
+        if job["job_id"] and job["status"] == STATUS_CONCLUIDO:
+            caminho_resultado = os.path.join(diretorio_lote, f"resultado_{os.path.basename(job['arquivo_job'])}")
+            _backend_do_job(modelo, diretorio_lote, job["backend"]).download(job["job_id"], caminho_resultado)
+            resultados = {r["custom_id"]: r for r in ler_jsonl(caminho_resultado)}
+        elif job["status"] != STATUS_CONCLUIDO:
+            print(f"[FALHA] Job de {job['modelo']} terminou com status '{job['status']}'.")
+
+        for custom_id, meta in job["pedidos"].items():
+            schema = SCHEMA_COMPLETO if meta["comp_id"] is None else SCHEMA_COMPETENCIA
+            resultado_json = None
+            if custom_id in resultados:
+                try:
+                    resultado_json = modelo.parse_batch_result(resultados[custom_id], schema)
+                except Exception as e:
+                    print(f"[FALHA] Pedido {custom_id} ({job['modelo']}): {e}")
+                if resultado_json is not None and cache is not None and meta.get("chave_cache"):
+                    resposta = {chave: valor for chave, valor in resultado_json.items() if chave != "_uso"}
+                    cache.put(meta["chave_cache"], resposta, job["provedor"], job["modelo"])
+            elif meta.get("em_cache") and cache is not None:
+                resultado_json = cache.get(meta["chave_cache"])
+
+            if resultado_json is None:
+                continue
+            # O texto do prompt não é necessário aqui, só nome e hash (proveniência)
+            prompt = Prompt(meta["prompt"], None, meta["prompt_hash"], None)
+            linhas = linhas_do_resultado(modelo, amostra_redacoes[meta["redacao"]],
+                                         meta["comp_id"], prompt, resultado_json)
+            blocos.append((meta["redacao"], indice_modelo, linhas))
+
+    saidas = abrir_saidas(output_csv)
+    if saidas is None:
+        exibir_resumo_provedores(modelos_para_testar, cache)
+        return
+    sink_arquivos, caminhos, tabela = saidas
+    sink = MultiSink([sink_arquivos, tabela])
+    blocos.sort(key=lambda bloco: (bloco[0], bloco[1]))
+    for _, _, linhas in blocos:
+        sink.write(linhas)
+
+    print(f"\n--- Lote '{lote_id}' Importado ---")
+    print(f"Total de redações no lote: {len(amostra_redacoes)}")
+    print(f"Total de avaliações de competências: {len(tabela)}")
+    exibir_resumo_provedores(modelos_para_testar, cache)
+    salvar_resultados(sink_arquivos, caminhos, tabela, modo_avaliacao)
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluation harness do corretor de redações do ENEM.")
+    grupo_lote = parser.add_mutually_exclusive_group()
+    grupo_lote.add_argument("--batch-enviar", action="store_true",
+                            help="Grava os pedidos da amostra em JSONL e envia ao endpoint de lote dos provedores.")
+    grupo_lote.add_argument("--batch-status", metavar="LOTE_ID",
+                            help="Consulta o status dos jobs de um lote.")
+    grupo_lote.add_argument("--batch-importar", metavar="LOTE_ID",
+                            help="Baixa os resultados de um lote e gera o CSV e as métricas.")
+    parser.add_argument("--aguardar", action="store_true",
+                        help="Com --batch-importar, espera o lote terminar (consulta periódica).")
+    parser.add_argument("--max-cost", type=float, metavar="USD", default=ORCAMENTO_MAXIMO_USD,
+                        help="Orçamento da execução: nenhuma chamada nova depois de atingi-lo (o que terminou é salvo).")
+    grupo_lote.add_argument("--dry-run", action="store_true",
+                            help="Só estima chamadas, tokens, tempo e custo da amostra (nos dois modos), sem chamar as APIs.")
+    grupo_lote.add_argument("--merge", nargs="+", metavar="ARQUIVO",
+                            help="Junta os resultados dos shards (CSV/JSONL/Parquet) e calcula as métricas globais.")
+    parser.add_argument("--shard", type=parse_shard, metavar="i/N",
+                        help="Avalia só o shard i (0 a N-1) das redações, dividido por um hash estável da URL.")
+    parser.add_argument("--n", type=lambda valor: None if valor == "todas" else int(valor), metavar="N|todas",
+                        default=N_AMOSTRAS_TESTE, help="Quantidade de redações da amostra (padrão: N_AMOSTRAS_TESTE).")
+    parser.add_argument("--estratificar", type=lambda valor: valor.split(","), metavar="ESTRATOS",
+                        help='Amostra estratificada pelos estratos dados (ex: "fonte,faixa_nota"; também tema_geral).')
+    parser.add_argument("--alocacao", choices=["proporcional", "neyman"], default="proporcional",
+                        help="Alocação da amostra entre os estratos (com --estratificar).")
+    parser.add_argument("--semente", type=int, default=SEMENTE_AMOSTRA,
+                        help="Semente do sorteio da amostra, para reproduzi-la (padrão: SEMENTE_AMOSTRA).")
+    parser.add_argument("--adaptativo", action="store_true", default=MODO_ADAPTATIVO,
+                        help="Amostragem sequencial: avalia em lotes e para cada modelo quando os ICs do QWK e do "
+                             "Pearson ficam estreitos o bastante (--n vira o teto de redações).")
+    parser.add_argument("--trace", metavar="ARQUIVO", default=ARQUIVO_TRACE,
+                        help="Grava um trace (JSON do chrome://tracing / Perfetto) com os spans de cada tarefa.")
+    parser.add_argument("--resume", metavar="RUN_ID",
+                        help="Retoma uma execução interrompida: mesma amostra, sem refazer o que já está no diário.")
+    args = parser.parse_args()
+
+    if args.batch_status:
+        consultar_lote(args.batch_status)
+    elif args.batch_importar:
+        importar_lote(args.batch_importar, output_csv=ARQUIVO_SAIDA_CSV, aguardar=args.aguardar)
+    elif args.merge:
+        mesclar_shards(args.merge, output_csv=ARQUIVO_SAIDA_CSV)
     # Certifique-se que o nome do arquivo JSON está correto
-    if not os.path.exists(NOME_ARQUIVO_DB):
+    elif not os.path.exists(NOME_ARQUIVO_DB):
         print(f"Erro: Arquivo '{NOME_ARQUIVO_DB}' não encontrado.")
         print(f"Por favor, renomeie '{NOME_ARQUIVO_DB}' no script 'main.py' para o nome correto.")
+    elif args.dry_run:
+        planejar_execucao(n_samples=args.n)
+    elif args.batch_enviar:
+        enviar_lote(n_samples=args.n)
     else:
-        run_evaluation_batch(n_samples=N_AMOSTRAS_TESTE, output_csv=ARQUIVO_SAIDA_CSV)
\ No newline at end of file
+        if args.trace:
+            tracing.ativar(args.trace)
+        try:
+            run_evaluation_batch(n_samples=args.n, output_csv=ARQUIVO_SAIDA_CSV, run_id=args.resume,
+                                 max_custo=args.max_cost, shard=args.shard, adaptativo=args.adaptativo,
+                                 estratificacao=({"estratos": args.estratificar, "alocacao": args.alocacao}
+                                                 if args.estratificar else ESTRATIFICACAO),
+                                 semente=args.semente)
+        finally:
+            tracing.desativar()
@@ -2,11 +2,13 @@
 from sklearn.metrics import cohen_kappa_score
 from scipy.stats import pearsonr
 import numpy as np
+import warnings
 
-def calculate_qwk(human_scores, llm_scores):
+def calculate_qwk(human_scores, llm_scores, pesos=None):
     """
     Calcula o Quadratic Weighted Kappa (QWK).
     Espera duas listas de notas (int ou float).
+    Com 'pesos' (pesos amostrais, ex: de uma amostra estratificada), calcula o QWK ponderado.
     """
     try:
         # Garante que os dados sejam numpy arrays
@@ -14,20 +16,30 @@ def calculate_qwk(human_scores, llm_scores):
         llm_scores = np.array(llm_scores)
         
         # 'quadratic' é o que define o QWK
-        return cohen_kappa_score(human_scores, llm_scores, weights='quadratic')
+        return cohen_kappa_score(human_scores, llm_scores, weights='quadratic', sample_weight=pesos)
     except Exception as e:
         print(f"Erro ao calcular QWK: {e}")
         return None
 
-def calculate_pearson(human_scores, llm_scores):
+def calculate_pearson(human_scores, llm_scores, pesos=None):
     """
     Calcula o Coeficiente de Correlação de Pearson (r).
     Espera duas listas de notas (int ou float).
+    Com 'pesos', calcula a correlação ponderada (sem p-valor: retorna (r, None)).
     """
     try:
         # Garante que os dados sejam numpy arrays
         human_scores = np.array(human_scores)
         llm_scores = np.array(llm_scores)
+
+        if pesos is not None:
+            pesos = np.asarray(pesos, dtype=float)
+            desvio_humano = human_scores - np.average(human_scores, weights=pesos)
+            desvio_llm = llm_scores - np.average(llm_scores, weights=pesos)
+            covariancia = np.average(desvio_humano * desvio_llm, weights=pesos)
+            r = covariancia / np.sqrt(np.average(desvio_humano ** 2, weights=pesos)
+                                      * np.average(desvio_llm ** 2, weights=pesos))
+            return float(r), None
         
         # Retorna o coeficiente (r) e o p-valor
         r, p_value = pearsonr(human_scores, llm_scores)
@@ -36,19 +48,22 @@ def calculate_pearson(human_scores, llm_scores):
         print(f"Erro ao calcular Pearson: {e}")
         return None
 
-def calculate_adjacent_agreement(human_scores, llm_scores, threshold=100):
+def calculate_adjacent_agreement(human_scores, llm_scores, threshold=100, pesos=None):
     """
     Calcula a Proporção de Adjacent Agreement.
     Verifica a % de notas onde a diferença absoluta é <= threshold.
     
     Para notas de competência, usaremos threshold=80 (conforme seu relatório).
     Para a nota final, usaremos threshold=100.
+    Com 'pesos', a proporção é ponderada pelos pesos amostrais.
     """
     try:
         human_scores = np.array(human_scores)
         llm_scores = np.array(llm_scores)
         
         diff = np.abs(human_scores - llm_scores)
+        if pesos is not None:
+            return float(np.average(diff <= threshold, weights=pesos))
         agreement_count = np.sum(diff <= threshold)
         
         proportion = agreement_count / len(human_scores)
@@ -57,6 +72,52 @@ def calculate_adjacent_agreement(human_scores, llm_scores, threshold=100):
         print(f"Erro ao calcular Adjacent Agreement: {e}")
         return None
 
+def bootstrap_ic(human_scores, llm_scores, metrica, grupos=None, n_reamostras=1000, confianca=0.95, semente=0):
+    """
+    Intervalo de confiança (bootstrap percentil) de uma métrica como calculate_qwk
+    ou calculate_pearson (quando ela devolve uma tupla, usa o primeiro valor).
+    Com 'grupos' (ex: a redação de cada nota de competência), reamostra grupos
+    inteiros: as 5 notas de uma redação não são independentes entre si.
+    Retorna (estimativa, limite inferior, limite superior) ou None se não houver
+    dados suficientes.
+    """
+    try:
+        human_scores = np.asarray(human_scores)
+        llm_scores = np.asarray(llm_scores)
+        if grupos is None:
+            grupos = np.arange(len(human_scores))
+        _, grupos = np.unique(np.asarray(grupos), return_inverse=True)
+        n_grupos = int(grupos.max()) + 1 if len(grupos) else 0
+        if n_grupos < 2:
+            return None
+
+        def valor(indices):
+            # Reamostras degeneradas (ex: notas todas iguais) dão NaN e avisos: ficam de fora
+            with warnings.catch_warnings(), np.errstate(all='ignore'):
+                warnings.simplefilter("ignore")
+                resultado = metrica(human_scores[indices], llm_scores[indices])
+            if isinstance(resultado, tuple):
+                resultado = resultado[0]
+            return np.nan if resultado is None else float(resultado)
+
+        estimativa = valor(np.arange(len(human_scores)))
+        rng = np.random.default_rng(semente)
+        valores = []
+        for _ in range(n_reamostras):
+            # Cada nota entra tantas vezes quantas a sua redação foi sorteada
+            multiplicidade = np.bincount(rng.integers(0, n_grupos, n_grupos), minlength=n_grupos)
+            valores.append(valor(np.repeat(np.arange(len(grupos)), multiplicidade[grupos])))
+        valores = np.asarray(valores)
+        valores = valores[~np.isnan(valores)]
+        if len(valores) == 0:
+            return None
+        alfa = (1 - confianca) / 2
+        inferior, superior = np.quantile(valores, [alfa, 1 - alfa])
+        return estimativa, float(inferior), float(superior)
+    except Exception as e:
+        print(f"Erro ao calcular o intervalo de confiança por bootstrap: {e}")
+        return None
+
 # Teste local
 if __name__ == "__main__":
     # Notas de exemplo (5 competências)
@@ -0,0 +1,136 @@
+# coding: utf-8
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+import tracing
+
+
+def percentis(valores):
+    """Resumo de uma lista de durações (segundos): n, média, p50, p95, p99 e máximo."""
+    if len(valores) == 0:
+        return {"n": 0}
+    arr = np.asarray(valores, dtype=float)
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+    return {
+        "n": int(arr.size),
+        "total_s": float(arr.sum()),
+        "media_s": float(arr.mean()),
+        "p50_s": float(p50),
+        "p95_s": float(p95),
+        "p99_s": float(p99),
+        "max_s": float(arr.max()),
+    }
+
+
+class PerfRecorder:
+    """
+    Coleta, em memória, a duração de cada etapa do pipeline (carregar prompt,
+    chamada à API, parse do JSON, gravação...) e a latência de cada chamada
+    por (modelo, competência). Usado pelo benchmark.py.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.etapas = defaultdict(list)
+        # (modelo, competência) -> [(latência, sucesso)]
+        self.chamadas = defaultdict(list)
+        self.contadores = defaultdict(int)
+
+    def registrar_etapa(self, nome, duracao):
+        with self._lock:
+            self.etapas[nome].append(duracao)
+
+    @contextmanager
+    def medir(self, nome):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registrar_etapa(nome, time.perf_counter() - inicio)
+
+    def contar(self, nome, quantidade=1):
+        with self._lock:
+            self.contadores[nome] += quantidade
+
+    def registrar_chamada(self, modelo, competencia, latencia, sucesso):
+        with self._lock:
+            self.chamadas[(modelo, competencia)].append((latencia, sucesso))
+
+    def resumo(self):
+        """Percentis por etapa, por modelo e por (modelo, competência)."""
+        with self._lock:
+            chamadas = {chave: list(valores) for chave, valores in self.chamadas.items()}
+            etapas = {nome: list(valores) for nome, valores in self.etapas.items()}
+            contadores = dict(self.contadores)
+
+        por_modelo = defaultdict(list)
+        por_competencia = defaultdict(dict)
+        falhas = defaultdict(int)
+        for (modelo, competencia), valores in chamadas.items():
+            latencias = [latencia for latencia, _ in valores]
+            por_modelo[modelo].extend(latencias)
+            por_competencia[modelo][competencia] = percentis(latencias)
+            falhas[modelo] += sum(1 for _, sucesso in valores if not sucesso)
+
+        todas = [latencia for latencias in por_modelo.values() for latencia in latencias]
+        return {
+            "latencia_chamadas": {
+                "geral": percentis(todas),
+                "por_modelo": {modelo: dict(percentis(lat), falhas=falhas[modelo]) for modelo, lat in por_modelo.items()},
+                "por_competencia": dict(por_competencia),
+            },
+            "etapas": {nome: percentis(valores) for nome, valores in etapas.items()},
+            "contadores": contadores,
+        }
+
+
+# Gravador ativo do processo (None = instrumentação desligada, custo ~zero)
+_recorder = None
+
+
+def ativar():
+    """Liga a instrumentação e devolve o PerfRecorder novo."""
+    global _recorder
+    _recorder = PerfRecorder()
+    return _recorder
+
+
+def desativar():
+    global _recorder
+    _recorder = None
+
+
+def ativo():
+    return _recorder
+
+
+@contextmanager
+def _medir_e_rastrear(recorder, nome, atributos):
+    with tracing.span(nome, **atributos), recorder.medir(nome):
+        yield
+
+
+def medir(nome, **atributos):
+    """
+    Context manager que mede a etapa 'nome' (não faz nada com a instrumentação desligada).
+    Com o tracing ligado, a etapa também vira um span, com os 'atributos' dados.
+    """
+    recorder = _recorder
+    if recorder is None:
+        return tracing.span(nome, **atributos)
+    if tracing.ativo() is None:
+        return recorder.medir(nome)
+    return _medir_e_rastrear(recorder, nome, atributos)
+
+
+def contar(nome, quantidade=1):
+    if _recorder is not None:
+        _recorder.contar(nome, quantidade)
+
+
+def registrar_chamada(modelo, competencia, latencia, sucesso):
+    if _recorder is not None:
+        _recorder.registrar_chamada(modelo, competencia, latencia, sucesso)
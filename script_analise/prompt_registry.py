@@ -0,0 +1,122 @@
+# coding: utf-8
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+
+from response_cache import hash_texto
+
+# Um prompt carregado: nome do arquivo, texto, hash (SHA-256) do conteúdo e mtime do arquivo
+Prompt = namedtuple("Prompt", ["nome", "texto", "hash", "mtime"])
+
+# Convenção de nomes da pasta /prompts:
+#   c{N}_{estrategia}.txt       -> prompt da competência N (ex: c1_zero_shot.txt, c1_few_shot.txt)
+#   completo_{estrategia}.txt   -> prompt com as 5 competências de uma vez
+PADRAO_NOME_PROMPT = re.compile(r"^(c[1-5]|completo)_(\w+)\.txt$")
+
+
+class PromptRegistry:
+    """
+    Carrega todos os prompts da pasta uma única vez e os serve da memória.
+
+    Cada prompt tem um hash do conteúdo (usado na proveniência dos resultados
+    e nas chaves de cache). Um arquivo só é relido quando seu mtime muda; a
+    checagem (um os.stat) é feita no máximo a cada 'intervalo_verificacao'
+    segundos por arquivo, então não há I/O por chamada nos lotes grandes.
+    """
+    def __init__(self, diretorio="prompts", intervalo_verificacao=2.0):
+        self.diretorio = diretorio
+        self.intervalo_verificacao = intervalo_verificacao
+        self._prompts = {}
+        self._ultima_verificacao = {}
+        self._lock = threading.Lock()
+        self.recargas = 0
+        self.carregar_todos()
+
+    @staticmethod
+    def nome_arquivo(comp_id, estrategia="zero_shot"):
+        """Nome do arquivo de prompt; comp_id=None indica o prompt 'completo'."""
+        prefixo = "completo" if comp_id is None else f"c{comp_id}"
+        return f"{prefixo}_{estrategia}.txt"
+
+    def _ler(self, nome):
+        caminho = os.path.join(self.diretorio, nome)
+        mtime = os.path.getmtime(caminho)
+        with open(caminho, 'r', encoding='utf-8') as f:
+            texto = f.read()
+        return Prompt(nome, texto, hash_texto(texto), mtime)
+
+    def carregar_todos(self):
+        """(Re)carrega todos os arquivos da pasta que seguem a convenção de nomes."""
+        try:
+            nomes = sorted(os.listdir(self.diretorio))
+        except OSError as e:
+            print(f"Erro ao listar a pasta de prompts '{self.diretorio}': {e}")
+            return
+        agora = time.monotonic()
+        with self._lock:
+            for nome in nomes:
+                if not PADRAO_NOME_PROMPT.match(nome):
+                    continue
+                try:
+                    self._prompts[nome] = self._ler(nome)
+                    self._ultima_verificacao[nome] = agora
+                except Exception as e:
+                    print(f"Erro ao carregar prompt: {nome}. {e}")
+            por_hash = {}
+            for nome, prompt in self._prompts.items():
+                por_hash.setdefault(prompt.hash, []).append(nome)
+        print(f"[OK] {len(self._prompts)} prompts carregados de '{self.diretorio}'")
+        for nomes_iguais in por_hash.values():
+            if len(nomes_iguais) > 1:
+                # O cache separa as respostas por competência, mas o prompt repetido é quase sempre um engano
+                print(f"[PromptRegistry AVISO] Prompts com o mesmo conteúdo: {', '.join(sorted(nomes_iguais))}. "
+                      f"Confira se cada arquivo traz a rubrica da sua competência.")
+
+    def get(self, nome):
+        """Retorna o Prompt pelo nome do arquivo (ou None), relendo se o arquivo mudou."""
+        agora = time.monotonic()
+        with self._lock:
+            prompt = self._prompts.get(nome)
+            if prompt is not None and agora - self._ultima_verificacao.get(nome, 0) < self.intervalo_verificacao:
+                return prompt
+
+            self._ultima_verificacao[nome] = agora
+            try:
+                mtime = os.path.getmtime(os.path.join(self.diretorio, nome))
+                if prompt is None or mtime != prompt.mtime:
+                    if prompt is not None:
+                        self.recargas += 1
+                        print(f"[OK] Prompt '{nome}' alterado no disco. Recarregado.")
+                    prompt = self._ler(nome)
+                    self._prompts[nome] = prompt
+            except OSError as e:
+                # Arquivo removido/inacessível: mantém a última versão conhecida, se houver
+                if prompt is None:
+                    print(f"Erro ao carregar prompt: {os.path.join(self.diretorio, nome)}. {e}")
+            return prompt
+
+    def get_competencia(self, comp_id, estrategia="zero_shot"):
+        """Prompt da competência comp_id (ou o 'completo' se comp_id=None) na estratégia pedida."""
+        return self.get(self.nome_arquivo(comp_id, estrategia))
+
+    def estrategias(self):
+        """Estratégias disponíveis para as 5 competências e para o modo completo."""
+        por_prefixo = {}
+        with self._lock:
+            for nome in self._prompts:
+                prefixo, estrategia = PADRAO_NOME_PROMPT.match(nome).groups()
+                por_prefixo.setdefault(estrategia, set()).add(prefixo)
+        return {
+            estrategia: {
+                "por_competencia": all(f"c{c}" in prefixos for c in range(1, 6)),
+                "completo": "completo" in prefixos,
+            }
+            for estrategia, prefixos in por_prefixo.items()
+        }
+
+    def hashes(self):
+        """Mapa nome -> hash de todos os prompts carregados (para registrar a proveniência da execução)."""
+        with self._lock:
+            return {nome: prompt.hash for nome, prompt in self._prompts.items()}
@@ -0,0 +1,167 @@
+# coding: utf-8
+import threading
+import time
+
+# Heurística de ~4 caracteres por token (boa o suficiente para português)
+CARACTERES_POR_TOKEN = 4
+
+
+def estimar_tokens(texto):
+    """
+    Estimativa local e barata da quantidade de tokens de um texto.
+    Usada para reservar orçamento de TPM antes da chamada.
+    """
+    if not texto:
+        return 0
+    return max(1, len(texto) // CARACTERES_POR_TOKEN)
+
+
+def is_quota_exhausted_error(erro):
+    """
+    Cota da conta esgotada (OpenAI: 429 com code="insufficient_quota", sem crédito).
+    Não passa esperando: não é limite de taxa e não adianta repetir.
+    """
+    return getattr(erro, "code", None) == "insufficient_quota" or "insufficient_quota" in str(erro).lower()
+
+
+def is_rate_limit_error(erro):
+    """
+    Identifica erros de limite de taxa (HTTP 429) dos SDKs.
+    OpenAI: RateLimitError (status_code=429), menos a cota esgotada (insufficient_quota).
+    Gemini: google.api_core.exceptions.ResourceExhausted (code=429).
+    """
+    if is_quota_exhausted_error(erro):
+        return False
+    if getattr(erro, "status_code", None) == 429 or getattr(erro, "code", None) == 429:
+        return True
+    mensagem = str(erro).lower()
+    return "429" in mensagem or "rate limit" in mensagem or "resource exhausted" in mensagem or "quota" in mensagem
+
+
+class TokenBucket:
+    """
+    Balde de fichas simples: enche a 'taxa_por_minuto' e guarda no máximo
+    'rajada_segundos' de orçamento acumulado.
+    Não é thread-safe sozinho; quem protege é o AdaptiveRateLimiter.
+    """
+    def __init__(self, taxa_por_minuto, rajada_segundos=10):
+        self.taxa_por_minuto = taxa_por_minuto
+        self.rajada_segundos = rajada_segundos
+        self.fichas = self.capacidade
+        self.ultimo_refill = time.monotonic()
+
+    @property
+    def capacidade(self):
+        return max(1.0, self.taxa_por_minuto * self.rajada_segundos / 60.0)
+
+    def refill(self, agora):
+        decorrido = agora - self.ultimo_refill
+        self.ultimo_refill = agora
+        self.fichas = min(self.capacidade, self.fichas + decorrido * self.taxa_por_minuto / 60.0)
+
+    def tempo_ate(self, quantidade):
+        """Segundos até existirem 'quantidade' fichas (0 se já existem)."""
+        # Pedidos maiores que o balde inteiro esperam só até o balde encher
+        quantidade = min(quantidade, self.capacidade)
+        falta = quantidade - self.fichas
+        if falta <= 0:
+            return 0.0
+        return falta * 60.0 / self.taxa_por_minuto
+
+    def consumir(self, quantidade):
+        self.fichas -= min(quantidade, self.capacidade)
+
+
+class AdaptiveRateLimiter:
+    """
+    Limitador de taxa por provedor com dois baldes: requisições por minuto (RPM)
+    e tokens por minuto (TPM). Um limite None desliga o balde correspondente.
+
+    É adaptativo (AIMD): cada erro 429 multiplica a taxa efetiva por
+    'fator_reducao' e cada sucesso devolve 'fator_recuperacao' dela, até
+    voltar ao orçamento nominal. Assim o provedor roda perto da própria cota
+    em vez de um delay fixo de pior caso.
+    """
+    def __init__(self, rpm=None, tpm=None, fator_reducao=0.5, fator_recuperacao=0.02,
+                 taxa_minima=0.05, pausa_apos_429=5.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.fator_reducao = fator_reducao
+        self.fator_recuperacao = fator_recuperacao
+        self.taxa_minima = taxa_minima
+        self.pausa_apos_429 = pausa_apos_429
+
+        # Fração do orçamento nominal em uso (1.0 = cota cheia)
+        self.taxa_atual = 1.0
+        self.pausado_ate = 0.0
+        self._lock = threading.Lock()
+        self._bucket_req = TokenBucket(rpm) if rpm else None
+        self._bucket_tok = TokenBucket(tpm) if tpm else None
+
+        # Estatísticas para o resumo da execução
+        self.total_requisicoes = 0
+        self.total_429 = 0
+        self.tempo_espera_total = 0.0
+
+    def _aplicar_taxa(self):
+        if self._bucket_req:
+            self._bucket_req.taxa_por_minuto = self.rpm * self.taxa_atual
+        if self._bucket_tok:
+            self._bucket_tok.taxa_por_minuto = self.tpm * self.taxa_atual
+
+    def acquire(self, tokens=0):
+        """
+        Bloqueia até existir orçamento para 1 requisição com 'tokens' tokens.
+        Retorna o tempo (s) que ficou esperando.
+        """
+        inicio = time.monotonic()
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                espera = max(0.0, self.pausado_ate - agora)
+                if self._bucket_req:
+                    self._bucket_req.refill(agora)
+                    espera = max(espera, self._bucket_req.tempo_ate(1))
+                if self._bucket_tok:
+                    self._bucket_tok.refill(agora)
+                    espera = max(espera, self._bucket_tok.tempo_ate(tokens))
+
+                if espera <= 0:
+                    if self._bucket_req:
+                        self._bucket_req.consumir(1)
+                    if self._bucket_tok:
+                        self._bucket_tok.consumir(tokens)
+                    self.total_requisicoes += 1
+                    esperado = time.monotonic() - inicio
+                    self.tempo_espera_total += esperado
+                    return esperado
+            time.sleep(espera)
+
+    def report_rate_limit(self, retry_after=None):
+        """Chamado quando o provedor responde 429: reduz a taxa e pausa um pouco."""
+        with self._lock:
+            self.total_429 += 1
+            self.taxa_atual = max(self.taxa_minima, self.taxa_atual * self.fator_reducao)
+            self._aplicar_taxa()
+            pausa = retry_after if retry_after is not None else self.pausa_apos_429
+            self.pausado_ate = max(self.pausado_ate, time.monotonic() + pausa)
+            # Esvazia os baldes: o orçamento acumulado claramente não existe do lado do servidor
+            for bucket in (self._bucket_req, self._bucket_tok):
+                if bucket:
+                    bucket.fichas = 0.0
+
+    def report_success(self):
+        """Chamado a cada resposta OK: recupera a taxa aos poucos."""
+        if self.taxa_atual >= 1.0:
+            return
+        with self._lock:
+            self.taxa_atual = min(1.0, self.taxa_atual + self.fator_recuperacao)
+            self._aplicar_taxa()
+
+    def stats(self):
+        return {
+            "requisicoes": self.total_requisicoes,
+            "erros_429": self.total_429,
+            "taxa_atual": self.taxa_atual,
+            "tempo_espera_total": self.tempo_espera_total,
+        }
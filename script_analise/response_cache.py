@@ -0,0 +1,128 @@
+# coding: utf-8
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def hash_texto(texto):
+    """SHA-256 (hex) de um texto. Usado para prompts e redações nas chaves do cache."""
+    return hashlib.sha256((texto or "").encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Cache persistente (SQLite) das respostas JSON das LLMs, endereçado por conteúdo.
+
+    A chave combina provedor, modelo, hash do prompt, hash da redação e a
+    configuração de geração (temperatura, schema). Qualquer mudança em um
+    desses itens gera uma chave nova, então o cache nunca devolve uma
+    correção feita com outro prompt ou outra configuração.
+
+    Despejo: entradas mais antigas que 'max_idade_dias' são removidas e,
+    acima de 'max_entradas', saem as menos acessadas recentemente (LRU).
+    """
+    # A cada quantas gravações roda o despejo
+    INTERVALO_DESPEJO = 500
+
+    def __init__(self, caminho="cache_respostas.sqlite", max_entradas=None, max_idade_dias=None):
+        self.caminho = caminho
+        self.max_entradas = max_entradas
+        self.max_idade_dias = max_idade_dias
+        self.hits = 0
+        self.misses = 0
+        self._gravacoes = 0
+        self._lock = threading.Lock()
+
+        # Uma única conexão compartilhada entre as threads do modo async (protegida pelo lock)
+        self._conn = sqlite3.connect(caminho, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS respostas (
+                chave TEXT PRIMARY KEY,
+                provedor TEXT,
+                modelo TEXT,
+                resposta TEXT NOT NULL,
+                criado_em REAL NOT NULL,
+                ultimo_acesso REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ultimo_acesso ON respostas (ultimo_acesso)")
+        self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(provedor, model_name, system_prompt, redacao_texto, generation_config):
+        """Monta a chave do cache a partir do conteúdo da chamada."""
+        partes = {
+            "provedor": provedor,
+            "modelo": model_name,
+            "prompt": hash_texto(system_prompt),
+            "redacao": hash_texto(redacao_texto),
+            "config": generation_config or {},
+        }
+        serializado = json.dumps(partes, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(serializado.encode("utf-8")).hexdigest()
+
+    def get(self, chave):
+        """Retorna o JSON guardado (dict) ou None."""
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT resposta FROM respostas WHERE chave = ?", (chave,)
+            ).fetchone()
+            if linha is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE respostas SET ultimo_acesso = ? WHERE chave = ?", (time.time(), chave)
+            )
+            self._conn.commit()
+        return json.loads(linha[0])
+
+    def put(self, chave, json_data, provedor=None, modelo=None):
+        """Guarda uma resposta bem-sucedida."""
+        agora = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO respostas (chave, provedor, modelo, resposta, criado_em, ultimo_acesso) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (chave, provedor, modelo, json.dumps(json_data, ensure_ascii=False), agora, agora),
+            )
+            self._conn.commit()
+            self._gravacoes += 1
+            precisa_despejar = self._gravacoes % self.INTERVALO_DESPEJO == 0
+        if precisa_despejar:
+            self.evict()
+
+    def evict(self):
+        """Remove entradas expiradas (idade) e o excesso (LRU). Retorna quantas saíram."""
+        removidas = 0
+        with self._lock:
+            if self.max_idade_dias is not None:
+                limite = time.time() - self.max_idade_dias * 86400
+                removidas += self._conn.execute(
+                    "DELETE FROM respostas WHERE criado_em < ?", (limite,)
+                ).rowcount
+            if self.max_entradas is not None:
+                removidas += self._conn.execute(
+                    "DELETE FROM respostas WHERE chave IN ("
+                    " SELECT chave FROM respostas ORDER BY ultimo_acesso DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entradas,),
+                ).rowcount
+            self._conn.commit()
+        return removidas
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM respostas").fetchone()[0]
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entradas": len(self)}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
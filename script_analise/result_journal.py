@@ -0,0 +1,82 @@
+# coding: utf-8
+import json
+import os
+import threading
+import time
+
+from result_sink import ResultSink
+
+
+class ResultJournal(ResultSink):
+    """
+    Diário append-only (JSONL) das avaliações de uma execução.
+
+    Cada avaliação de competência é gravada (com flush + fsync) assim que
+    chega, então um crash ou Ctrl-C não perde o que já foi pago. Junto do
+    diário fica um manifesto com a amostra e a configuração da execução,
+    usado pelo --resume para recarregar as mesmas redações e pular o que
+    já está no diário.
+    Com retomar=True, a pasta da execução não é criada: se ela não existe
+    (ex: run_id digitado errado), existe() devolve False e nada fica para trás.
+    """
+    def __init__(self, diretorio_execucoes="execucoes", run_id=None, retomar=False):
+        self.run_id = run_id or time.strftime("%Y%m%d-%H%M%S")
+        self.diretorio = os.path.join(diretorio_execucoes, self.run_id)
+        self.caminho = os.path.join(self.diretorio, "journal.jsonl")
+        self.caminho_manifesto = os.path.join(self.diretorio, "manifesto.json")
+        self._lock = threading.Lock()
+        if not retomar:
+            os.makedirs(self.diretorio, exist_ok=True)
+
+    def existe(self):
+        return os.path.exists(self.caminho_manifesto)
+
+    def salvar_manifesto(self, manifesto):
+        with open(self.caminho_manifesto, 'w', encoding='utf-8') as f:
+            json.dump(manifesto, f, ensure_ascii=False, indent=2)
+
+    def carregar_manifesto(self):
+        with open(self.caminho_manifesto, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def append(self, linhas):
+        """Grava as linhas de uma tarefa concluída e força a ida ao disco."""
+        if not linhas:
+            return
+        with self._lock:
+            with open(self.caminho, 'a', encoding='utf-8') as f:
+                for linha in linhas:
+                    f.write(json.dumps(linha, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    # O diário também é um sink: recebe as linhas junto com o CSV e a tabela de notas
+    write = append
+
+    def iterar(self):
+        """
+        Lê o diário linha a linha (sem carregá-lo inteiro). Uma última linha
+        truncada (crash no meio da gravação) é ignorada; aquela avaliação será refeita.
+        """
+        if not os.path.exists(self.caminho):
+            return
+        with open(self.caminho, 'r', encoding='utf-8') as f:
+            for numero, texto in enumerate(f, start=1):
+                if not texto.strip():
+                    continue
+                try:
+                    yield json.loads(texto)
+                except json.JSONDecodeError:
+                    print(f"Aviso: linha {numero} do diário '{self.caminho}' está corrompida. Ignorando.")
+
+    def carregar(self):
+        """Lê todas as linhas do diário."""
+        return list(self.iterar())
+
+    @staticmethod
+    def chave(linha):
+        """Identifica uma avaliação: (redação, modelo, competência)."""
+        return (linha["redacao_id"], linha["modelo"], linha["competencia"])
+
+    def chaves_concluidas(self):
+        return {self.chave(linha) for linha in self.iterar()}
@@ -0,0 +1,283 @@
+# coding: utf-8
+import csv
+import json
+import os
+from array import array
+
+import numpy as np
+
+# pyarrow é opcional: só é necessário para o formato Parquet
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+# Colunas numéricas das linhas de resultado (no CSV tudo volta como texto)
+COLUNAS_INTEIRAS = ("nota_humano", "nota_llm", "diferenca")
+COLUNAS_REAIS = ("tokens_entrada", "tokens_saida", "tokens_cache", "latencia_s", "custo_usd", "concordancia",
+                 "tempo_ate_nota_s")
+# Colunas que só algumas linhas trazem (self-consistency, cascata, streaming). Entram sempre no
+# cabeçalho/schema, senão uma linha posterior que as tenha perderia esses valores.
+COLUNAS_OPCIONAIS = ("concordancia", "modelo_cascata", "tempo_ate_nota_s")
+
+
+def colunas_das_linhas(linhas):
+    """Colunas da primeira linha, na ordem dela, seguidas das COLUNAS_OPCIONAIS que faltarem."""
+    colunas = list(linhas[0].keys())
+    return colunas + [coluna for coluna in COLUNAS_OPCIONAIS if coluna not in colunas]
+
+
+class ResultSink:
+    """
+    Destino de linhas de resultado gravadas à medida que chegam.
+    Implementações: CsvSink, JsonlSink, ParquetSink, TabelaNotas e MultiSink.
+    """
+    caminho = None
+
+    def write(self, linhas):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class CsvSink(ResultSink):
+    """
+    CSV com flush a cada lote de linhas. O cabeçalho vem das chaves da primeira
+    linha mais as COLUNAS_OPCIONAIS (vazias nas linhas que não as têm).
+    """
+    def __init__(self, caminho):
+        self.caminho = caminho
+        # utf-8-sig: mesmo encoding do CSV original (abre direto no Excel)
+        self._arquivo = open(caminho, 'w', encoding='utf-8-sig', newline='')
+        self._writer = None
+
+    def write(self, linhas):
+        if not linhas:
+            return
+        if self._writer is None:
+            self._writer = csv.DictWriter(self._arquivo, fieldnames=colunas_das_linhas(linhas), extrasaction='ignore')
+            self._writer.writeheader()
+        self._writer.writerows(linhas)
+        self._arquivo.flush()
+
+    def close(self):
+        self._arquivo.close()
+
+
+class JsonlSink(ResultSink):
+    """Uma linha JSON por avaliação, com flush a cada lote."""
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._arquivo = open(caminho, 'w', encoding='utf-8')
+
+    def write(self, linhas):
+        for linha in linhas:
+            self._arquivo.write(json.dumps(linha, ensure_ascii=False) + "\n")
+        self._arquivo.flush()
+
+    def close(self):
+        self._arquivo.close()
+
+
+class ParquetSink(ResultSink):
+    """
+    Parquet gravado em row groups de 'tamanho_row_group' linhas: a memória
+    fica limitada ao buffer de um row group, não ao tamanho da execução.
+    O schema é inferido no primeiro row group, sempre com as COLUNAS_OPCIONAIS.
+    """
+    def __init__(self, caminho, tamanho_row_group=5000):
+        if pa is None:
+            raise ImportError("O formato Parquet exige o pacote 'pyarrow' (pip install pyarrow).")
+        self.caminho = caminho
+        self.tamanho_row_group = tamanho_row_group
+        self._buffer = []
+        self._writer = None
+
+    def write(self, linhas):
+        self._buffer.extend(linhas)
+        if len(self._buffer) >= self.tamanho_row_group:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        if self._writer is None:
+            inferido = pa.Table.from_pylist(self._buffer).schema
+            campos = []
+            for coluna in colunas_das_linhas(self._buffer):
+                tipo = inferido.field(coluna).type if coluna in inferido.names else pa.null()
+                # Colunas só com None no primeiro row group (ex: justificativa vazia) ou ausentes
+                # dele (ex: concordancia) viram float se forem numéricas, senão texto
+                if pa.types.is_null(tipo):
+                    tipo = pa.float64() if coluna in COLUNAS_REAIS else pa.string()
+                campos.append(pa.field(coluna, tipo))
+            schema = pa.schema(campos)
+            self._writer = pq.ParquetWriter(self.caminho, schema)
+        tabela = pa.Table.from_pylist(self._buffer, schema=self._writer.schema)
+        self._writer.write_table(tabela)
+        self._buffer = []
+
+    def close(self):
+        self._flush()
+        if self._writer is not None:
+            self._writer.close()
+
+
+class MultiSink(ResultSink):
+    """Repassa cada lote de linhas para vários sinks."""
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    def write(self, linhas):
+        for sink in self.sinks:
+            sink.write(linhas)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+class TabelaNotas(ResultSink):
+    """
+    Tabela numérica compacta (arrays de inteiros) com só o que as métricas
+    usam: modelo, redação, competência, nota humana e nota da LLM.
+    Os textos longos (raciocinio_cot, justificativa) nunca ficam em memória.
+    """
+    def __init__(self):
+        self.modelos = []
+        self.redacao_ids = []
+        self._indice_modelo = {}
+        self._indice_redacao = {}
+        self.col_modelo = array('H')
+        self.col_redacao = array('I')
+        self.col_comp = array('B')
+        self.col_humano = array('h')
+        self.col_llm = array('h')
+
+    def _indice(self, valor, indices, lista):
+        indice = indices.get(valor)
+        if indice is None:
+            indice = indices[valor] = len(lista)
+            lista.append(valor)
+        return indice
+
+    def write(self, linhas):
+        for linha in linhas:
+            self.col_modelo.append(self._indice(linha["modelo"], self._indice_modelo, self.modelos))
+            self.col_redacao.append(self._indice(linha["redacao_id"], self._indice_redacao, self.redacao_ids))
+            self.col_comp.append(int(str(linha["competencia"]).lstrip("C")))
+            self.col_humano.append(int(linha["nota_humano"]))
+            self.col_llm.append(int(linha["nota_llm"]))
+
+    def __len__(self):
+        return len(self.col_llm)
+
+    def scores_competencias(self, modelo):
+        """(notas humanas, notas da LLM) de todas as competências avaliadas pelo modelo."""
+        mascara = np.frombuffer(self.col_modelo, dtype=np.uint16) == self._indice_modelo[modelo]
+        humano = np.frombuffer(self.col_humano, dtype=np.int16)[mascara].astype(np.int64)
+        llm = np.frombuffer(self.col_llm, dtype=np.int16)[mascara].astype(np.int64)
+        return humano, llm
+
+    def redacoes_competencias(self, modelo):
+        """Índice da redação de cada nota de scores_competencias (mesma ordem), para o bootstrap por redação."""
+        mascara = np.frombuffer(self.col_modelo, dtype=np.uint16) == self._indice_modelo[modelo]
+        return np.frombuffer(self.col_redacao, dtype=np.uint32)[mascara].astype(np.int64)
+
+    def pares_llm(self, modelo_a, modelo_b):
+        """
+        Notas da LLM dos dois modelos nas (redação, competência) avaliadas por ambos,
+        alinhadas (ex: cascata x modelo forte). Retorna (notas de modelo_a, notas de modelo_b).
+        """
+        modelos = np.frombuffer(self.col_modelo, dtype=np.uint16)
+        chaves = (np.frombuffer(self.col_redacao, dtype=np.uint32).astype(np.int64) * 8
+                  + np.frombuffer(self.col_comp, dtype=np.uint8))
+        llm = np.frombuffer(self.col_llm, dtype=np.int16).astype(np.int64)
+        mascara_a = modelos == self._indice_modelo[modelo_a]
+        mascara_b = modelos == self._indice_modelo[modelo_b]
+        chaves_a, indices_a = np.unique(chaves[mascara_a], return_index=True)
+        chaves_b, indices_b = np.unique(chaves[mascara_b], return_index=True)
+        _, comuns_a, comuns_b = np.intersect1d(chaves_a, chaves_b, return_indices=True)
+        return llm[mascara_a][indices_a[comuns_a]], llm[mascara_b][indices_b[comuns_b]]
+
+    def scores_finais(self, modelo):
+        """
+        Notas finais (soma C1-C5) das redações que o modelo avaliou por completo.
+        Retorna (ids das redações, totais humanos, totais da LLM, ids incompletos).
+        """
+        mascara = np.frombuffer(self.col_modelo, dtype=np.uint16) == self._indice_modelo[modelo]
+        redacoes = np.frombuffer(self.col_redacao, dtype=np.uint32)[mascara].astype(np.int64)
+        n = len(self.redacao_ids)
+        contagem = np.bincount(redacoes, minlength=n)
+        total_humano = np.bincount(redacoes, weights=np.frombuffer(self.col_humano, dtype=np.int16)[mascara], minlength=n)
+        total_llm = np.bincount(redacoes, weights=np.frombuffer(self.col_llm, dtype=np.int16)[mascara], minlength=n)
+
+        # Mantém a ordem em que as redações apareceram pela primeira vez para este modelo
+        _, primeira_ocorrencia = np.unique(redacoes, return_index=True)
+        ordem = redacoes[np.sort(primeira_ocorrencia)]
+        completas = ordem[contagem[ordem] == 5]
+        incompletas = ordem[contagem[ordem] != 5]
+        return ([self.redacao_ids[i] for i in completas],
+                total_humano[completas].astype(np.int64),
+                total_llm[completas].astype(np.int64),
+                [self.redacao_ids[i] for i in incompletas])
+
+
+def abrir_sinks(caminho_csv, formatos=("csv",), tamanho_row_group=5000):
+    """
+    Abre um sink por formato pedido ("csv", "jsonl", "parquet"), todos com o
+    mesmo nome-base de 'caminho_csv'. Retorna (MultiSink, lista de caminhos).
+    """
+    base, _ = os.path.splitext(caminho_csv)
+    sinks = []
+    for formato in formatos:
+        if formato == "csv":
+            sinks.append(CsvSink(caminho_csv))
+        elif formato == "jsonl":
+            sinks.append(JsonlSink(base + ".jsonl"))
+        elif formato == "parquet":
+            sinks.append(ParquetSink(base + ".parquet", tamanho_row_group))
+        else:
+            raise ValueError(f"Formato de saída desconhecido: '{formato}' (use csv, jsonl ou parquet)")
+    return MultiSink(sinks), [sink.caminho for sink in sinks]
+
+
+def _tipar_linha_csv(linha):
+    """Converte as colunas numéricas de uma linha lida do CSV; células vazias viram None."""
+    for coluna, valor in linha.items():
+        if valor == "":
+            linha[coluna] = None
+        elif coluna in COLUNAS_INTEIRAS:
+            linha[coluna] = int(valor)
+        elif coluna in COLUNAS_REAIS:
+            linha[coluna] = float(valor)
+    return linha
+
+
+def ler_resultados(caminho):
+    """
+    Lê, uma a uma, as linhas de resultado gravadas por um sink: CSV, JSONL (inclusive
+    o diário da execução) ou Parquet. Linhas JSON corrompidas são ignoradas.
+    """
+    if caminho.endswith(".csv"):
+        with open(caminho, 'r', encoding='utf-8-sig', newline='') as f:
+            for linha in csv.DictReader(f):
+                yield _tipar_linha_csv(linha)
+        return
+    if caminho.endswith(".parquet"):
+        if pq is None:
+            raise ImportError("O formato Parquet exige o pacote 'pyarrow' (pip install pyarrow).")
+        for lote in pq.ParquetFile(caminho).iter_batches():
+            yield from lote.to_pylist()
+        return
+    with open(caminho, 'r', encoding='utf-8') as f:
+        for texto in f:
+            if texto.strip():
+                try:
+                    yield json.loads(texto)
+                except json.JSONDecodeError:
+                    continue
@@ -0,0 +1,190 @@
+# coding: utf-8
+import json
+import random
+import threading
+import time
+
+from rate_limiter import is_rate_limit_error
+
+# Nomes de exceções de timeout/conexão dos SDKs (comparados pelo nome da classe
+# para não importar os pacotes de erro de cada provedor aqui)
+ERROS_TRANSITORIOS = {
+    "APITimeoutError", "APIConnectionError", "InternalServerError",  # OpenAI (e Google)
+    "DeadlineExceeded", "ServiceUnavailable", "GatewayTimeout", "Aborted",  # Google (api_core)
+}
+
+
+class RespostaInvalida(ValueError):
+    """JSON da LLM fora do schema (campo ausente, tipo errado): retentável, como o JSON malformado."""
+
+
+def _status_http(erro):
+    """Código HTTP do erro, se o SDK expuser um (OpenAI: status_code, Google: code)."""
+    for atributo in ("status_code", "code"):
+        valor = getattr(erro, atributo, None)
+        if isinstance(valor, int):
+            return valor
+    return None
+
+
+def is_retryable_error(erro):
+    """
+    Classifica um erro de chamada como retentável (vale tentar de novo) ou fatal.
+    Retentáveis: timeouts e falhas de conexão, 429, 5xx e JSON malformado /
+    fora do schema (a próxima geração costuma vir certa).
+    Fatais: o resto (chave inválida, cota esgotada, 400, 403, 404, conteúdo
+    bloqueado, outros ValueError, que costumam ser erro de programação...).
+    """
+    if is_rate_limit_error(erro):
+        return True
+    if isinstance(erro, (TimeoutError, ConnectionError, json.JSONDecodeError, RespostaInvalida)):
+        return True
+    if type(erro).__name__ in ERROS_TRANSITORIOS:
+        return True
+    status = _status_http(erro)
+    return status is not None and (status >= 500 or status == 408)
+
+
+def retry_after_do_erro(erro):
+    """Segundos pedidos pelo servidor no cabeçalho Retry-After (ou None)."""
+    resposta = getattr(erro, "response", None)
+    cabecalhos = getattr(resposta, "headers", None)
+    if not cabecalhos:
+        return None
+    try:
+        return float(cabecalhos.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Retentativas com backoff exponencial e jitter ("full jitter"): antes da
+    tentativa n+1 espera um tempo sorteado entre 0 e min(espera_maxima,
+    espera_base * 2^n). O sorteio evita que as threads que falharam juntas
+    voltem todas no mesmo instante.
+    """
+    def __init__(self, max_tentativas=4, espera_base=1.0, espera_maxima=30.0):
+        self.max_tentativas = max(1, max_tentativas)
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self._lock = threading.Lock()
+
+        # Estatísticas para o resumo da execução
+        self.retentativas = 0
+        self.erros_retentaveis = 0
+        self.erros_fatais = 0
+        self.tentativas_esgotadas = 0
+        self.tempo_backoff_total = 0.0
+
+    def espera(self, tentativa):
+        """Tempo (s) de espera depois da tentativa 'tentativa' (começando em 0)."""
+        return random.uniform(0, min(self.espera_maxima, self.espera_base * 2 ** tentativa))
+
+    def registrar(self, retentavel, esgotou=False, espera=0.0):
+        with self._lock:
+            if not retentavel:
+                self.erros_fatais += 1
+                return
+            self.erros_retentaveis += 1
+            if esgotou:
+                self.tentativas_esgotadas += 1
+            else:
+                self.retentativas += 1
+                self.tempo_backoff_total += espera
+
+    def stats(self):
+        return {
+            "retentativas": self.retentativas,
+            "erros_retentaveis": self.erros_retentaveis,
+            "erros_fatais": self.erros_fatais,
+            "tentativas_esgotadas": self.tentativas_esgotadas,
+            "tempo_backoff_total": self.tempo_backoff_total,
+        }
+
+
+class CircuitBreaker:
+    """
+    Disjuntor por provedor. Depois de 'limite_falhas' falhas seguidas (5xx,
+    timeouts... os 429 ficam com o limitador de taxa), o provedor é pausado
+    por 'tempo_pausa' segundos em vez de continuar gastando cota com chamadas
+    que vão falhar. Passada a pausa, UMA chamada de teste é liberada: se der
+    certo o disjuntor fecha; se falhar ele reabre com o dobro da pausa (até
+    'tempo_pausa_maximo'). Após 'max_disparos_seguidos' disparos sem nenhum
+    sucesso, o provedor é dado como fora do ar e as chamadas falham na hora.
+    """
+    FECHADO = "fechado"
+    ABERTO = "aberto"
+    MEIO_ABERTO = "meio_aberto"
+
+    def __init__(self, limite_falhas=5, tempo_pausa=30.0, tempo_pausa_maximo=300.0, max_disparos_seguidos=5):
+        self.limite_falhas = limite_falhas
+        self.tempo_pausa = tempo_pausa
+        self.tempo_pausa_maximo = tempo_pausa_maximo
+        self.max_disparos_seguidos = max_disparos_seguidos
+
+        self.estado = self.FECHADO
+        self.falhas_seguidas = 0
+        self.disparos_seguidos = 0
+        self.reabre_em = 0.0
+        self._cond = threading.Condition()
+
+        # Estatísticas para o resumo da execução
+        self.disparos = 0
+        self.tempo_pausa_total = 0.0
+        self.chamadas_recusadas = 0
+
+    def aguardar(self):
+        """
+        Bloqueia enquanto o disjuntor estiver aberto.
+        Retorna True se a chamada pode seguir, False se o provedor foi dado como fora do ar.
+        """
+        with self._cond:
+            while True:
+                if self.estado == self.FECHADO:
+                    return True
+                if self.disparos_seguidos >= self.max_disparos_seguidos:
+                    self.chamadas_recusadas += 1
+                    return False
+                espera = None
+                if self.estado == self.ABERTO:
+                    espera = self.reabre_em - time.monotonic()
+                    if espera <= 0:
+                        # Libera só esta chamada como teste; as demais esperam o resultado
+                        self.estado = self.MEIO_ABERTO
+                        return True
+                self._cond.wait(espera)
+
+    def registrar_sucesso(self):
+        with self._cond:
+            self.falhas_seguidas = 0
+            self.disparos_seguidos = 0
+            if self.estado != self.FECHADO:
+                self.estado = self.FECHADO
+                self._cond.notify_all()
+
+    def registrar_falha(self):
+        """Retorna True se esta falha disparou (abriu) o disjuntor."""
+        with self._cond:
+            self.falhas_seguidas += 1
+            disparar = (self.estado == self.MEIO_ABERTO
+                        or (self.estado == self.FECHADO and self.falhas_seguidas >= self.limite_falhas))
+            if not disparar:
+                return False
+            self.disparos += 1
+            self.disparos_seguidos += 1
+            pausa = min(self.tempo_pausa_maximo, self.tempo_pausa * 2 ** (self.disparos_seguidos - 1))
+            self.tempo_pausa_total += pausa
+            self.reabre_em = time.monotonic() + pausa
+            self.estado = self.ABERTO
+            self.falhas_seguidas = 0
+            self._cond.notify_all()
+            return True
+
+    def stats(self):
+        return {
+            "estado": self.estado,
+            "disparos": self.disparos,
+            "tempo_pausa_total": self.tempo_pausa_total,
+            "chamadas_recusadas": self.chamadas_recusadas,
+        }
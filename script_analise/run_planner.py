@@ -0,0 +1,137 @@
+# coding: utf-8
+import csv
+import os
+from collections import defaultdict
+
+from cost_tracker import custo_chamada
+from rate_limiter import estimar_tokens
+
+# Suposições usadas quando não há uma execução anterior para calibrar o plano:
+# tokens de saída por competência avaliada e latência por chamada em cada modo
+SUPOSICOES_PADRAO = {"tokens_saida_por_competencia": 400,
+                     "latencia_s": {"por_competencia": 4.0, "completo": 12.0}}
+
+
+def modo_do_prompt(nome_prompt):
+    """Modo de avaliação que gerou uma linha do CSV, pelo nome do prompt (completo_*.txt ou cN_*.txt)."""
+    return "completo" if str(nome_prompt).startswith("completo") else "por_competencia"
+
+
+def calibrar(caminho_csv):
+    """
+    Médias reais de uma execução anterior (CSV de resultados com as colunas de uso):
+    {(modelo, modo): {"tokens_saida_por_competencia": ..., "latencia_s": ...}}.
+    Retorna {} se o arquivo não existe ou não tem as colunas.
+    """
+    if not caminho_csv or not os.path.exists(caminho_csv):
+        return {}
+    somas = defaultdict(lambda: [0.0, 0, 0.0, 0])
+    try:
+        with open(caminho_csv, 'r', encoding='utf-8-sig', newline='') as f:
+            for linha in csv.DictReader(f):
+                if not linha.get("tokens_saida") or not linha.get("latencia_s"):
+                    continue
+                soma = somas[(linha["modelo"], modo_do_prompt(linha.get("prompt")))]
+                soma[0] += float(linha["tokens_saida"])
+                soma[1] += 1
+                soma[2] += float(linha["latencia_s"])
+                soma[3] += 1
+    except Exception as e:
+        print(f"[Planejador AVISO] Não foi possível calibrar o plano com '{caminho_csv}': {e}")
+        return {}
+    # No modo "completo" a latência da chamada se repete nas 5 linhas: a média por linha é a média por chamada
+    return {chave: {"tokens_saida_por_competencia": tokens / n_tokens, "latencia_s": latencia / n_latencia}
+            for chave, (tokens, n_tokens, latencia, n_latencia) in somas.items() if n_tokens}
+
+
+def planejar_provedor(provedor, textos, prompts, modo, precos, calibracao=None, modo_async=True,
+                      suposicoes=None, reserva_saida_por_competencia=800):
+    """
+    Estimativa de UM provedor para a amostra, sem nenhuma chamada:
+      - chamadas e tokens de entrada (contados localmente em cada prompt e redação);
+      - tokens de saída e latência por chamada (da calibração, se houver, ou das suposições);
+      - custo (PRECOS_POR_MILHAO) e tempo de parede.
+    O tempo é o maior entre o que o RPM, o TPM e a concorrência permitem. O TPM conta a
+    reserva de saída que o limitador de taxa faz antes de cada chamada
+    ('reserva_saida_por_competencia'), não a saída esperada.
+    'provedor' é um dict com modelo, concorrencia, rpm, tpm e, opcional, n_candidatos
+    (amostras por chamada, self-consistency); 'prompts' mapeia comp_id
+    (None no modo "completo") -> texto do prompt.
+    """
+    modelo = provedor["modelo"]
+    blocos = 5 if modo == "completo" else 1
+    suposicoes = suposicoes or SUPOSICOES_PADRAO
+    calibrado = (calibracao or {}).get((modelo, modo)) or {}
+    amostras = provedor.get("n_candidatos", 1)
+    # A calibração já traz a saída real da chamada (todas as amostras); a suposição é por amostra
+    tokens_saida_bloco = calibrado.get("tokens_saida_por_competencia",
+                                       suposicoes["tokens_saida_por_competencia"] * amostras)
+    latencia = calibrado.get("latencia_s", suposicoes["latencia_s"][modo])
+
+    tokens_redacoes = sum(estimar_tokens(texto) for texto in textos)
+    chamadas = len(textos) * len(prompts)
+    tokens_entrada = sum(len(textos) * estimar_tokens(texto_prompt) + tokens_redacoes for texto_prompt in prompts.values())
+    tokens_saida = chamadas * blocos * tokens_saida_bloco
+    custo = custo_chamada(precos, modelo, {"tokens_entrada": tokens_entrada, "tokens_saida": tokens_saida})
+
+    tempos = {"concorrencia": chamadas * latencia / (provedor["concorrencia"] if modo_async else 1)}
+    if provedor.get("rpm"):
+        tempos["rpm"] = 60.0 * chamadas / provedor["rpm"]
+    if provedor.get("tpm"):
+        tempos["tpm"] = (60.0 * (tokens_entrada + chamadas * blocos * amostras * reserva_saida_por_competencia)
+                         / provedor["tpm"])
+    gargalo = max(tempos, key=tempos.get)
+    return {
+        "modelo": modelo,
+        "modo": modo,
+        "chamadas": chamadas,
+        "tokens_entrada": tokens_entrada,
+        "tokens_saida": tokens_saida,
+        "custo_usd": custo,
+        "tempo_s": tempos[gargalo],
+        "gargalo": gargalo,
+        "calibrado": bool(calibrado),
+        "latencia_s": latencia,
+    }
+
+
+def planejar(provedores, textos, prompts, modo, precos, calibracao=None, modo_async=True,
+             suposicoes=None, reserva_saida_por_competencia=800):
+    """
+    Plano da execução inteira num modo de avaliação. No modo async os provedores rodam
+    em paralelo (o tempo total é o do mais lento); no sequencial, um depois do outro.
+    """
+    por_provedor = [planejar_provedor(provedor, textos, prompts, modo, precos, calibracao, modo_async,
+                                      suposicoes, reserva_saida_por_competencia)
+                    for provedor in provedores]
+    tempos = [plano["tempo_s"] for plano in por_provedor]
+    return {
+        "modo": modo,
+        "modo_async": modo_async,
+        "n_redacoes": len(textos),
+        "chamadas": sum(plano["chamadas"] for plano in por_provedor),
+        "tokens_entrada": sum(plano["tokens_entrada"] for plano in por_provedor),
+        "tokens_saida": sum(plano["tokens_saida"] for plano in por_provedor),
+        "custo_usd": sum(plano["custo_usd"] for plano in por_provedor),
+        "tempo_s": (max(tempos) if modo_async else sum(tempos)) if tempos else 0.0,
+        "por_provedor": por_provedor,
+    }
+
+
+def formatar_duracao(segundos):
+    if segundos < 120:
+        return f"{segundos:.0f}s"
+    if segundos < 7200:
+        return f"{segundos / 60:.1f}min"
+    return f"{segundos / 3600:.1f}h"
+
+
+def exibir_plano(plano):
+    print(f"\nModo {plano['modo']} ({'async' if plano['modo_async'] else 'sequencial'}): "
+          f"{plano['chamadas']} chamadas | {plano['tokens_entrada']:,.0f} tokens de entrada "
+          f"| {plano['tokens_saida']:,.0f} de saída | ~{formatar_duracao(plano['tempo_s'])} | ${plano['custo_usd']:.4f}")
+    for p in plano["por_provedor"]:
+        origem = "calibrado" if p["calibrado"] else "suposição"
+        print(f"  {p['modelo']}: {p['chamadas']} chamadas | entrada {p['tokens_entrada']:,.0f} "
+              f"| saída {p['tokens_saida']:,.0f} | ${p['custo_usd']:.4f} | ~{formatar_duracao(p['tempo_s'])} "
+              f"(limitado por {p['gargalo']}; latência {p['latencia_s']:.1f}s/chamada, {origem})")
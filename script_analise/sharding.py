@@ -0,0 +1,65 @@
+# coding: utf-8
+import hashlib
+import os
+import re
+
+# Nome do arquivo de resultados de um shard: evaluation_results.shard-0-de-4.csv
+PADRAO_ARQUIVO_SHARD = re.compile(r"\.shard-(\d+)-de-(\d+)(\.[^.]+)?$")
+
+
+def parse_shard(texto):
+    """
+    Converte "i/N" em (i, N), com 0 <= i < N.
+    Levanta ValueError se o formato ou os números forem inválidos.
+    """
+    partes = str(texto).split("/")
+    if len(partes) != 2:
+        raise ValueError(f"Shard inválido: '{texto}' (use i/N, ex: 0/4)")
+    indice, n_shards = int(partes[0]), int(partes[1])
+    if n_shards < 1 or not 0 <= indice < n_shards:
+        raise ValueError(f"Shard inválido: '{texto}' (precisa de 0 <= i < N)")
+    return indice, n_shards
+
+
+def hash_estavel(texto, sal=""):
+    """
+    Hash de 64 bits do texto, igual em qualquer processo ou máquina
+    (o hash() do Python muda a cada processo por causa do PYTHONHASHSEED).
+    """
+    return int.from_bytes(hashlib.sha256((sal + str(texto)).encode("utf-8")).digest()[:8], "big")
+
+
+def shard_da_redacao(redacao_id, n_shards):
+    """Shard (0 a N-1) de uma redação, pelo hash estável do seu ID (a URL)."""
+    return hash_estavel(redacao_id) % n_shards
+
+
+def nome_arquivo_shard(caminho, shard):
+    """evaluation_results.csv -> evaluation_results.shard-i-de-N.csv"""
+    base, extensao = os.path.splitext(caminho)
+    return f"{base}.shard-{shard[0]}-de-{shard[1]}{extensao}"
+
+
+def shard_do_arquivo(caminho):
+    """(i, N) pelo nome de um arquivo de shard, ou None se o nome não segue o padrão."""
+    encontrado = PADRAO_ARQUIVO_SHARD.search(os.path.basename(caminho))
+    if not encontrado:
+        return None
+    return int(encontrado.group(1)), int(encontrado.group(2))
+
+
+def shards_faltando(caminhos):
+    """
+    Confere, pelos nomes dos arquivos, se todos os shards de uma divisão estão presentes.
+    Retorna (N, lista de índices faltando), ou (None, []) se os nomes não indicam shards.
+    Levanta ValueError se os arquivos vêm de divisões diferentes (ex: de 4 e de 8).
+    """
+    shards = [shard for shard in map(shard_do_arquivo, caminhos) if shard is not None]
+    divisoes = {n_shards for _, n_shards in shards}
+    if not divisoes:
+        return None, []
+    if len(divisoes) > 1:
+        raise ValueError(f"Arquivos de divisões diferentes em shards: {sorted(divisoes)}")
+    n_shards = divisoes.pop()
+    presentes = {indice for indice, _ in shards}
+    return n_shards, [indice for indice in range(n_shards) if indice not in presentes]
@@ -0,0 +1,6 @@
+# coding: utf-8
+import os
+import sys
+
+# Os módulos do script_analise são importados pelo nome (ex: import metrics), como no main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,19 @@
+# coding: utf-8
+import pytest
+
+from llm_provider import agregar_notas, ajustar_nota
+
+
+def test_ajustar_nota_vai_para_a_nota_valida_mais_proxima():
+    assert ajustar_nota(150) == 160
+    assert ajustar_nota(100) == 80  # empate: a menor
+    assert ajustar_nota("200") == 200
+
+
+def test_agregar_notas_maioria_e_mediana():
+    assert agregar_notas([120, 160, 160, 200]) == 160
+    # Empate: a empatada mais próxima da mediana dos votos
+    assert agregar_notas([40, 40, 200, 200, 160]) == 200
+    assert agregar_notas([0, 40, 200], "mediana") == 40
+    with pytest.raises(ValueError):
+        agregar_notas([160], "media")
@@ -0,0 +1,32 @@
+# coding: utf-8
+from data_loader import alocar_amostra, faixa_nota
+
+
+def test_faixa_nota():
+    assert faixa_nota(0) == "0-399"
+    assert faixa_nota(399) == "0-399"
+    assert faixa_nota(400) == "400-599"
+    assert faixa_nota(799) == "600-799"
+    assert faixa_nota(1000) == "800-1000"
+
+
+def test_alocar_amostra_proporcional():
+    assert alocar_amostra([50, 30, 20], 10) == [5, 3, 2]
+    assert sum(alocar_amostra([7, 5, 3], 8)) == 8
+
+
+def test_alocar_amostra_minimo_de_um_e_teto_do_estrato():
+    # Estrato pequeno ganha ao menos 1 quando n dá para todos
+    alocacao = alocar_amostra([1000, 2], 10)
+    assert alocacao[1] >= 1 and sum(alocacao) == 10
+    # Nenhum estrato recebe mais do que tem; o que não cabe fica de fora
+    assert alocar_amostra([2, 3], 10) == [2, 3]
+    # n menor que o número de estratos: sem o mínimo de 1
+    assert sum(alocar_amostra([10, 10, 10], 2)) == 2
+
+
+def test_alocar_amostra_neyman_favorece_o_estrato_que_varia_mais():
+    # 1 para cada estrato e as 8 restantes na proporção 1:4 (N_h * S_h)
+    assert alocar_amostra([100, 100], 10, desvios=[10.0, 40.0]) == [3, 7]
+    # Sem variação em nenhum estrato, volta ao proporcional
+    assert alocar_amostra([30, 10], 4, desvios=[0.0, 0.0]) == [3, 1]
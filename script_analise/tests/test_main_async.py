@@ -0,0 +1,72 @@
+# coding: utf-8
+import os
+import threading
+import time
+
+import pytest
+
+import main
+from llm_provider import MockProvider
+from result_journal import ResultJournal
+from result_sink import TabelaNotas
+
+
+class MockContaConcorrencia(MockProvider):
+    """MockProvider que registra o pico de chamadas simultâneas."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock_em_voo = threading.Lock()
+        self.em_voo = 0
+        self.pico = 0
+
+    def _request_correction(self, system_prompt, redacao_texto, schema):
+        with self._lock_em_voo:
+            self.em_voo += 1
+            self.pico = max(self.pico, self.em_voo)
+        try:
+            time.sleep(0.02)
+            return super()._request_correction(system_prompt, redacao_texto, schema)
+        finally:
+            with self._lock_em_voo:
+                self.em_voo -= 1
+
+
+def _redacao(redacao_id):
+    return {"input": {"id": redacao_id, "texto": f"texto da redação {redacao_id}"},
+            "ground_truth": {"competencias": {c: {"nota": 120} for c in range(1, 6)}}}
+
+
+@pytest.fixture(autouse=True)
+def _prompts_do_repositorio(monkeypatch):
+    monkeypatch.setattr(main, "DIRETORIO_PROMPTS",
+                        os.path.join(os.path.dirname(os.path.abspath(main.__file__)), "prompts"))
+    monkeypatch.setattr(main, "_registro_prompts", None)
+    main.iniciar_custos()
+
+
+def test_executar_async_respeita_o_limite_de_cada_provedor_e_grava_tudo():
+    lento = MockContaConcorrencia("lento", max_concurrency=2)
+    rapido = MockContaConcorrencia("rapido", max_concurrency=5)
+    amostra = [_redacao(f"r{i}") for i in range(6)]
+    tabela = TabelaNotas()
+
+    total = main.executar_async(amostra, [lento, rapido], "por_competencia", sink=tabela)
+
+    # 6 redações x 2 modelos x 5 competências, todas no sink
+    assert total == len(tabela) == 60
+    assert set(tabela.modelos) == {"lento", "rapido"}
+    assert set(tabela.redacao_ids) == {f"r{i}" for i in range(6)}
+    # Cada provedor fica no seu semáforo, e o mais rápido não é limitado pelo outro
+    assert lento.pico == 2
+    assert 2 < rapido.pico <= 5
+
+
+def test_executar_async_pula_o_que_ja_esta_no_diario():
+    modelo = MockProvider("mock")
+    amostra = [_redacao("r1"), _redacao("r2")]
+    concluidas = {ResultJournal.chave({"redacao_id": "r1", "modelo": "mock", "competencia": f"C{c}"})
+                  for c in range(1, 6)}
+    tabela = TabelaNotas()
+
+    assert main.executar_async(amostra, [modelo], "por_competencia", sink=tabela, concluidas=concluidas) == 5
+    assert tabela.redacao_ids == ["r2"]
@@ -0,0 +1,30 @@
+# coding: utf-8
+import numpy as np
+
+from metrics import bootstrap_ic, calculate_pearson, calculate_qwk
+
+
+def test_bootstrap_ic_contem_a_estimativa_e_e_reprodutivel():
+    rng = np.random.default_rng(1)
+    humano = rng.choice([0, 40, 80, 120, 160, 200], size=200)
+    llm = np.clip(humano + rng.choice([-40, 0, 0, 40], size=200), 0, 200)
+
+    estimativa, inferior, superior = bootstrap_ic(humano, llm, calculate_qwk, n_reamostras=200)
+    assert estimativa == calculate_qwk(humano, llm)
+    assert inferior <= estimativa <= superior
+    assert bootstrap_ic(humano, llm, calculate_qwk, n_reamostras=200) == (estimativa, inferior, superior)
+
+
+def test_bootstrap_ic_por_grupos_e_metrica_com_tupla():
+    humano = [40, 80, 120, 160, 200] * 8
+    llm = [40, 120, 120, 160, 160] * 8
+    grupos = np.repeat(np.arange(8), 5)
+    ic = bootstrap_ic(humano, llm, calculate_pearson, grupos, n_reamostras=100)
+    assert ic is not None
+    # calculate_pearson devolve (r, p): o IC é do r
+    assert ic[0] == calculate_pearson(humano, llm)[0]
+
+
+def test_bootstrap_ic_sem_dados_suficientes():
+    assert bootstrap_ic([120], [120], calculate_qwk) is None
+    assert bootstrap_ic([120, 160], [120, 160], calculate_qwk, grupos=[0, 0]) is None
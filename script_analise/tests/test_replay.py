@@ -0,0 +1,47 @@
+# coding: utf-8
+import csv
+
+from llm_provider import SCHEMA_COMPLETO, ReplayProvider
+from response_cache import hash_texto
+
+
+def _gravar_csv(caminho, linhas, com_prompt_hash=True):
+    colunas = ["redacao_id", "modelo", "prompt", "competencia", "nota_humano", "nota_llm", "diferenca",
+               "raciocinio_cot", "justificativa_aluno"] + (["prompt_hash"] if com_prompt_hash else [])
+    with open(caminho, "w", encoding="utf-8", newline="") as f:
+        escritor = csv.DictWriter(f, fieldnames=colunas)
+        escritor.writeheader()
+        for linha in linhas:
+            escritor.writerow({coluna: linha.get(coluna, "") for coluna in colunas})
+
+
+def _linha(comp, nota, prompt_hash=""):
+    return {"redacao_id": "r1", "modelo": "gravado", "prompt": f"c{comp}_zero_shot.txt", "competencia": f"C{comp}",
+            "nota_humano": 120, "nota_llm": nota, "diferenca": nota - 120, "raciocinio_cot": f"cot {comp}",
+            "justificativa_aluno": f"just {comp}", "prompt_hash": prompt_hash}
+
+
+def test_replay_separa_competencias_com_o_mesmo_prompt(tmp_path):
+    # c3 e c4 com o mesmo texto de prompt: o hash é igual, a competência desempata
+    prompt = "rubrica igual"
+    caminho = str(tmp_path / "gravacao.csv")
+    _gravar_csv(caminho, [_linha(3, 80, hash_texto(prompt)), _linha(4, 200, hash_texto(prompt))])
+    replay = ReplayProvider(caminho, {"r1": "texto da redação"})
+
+    assert replay.get_correction(prompt, "texto da redação", competencia=3)["nota_atribuida"] == 80
+    assert replay.get_correction(prompt, "texto da redação", competencia=4)["nota_atribuida"] == 200
+    # Outro prompt ou outra redação: sem resposta gravada
+    assert replay.get_correction("outro prompt", "texto da redação", competencia=3) is None
+    assert replay.get_correction(prompt, "outra redação", competencia=3) is None
+
+
+def test_replay_aceita_csv_sem_prompt_hash(tmp_path):
+    caminho = str(tmp_path / "evaluation_results.csv")
+    _gravar_csv(caminho, [_linha(c, 40 * c) for c in range(1, 6)], com_prompt_hash=False)
+    replay = ReplayProvider(caminho, {"r1": "texto da redação"})
+
+    resposta = replay.get_correction("qualquer prompt", "texto da redação", competencia=2)
+    assert resposta["nota_atribuida"] == 80
+    assert resposta["justificativa_para_aluno"] == "just 2"
+    completo = replay.get_correction("qualquer prompt", "texto da redação", SCHEMA_COMPLETO)
+    assert [completo[f"c{c}"]["nota_atribuida"] for c in range(1, 6)] == [40, 80, 120, 160, 200]
@@ -0,0 +1,21 @@
+# coding: utf-8
+import os
+
+from result_journal import ResultJournal
+
+
+def test_retomar_execucao_inexistente_nao_cria_a_pasta(tmp_path):
+    journal = ResultJournal(str(tmp_path), "20250101-000000", retomar=True)
+    assert not journal.existe()
+    assert not os.path.exists(journal.diretorio)
+
+
+def test_retomar_execucao_existente(tmp_path):
+    nova = ResultJournal(str(tmp_path), "r1")
+    nova.salvar_manifesto({"redacao_ids": ["a"]})
+    nova.append([{"redacao_id": "a", "modelo": "mock", "competencia": "C1", "nota_llm": 120}])
+
+    retomada = ResultJournal(str(tmp_path), "r1", retomar=True)
+    assert retomada.existe()
+    assert retomada.carregar_manifesto() == {"redacao_ids": ["a"]}
+    assert retomada.chaves_concluidas() == {("a", "mock", "C1")}
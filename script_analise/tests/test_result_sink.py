@@ -0,0 +1,38 @@
+# coding: utf-8
+import pytest
+
+from result_sink import CsvSink, ParquetSink, ler_resultados, pa
+
+
+def _linhas():
+    # A primeira linha não tem as colunas opcionais; a segunda (ex: escalada na cascata) tem
+    return [{"redacao_id": "r1", "nota_llm": 120},
+            {"redacao_id": "r2", "nota_llm": 160, "concordancia": 0.6, "modelo_cascata": "forte"}]
+
+
+def test_csv_guarda_colunas_opcionais_de_linhas_posteriores(tmp_path):
+    caminho = str(tmp_path / "resultados.csv")
+    sink = CsvSink(caminho)
+    primeira, segunda = _linhas()
+    sink.write([primeira])
+    sink.write([segunda])
+    sink.close()
+
+    lidas = list(ler_resultados(caminho))
+    assert lidas[0]["concordancia"] is None and lidas[0]["modelo_cascata"] is None
+    assert lidas[1]["concordancia"] == 0.6
+    assert lidas[1]["modelo_cascata"] == "forte"
+
+
+@pytest.mark.skipif(pa is None, reason="pyarrow não instalado")
+def test_parquet_guarda_colunas_opcionais_de_row_groups_posteriores(tmp_path):
+    caminho = str(tmp_path / "resultados.parquet")
+    sink = ParquetSink(caminho, tamanho_row_group=1)
+    for linha in _linhas():
+        sink.write([linha])
+    sink.close()
+
+    lidas = list(ler_resultados(caminho))
+    assert lidas[0]["concordancia"] is None
+    assert lidas[1]["concordancia"] == 0.6
+    assert lidas[1]["modelo_cascata"] == "forte"
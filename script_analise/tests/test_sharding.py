@@ -0,0 +1,52 @@
+# coding: utf-8
+import pytest
+
+import main
+from result_sink import ler_resultados
+from sharding import nome_arquivo_shard, parse_shard, shard_da_redacao, shard_do_arquivo, shards_faltando
+
+
+def test_shard_da_redacao_estavel_e_no_intervalo():
+    ids = [f"https://ex.com/{i}" for i in range(200)]
+    shards = [shard_da_redacao(redacao_id, 4) for redacao_id in ids]
+    assert all(0 <= shard < 4 for shard in shards)
+    assert set(shards) == {0, 1, 2, 3}
+    # O mesmo ID cai sempre no mesmo shard (hash estável, não o hash() do Python)
+    assert shards == [shard_da_redacao(redacao_id, 4) for redacao_id in ids]
+
+
+def test_parse_shard_e_nomes_de_arquivo():
+    assert parse_shard("1/4") == (1, 4)
+    for invalido in ("4/4", "1", "-1/3", "a/b"):
+        with pytest.raises(ValueError):
+            parse_shard(invalido)
+    caminho = nome_arquivo_shard("saida/evaluation_results.csv", (2, 8))
+    assert caminho == "saida/evaluation_results.shard-2-de-8.csv"
+    assert shard_do_arquivo(caminho) == (2, 8)
+    assert shards_faltando(["a.shard-0-de-3.csv", "a.shard-2-de-3.csv"]) == (3, [1])
+    with pytest.raises(ValueError):
+        shards_faltando(["a.shard-0-de-2.csv", "a.shard-1-de-4.csv"])
+
+
+def _linha(redacao_id, comp, nota):
+    return {"redacao_id": redacao_id, "modelo": "mock", "prompt": f"c{comp}_zero_shot.txt",
+            "competencia": f"C{comp}", "nota_humano": 120, "nota_llm": nota, "diferenca": nota - 120,
+            "raciocinio_cot": "cot", "justificativa_aluno": "just"}
+
+
+def test_mesclar_shards_junta_sem_repetir(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "FORMATOS_SAIDA", ["csv"])
+    arquivos = []
+    for indice, redacoes in enumerate([["r1", "r2"], ["r2", "r3"]]):
+        caminho = str(tmp_path / nome_arquivo_shard("evaluation_results.csv", (indice, 2)))
+        sink = main.abrir_saidas(caminho)[0]
+        sink.write([_linha(redacao_id, comp, 40 * comp) for redacao_id in redacoes for comp in range(1, 6)])
+        sink.close()
+        arquivos.append(caminho)
+
+    saida = str(tmp_path / "mesclado.csv")
+    main.mesclar_shards(arquivos, saida)
+    linhas = list(ler_resultados(saida))
+    # r2 está nos dois shards: entra uma vez só
+    assert len(linhas) == 15
+    assert {linha["redacao_id"] for linha in linhas} == {"r1", "r2", "r3"}
@@ -0,0 +1,54 @@
+# coding: utf-8
+from llm_provider import (SCHEMA_COMPETENCIA, SCHEMA_COMPLETO, CascadeProvider, ExtratorNotas, HedgedProvider,
+                          MockProvider)
+
+
+def _receber_em_pedacos(extrator, texto, tamanho=3):
+    for inicio in range(0, len(texto), tamanho):
+        extrator.receber(texto[inicio:inicio + tamanho])
+
+
+def test_extrator_entrega_a_nota_antes_do_resto():
+    notas = []
+    extrator = ExtratorNotas(SCHEMA_COMPETENCIA, lambda bloco, nota: notas.append((bloco, nota)))
+    _receber_em_pedacos(extrator, '{"nota_atribuida": 160, "raciocinio_cot": "')
+    assert notas == [(None, 160)]
+    # Uma nota citada dentro de um texto não é confundida com o campo
+    _receber_em_pedacos(extrator, 'o \\"nota_atribuida\\": 40 seria injusto", "justificativa_para_aluno": "ok"}')
+    assert notas == [(None, 160)]
+
+
+def test_extrator_no_modo_completo_e_no_fim():
+    notas = {}
+    extrator = ExtratorNotas(SCHEMA_COMPLETO, lambda bloco, nota: notas.__setitem__(bloco, nota))
+    _receber_em_pedacos(extrator, '{"c1": {"nota_atribuida": 120, "raciocinio_cot": "x"}, "c2": {"nota_atribuida": 80')
+    assert notas == {"c1": 120}
+    # O que não saiu no streaming é entregue a partir da resposta final
+    extrator.completar({f"c{c}": {"nota_atribuida": 200} for c in range(2, 6)})
+    assert notas == {"c1": 120, "c2": 200, "c3": 200, "c4": 200, "c5": 200}
+    assert extrator.tempo_primeira_nota() is not None
+
+
+def test_cascata_repassa_a_nota_em_streaming_e_a_substitui_ao_subir():
+    # A primeira etapa dá uma nota fora dos níveis (fronteira): a cascata sobe para a segunda
+    barato = MockProvider("barato", latencia="constante", latencia_media=0.2, politica_nota="constante",
+                          nota_fixa=150)
+    forte = MockProvider("forte", latencia="constante", latencia_media=0.2, politica_nota="constante", nota_fixa=120)
+    cascata = CascadeProvider([barato, forte])
+    notas = []
+    resposta = cascata.get_correction_stream("prompt", "texto", ao_receber_nota=lambda bloco, nota: notas.append(nota),
+                                             competencia=1)
+    assert notas == [150, 120]
+    assert resposta["nota_atribuida"] == 120
+    # O tempo até a nota é o da nota que valeu, antes do fim da resposta do modelo forte
+    assert 0.2 < resposta["_uso"]["tempo_ate_nota_s"] < resposta["_uso"]["latencia_s"]
+
+
+def test_hedge_repassa_a_nota_em_streaming():
+    hedge = HedgedProvider(MockProvider("mock", latencia="constante", latencia_media=0.2))
+    notas = []
+    resposta = hedge.get_correction_stream("prompt", "texto", ao_receber_nota=lambda bloco, nota: notas.append(nota),
+                                           competencia=1)
+    hedge.close()
+    assert notas == [resposta["nota_atribuida"]]
+    assert resposta["_uso"]["tempo_ate_nota_s"] < resposta["_uso"]["latencia_s"] / 2
@@ -0,0 +1,113 @@
+# coding: utf-8
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Atributos herdados pelos spans abertos dentro de outro (redacao_id, modelo, competencia...).
+# contextvars: cada tarefa async e cada asyncio.to_thread leva a sua cópia.
+_atributos = contextvars.ContextVar("atributos_trace", default={})
+
+
+class TraceWriter:
+    """
+    Grava spans no Trace Event Format (o JSON do chrome://tracing, aberto também
+    pelo Perfetto em https://ui.perfetto.dev): um evento "X" por span, com início e
+    duração em microssegundos, thread e atributos em "args".
+    Os eventos são gravados à medida que os spans terminam (formato JSON Array, que
+    os visualizadores aceitam mesmo sem o "]" final, ex: se a execução cair).
+    """
+    def __init__(self, caminho, nome_processo="corretor-redacoes-enem"):
+        self.caminho = caminho
+        self._arquivo = open(caminho, 'w', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._origem = time.perf_counter()
+        self._threads = set()
+        self.n_spans = 0
+        self._arquivo.write("[\n")
+        self._evento({"name": "process_name", "ph": "M", "pid": self._pid, "tid": 0,
+                      "args": {"name": nome_processo}})
+
+    def _evento(self, evento):
+        self._arquivo.write(json.dumps(evento, ensure_ascii=False, default=str) + ",\n")
+
+    def registrar(self, nome, inicio, duracao, atributos):
+        tid = threading.get_native_id()
+        with self._lock:
+            if tid not in self._threads:
+                # Nome da thread (MainThread, asyncio_0...) nas faixas do visualizador
+                self._threads.add(tid)
+                self._evento({"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid,
+                              "args": {"name": threading.current_thread().name}})
+            self._evento({"name": nome, "ph": "X", "pid": self._pid, "tid": tid,
+                          "ts": round((inicio - self._origem) * 1e6, 1), "dur": round(duracao * 1e6, 1),
+                          "args": atributos})
+            self.n_spans += 1
+
+    def close(self):
+        with self._lock:
+            # Último evento sem vírgula: o arquivo fecha como um JSON válido
+            self._arquivo.write(json.dumps({"name": "trace_fim", "ph": "M", "pid": self._pid, "tid": 0,
+                                            "args": {"spans": self.n_spans}}) + "\n]\n")
+            self._arquivo.close()
+
+
+@contextmanager
+def _span(writer, nome, atributos):
+    herdados = _atributos.get()
+    if atributos:
+        herdados = {**herdados, **atributos}
+        token = _atributos.set(herdados)
+    inicio = time.perf_counter()
+    erro = None
+    try:
+        yield
+    except BaseException as e:
+        erro = type(e).__name__
+        raise
+    finally:
+        duracao = time.perf_counter() - inicio
+        if atributos:
+            _atributos.reset(token)
+        writer.registrar(nome, inicio, duracao, herdados if erro is None else dict(herdados, erro=erro))
+
+
+# Trace ativo do processo (None = tracing desligado, custo ~zero)
+_writer = None
+
+
+def ativar(caminho):
+    """Liga o tracing, gravando os spans em 'caminho'. Devolve o TraceWriter."""
+    global _writer
+    _writer = TraceWriter(caminho)
+    return _writer
+
+
+def desativar():
+    """Desliga o tracing e fecha o arquivo. Devolve o caminho gravado (ou None se estava desligado)."""
+    global _writer
+    writer, _writer = _writer, None
+    if writer is None:
+        return None
+    writer.close()
+    print(f"[OK] Trace com {writer.n_spans} spans salvo em '{writer.caminho}' "
+          f"(abra em https://ui.perfetto.dev ou chrome://tracing)")
+    return writer.caminho
+
+
+def ativo():
+    return _writer
+
+
+def span(nome, **atributos):
+    """
+    Context manager que grava um span 'nome' com os atributos dados e os herdados dos
+    spans em volta. Os atributos passados aqui valem também para os spans internos.
+    Não faz nada com o tracing desligado.
+    """
+    if _writer is None:
+        return nullcontext()
+    return _span(_writer, nome, atributos)